@@ -2,8 +2,15 @@ import numpy as np
 import os
 import matplotlib.pyplot as plt
 import json
-from ..utils.FCC import create_rgb_image
-from ..utils.analyseSAM import compare_pixel_to_library
+import sys
+
+# Make the repository root importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.FCC import create_rgb_image
+from utils.analyseSAM import compare_pixel_to_library
+from utils.cubeIO import load_cube
+from utils.spectralLib import load_library
 
 class SAMComparisonTool:
     def __init__(self, image_data, metadata, library_path='data/spectral_library.json'):
@@ -45,8 +52,7 @@ class SAMComparisonTool:
         """
         try:
             if self.library_path and os.path.exists(self.library_path):
-                with open(self.library_path, 'r') as f:
-                    return json.load(f)
+                return load_library(self.library_path)
         except Exception as e:
             print(f"Error loading library: {e}")
         return {}
@@ -142,7 +148,7 @@ class SAMComparisonTool:
 # Example usage
 if __name__ == "__main__":
     # Load the hyperspectral data cube and metadata
-    image_data = np.load('data/Salinas_corrected.npy')
+    image_data = load_cube('data/Salinas_corrected.npy')
     with open('data/metadata.json', 'r') as f:
         metadata = json.load(f)
 
@@ -2,9 +2,16 @@ import numpy as np
 import json
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button, TextBox
-from ..utils.FCC import create_rgb_image
-from ..utils.pixelSpectrum import get_pixel_spectrum
-from ..utils.spectralLib import save_entry_to_library, view_library
+import os
+import sys
+
+# Make the repository root importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.FCC import create_rgb_image
+from utils.pixelSpectrum import get_pixel_spectrum
+from utils.spectralLib import save_entry_to_library, view_library
+from utils.cubeIO import load_cube
 
 class SpectralLibraryCreationTool:
     def __init__(self, image_data, metadata, library_path='data/spectral_library.json'):
@@ -155,7 +162,7 @@ class SpectralLibraryCreationTool:
 # Example usage script remains the same
 def main():
     # Load the hyperspectral data cube
-    image_data = np.load('data/Salinas_corrected.npy')
+    image_data = load_cube('data/Salinas_corrected.npy')
     library_path = 'data/spectral_library.json'
 
     # Load the metadata
@@ -2,8 +2,15 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import json
-from ..utils.FCC import create_rgb_image
-from ..utils.canvasHandler import CanvasHandler
+import os
+import sys
+
+# Make the repository root importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.FCC import create_rgb_image
+from utils.canvasHandler import CanvasHandler
+from utils.cubeIO import load_cube
 
 class SpectralVisualizationTool:
     def __init__(self, image_data, metadata, max_pixels=10):
@@ -30,7 +37,7 @@ class SpectralVisualizationTool:
 # Example usage script
 def main():
     # Load the hyperspectral data cube
-    image_data = np.load('data/Salinas_corrected.npy')
+    image_data = load_cube('data/Salinas_corrected.npy')
 
     # Load the metadata
     with open('data/metadata.json', 'r') as f:
@@ -1,11 +1,16 @@
+import time
+# Reference point for the startup-time measurement
+_PROCESS_START = time.perf_counter()
+
 import sys
 import os
 import numpy as np
 import json
 from PyQt5.QtWidgets import (QMainWindow, QApplication, QVBoxLayout, QHBoxLayout, 
                              QWidget, QPushButton, QFileDialog, QLabel, QMessageBox)
-from PyQt5.QtCore import Qt
-from spectralToolsQT import SpectralAnalysisTool
+from PyQt5.QtCore import Qt, QTimer
+from utils.cubeIO import load_cube, load_envi
+from utils.spectralMetadata import as_metadata
 
 class DataInputWidget(QWidget):
     def __init__(self, parent=None):
@@ -14,7 +19,7 @@ class DataInputWidget(QWidget):
         
         # Image Data Input
         self.image_label = QLabel("Hyperspectral Image: Not Selected")
-        self.image_button = QPushButton("Select Hyperspectral Image (.npy)")
+        self.image_button = QPushButton("Select Hyperspectral Image (.npy / ENVI .hdr)")
         self.image_button.clicked.connect(self.select_image)
         
         # Metadata Input
@@ -24,7 +29,7 @@ class DataInputWidget(QWidget):
 
         # Spectral Library Input
         self.spectral_library_label = QLabel("Spectral Library: Not Selected")
-        self.spectral_library_button = QPushButton("Select Spectral Library (.json)")
+        self.spectral_library_button = QPushButton("Select Spectral Library (.json / .slib)")
         self.spectral_library_button.clicked.connect(self.select_spectral_library)
         
         # Add widgets to layout
@@ -42,13 +47,30 @@ class DataInputWidget(QWidget):
         self.image_data = None
         self.metadata = None
         self.spectral_library = None
+        # True while the metadata came from the selected image's ENVI header
+        self.metadata_from_header = False
     
     def select_image(self):
         filepath, _ = QFileDialog.getOpenFileName(self, "Select Hyperspectral Image", 
-                                                  "", "NumPy Files (*.npy)")
+                                                  "", "NumPy Files (*.npy);;ENVI Header (*.hdr)")
         if filepath:
             try:
-                self.image_data = np.load(filepath)
+                metadata = None
+                if filepath.lower().endswith('.hdr'):
+                    self.image_data, metadata = load_envi(filepath)
+                else:
+                    self.image_data = load_cube(filepath)
+
+                # Take the band wavelengths straight from the ENVI header
+                if metadata is not None:
+                    self.metadata = as_metadata(metadata)
+                    self.metadata_from_header = True
+                    self.metadata_label.setText(f"Metadata: {os.path.basename(filepath)} (ENVI header)")
+                elif self.metadata_from_header:
+                    # The previous scene's header does not describe this cube
+                    self.metadata = None
+                    self.metadata_from_header = False
+                    self.metadata_label.setText("Metadata: Not Selected")
                 self.image_label.setText(f"Image: {os.path.basename(filepath)}")
             except Exception as e:
                 QMessageBox.warning(self, "Error", f"Could not load image: {str(e)}")
@@ -59,14 +81,15 @@ class DataInputWidget(QWidget):
         if filepath:
             try:
                 with open(filepath, 'r') as f:
-                    self.metadata = json.load(f)
+                    self.metadata = as_metadata(json.load(f))
+                self.metadata_from_header = False
                 self.metadata_label.setText(f"Metadata: {os.path.basename(filepath)}")
             except Exception as e:
                 QMessageBox.warning(self, "Error", f"Could not load metadata: {str(e)}")
 
     def select_spectral_library(self):
         filepath, _ = QFileDialog.getOpenFileName(self, "Select Spectral Library", 
-                                                  "", "JSON Files (*.json)")
+                                                  "", "Spectral Libraries (*.json *.slib)")
         if filepath:
             try:
                 self.spectral_library = filepath
@@ -103,6 +126,12 @@ class HyperspectralAnalysisTool(QMainWindow):
             QMessageBox.warning(self, "Error", "Please select hyperspectral image and metadata first")
             return
 
+        try:
+            self.data_input_widget.metadata.check_cube(self.data_input_widget.image_data)
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+
         if self.data_input_widget.spectral_library is None:
             QMessageBox.warning(self, "Warning", "Defaulting to preset spectral library")
             #use a default library path, if it doesn't exist, create it
@@ -112,6 +141,11 @@ class HyperspectralAnalysisTool(QMainWindow):
             self.data_input_widget.spectral_library = 'data/spectral_library.json'
 
         
+        start = time.perf_counter()
+        # matplotlib and the analysis widgets are only imported once needed,
+        # so the file picker comes up without paying for them
+        from spectralToolsQT import SpectralAnalysisTool
+        
         # Open Spectral Analysis Tool
         self.spectral_tool = SpectralAnalysisTool(
             self.data_input_widget.image_data, 
@@ -119,11 +153,21 @@ class HyperspectralAnalysisTool(QMainWindow):
             self.data_input_widget.spectral_library
         )
         self.spectral_tool.show()
+        QTimer.singleShot(0, lambda: self.report_ready(start))
+    
+    def report_ready(self, start):
+        """Record the time from "Run Spectral Analysis" to an interactive window."""
+        elapsed = time.perf_counter() - start
+        self.spectral_tool.timings['time_to_interactive'] = elapsed
+        self.spectral_tool.statusBar().showMessage(f"Ready in {elapsed:.2f} s", 5000)
 
 def main():
     app = QApplication(sys.argv)
     main_window = HyperspectralAnalysisTool()
     main_window.show()
+    # Time from process start until the event loop first runs
+    QTimer.singleShot(0, lambda: main_window.statusBar().showMessage(
+        f"Started in {time.perf_counter() - _PROCESS_START:.2f} s", 5000))
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
@@ -0,0 +1,392 @@
+"""
+Headless benchmarks of the hot paths on synthetic cubes and libraries.
+
+    python benchmarks/run_benchmarks.py --preset salinas -o results.json
+    python benchmarks/run_benchmarks.py --preset salinas --baseline results.json
+
+Times pixel extraction, FCC rendering, PCA/MNF fitting, single-click SAM, scene
+classification and library load/save, writes the timings as JSON and
+compares them with a baseline run from the same machine; the exit status is
+1 when a benchmark got slower than the threshold allows.
+"""
+import argparse
+import contextlib
+import fnmatch
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the repository root importable when run as a script
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+from benchmarks.synthetic import format_shape, parse_shape, synthetic_cube, synthetic_library, synthetic_metadata
+from utils.analyseSAM import compare_pixel_to_library, compile_library
+from utils.classifySAM import classify_scene
+from utils.FCC import create_rgb_image, default_rgb_bands
+from utils.libraryIndex import get_library_index
+from utils.overviewPyramid import OverviewPyramid
+from utils.pcaTransform import ProjectedCube, fit_transform
+from utils.parallelTiles import default_workers, shutdown_pool
+from utils.pixelSpectrum import get_pixel_spectrum
+from utils.spectralLib import read_library_table, save_entry_to_library, write_library
+from utils.spectralMetadata import as_metadata
+from utils.spectrumSelection import read_pixel_spectra
+
+# Cube shapes and library sizes of every preset; 4096x2048x204 int16 is a
+# 3.4 GB memory-mapped cube
+PRESETS = {
+    'quick': {'cubes': ['128x64x204'], 'libraries': [10, 1000]},
+    'salinas': {'cubes': ['512x217x204'], 'libraries': [10, 1000, 100000]},
+    'large': {'cubes': ['512x217x204', '4096x2048x204'], 'libraries': [10, 1000, 100000]},
+}
+
+# Cubes larger than this are written to the data directory and memory-mapped
+MMAP_BYTES = 2 ** 30
+
+# Benchmarks by the data they need
+CUBE_BENCHMARKS = ('pixel_spectrum', 'pixel_spectra_batch', 'fcc_rgb', 'fcc_pyramid', 'pca_fit', 'mnf_fit',
+                   'fcc_pca')
+SAM_BENCHMARKS = ('sam_compile', 'sam_click', 'sam_click_top_k', 'classify_scene')
+LIBRARY_BENCHMARKS = ('library_save_json', 'library_save_slib', 'library_load_json', 'library_load_slib',
+                      'library_append_entry')
+
+# Results file format version
+RESULTS_VERSION = 1
+
+# A benchmark only counts as a regression if it slowed down by more than
+# this many seconds as well, so timer noise on tiny timings is not flagged
+MIN_REGRESSION_SECONDS = 1e-4
+
+
+def measure(func, repeat=5, number=1, max_time=10.0):
+    """
+    Time a function.
+
+    The first call is a warm-up that fills caches and starts worker pools;
+    it is only kept when it alone took longer than max_time. Further runs
+    stop early once max_time has been spent on them.
+
+    Parameters:
+    func (callable): Function to time, called without arguments
+    repeat (int): Number of timed runs
+    number (int): Calls per run; times are reported per call
+    max_time (float): Time budget in seconds
+
+    Returns:
+    list: Seconds per call of every timed run
+    """
+    def run():
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        return (time.perf_counter() - start) / number
+
+    warm_up = run()
+    if warm_up * number > max_time:
+        return [warm_up]
+
+    times = []
+    spent = 0.0
+    for _ in range(repeat):
+        times.append(run())
+        spent += times[-1] * number
+        if spent > max_time:
+            break
+    return times
+
+
+def selected(args, *names):
+    """True if any of the named benchmarks matches the --only patterns."""
+    return not args.only or any(fnmatch.fnmatch(name, pattern) for name in names for pattern in args.only)
+
+
+def benchmark_key(name, params):
+    """Unique key of a benchmark case, e.g. 'sam_click[cube=512x217x204,entries=10]'."""
+    return name + '[' + ','.join(f"{k}={v}" for k, v in params.items()) + ']'
+
+
+def _cube_cases(image_data, metadata, cube_name, rng):
+    rows, cols = image_data.shape[:2]
+    pixels = np.column_stack((rng.integers(0, rows, 1000), rng.integers(0, cols, 1000)))
+    clicks = itertools.cycle([tuple(int(v) for v in pixel) for pixel in pixels])
+    params = {'cube': cube_name}
+
+    yield 'pixel_spectrum', params, lambda: get_pixel_spectrum(image_data, metadata, next(clicks)), 100
+    yield 'pixel_spectra_batch', dict(params, pixels=len(pixels)), lambda: read_pixel_spectra(image_data, pixels), 1
+    yield 'fcc_rgb', params, lambda: create_rgb_image(image_data, metadata), 1
+    yield 'fcc_pyramid', params, lambda: OverviewPyramid(image_data, default_rgb_bands(image_data, metadata)), 1
+    yield 'pca_fit', params, lambda: fit_transform(image_data, 'pca'), 1
+    yield 'mnf_fit', params, lambda: fit_transform(image_data, 'mnf'), 1
+
+    # The transform is fitted by the warm-up run, so only the projection and render are timed
+    transform = []
+
+    def render_pca():
+        if not transform:
+            transform.append(fit_transform(image_data, 'pca'))
+        return create_rgb_image(ProjectedCube(image_data, transform[0], 3), bands=(0, 1, 2), stretch='percentile')
+
+    yield 'fcc_pca', params, render_pca, 1
+
+
+def _sam_cases(image_data, metadata, cube_name, table, args, rng):
+    rows, cols = image_data.shape[:2]
+    pixels = np.column_stack((rng.integers(0, rows, 100), rng.integers(0, cols, 100)))
+    clicks = itertools.cycle([tuple(int(v) for v in pixel) for pixel in pixels])
+    params = {'cube': cube_name, 'entries': len(table)}
+    wavelengths = metadata.wavelengths[:image_data.shape[2]]
+
+    yield 'sam_compile', params, lambda: compile_library(table, wavelengths), 1
+    if not selected(args, *SAM_BENCHMARKS[1:]):
+        return
+
+    compiled = compile_library(table, wavelengths)
+    get_library_index(compiled)
+    yield 'sam_click', params, lambda: compare_pixel_to_library(
+        image_data, metadata, next(clicks), compiled_library=compiled), 1
+    yield 'sam_click_top_k', dict(params, top_k=10), lambda: compare_pixel_to_library(
+        image_data, metadata, next(clicks), compiled_library=compiled, top_k=10), 1
+
+    if len(table) <= args.max_classify_entries:
+        for n_workers in sorted({1, args.workers}):
+            yield 'classify_scene', dict(params, workers=n_workers), lambda n_workers=n_workers: classify_scene(
+                image_data, compiled, n_workers=n_workers), 1
+
+
+def _library_cases(table, data_dir, args):
+    params = {'entries': len(table)}
+    json_path = os.path.join(data_dir, f"library_{len(table)}.json")
+    binary_path = os.path.join(data_dir, f"library_{len(table)}.slib")
+    journal_library = os.path.join(data_dir, f"library_{len(table)}_journal.slib")
+    wavelengths = table.wavelengths
+    spectrum = np.nan_to_num(table.spectra[0])
+
+    yield 'library_save_json', params, lambda: write_library(json_path, table), 1
+    yield 'library_save_slib', params, lambda: write_library(binary_path, table), 1
+
+    # The save benchmarks leave the files behind unless --only skipped them
+    for name, path in (('library_load_json', json_path), ('library_load_slib', binary_path)):
+        if selected(args, name):
+            if not os.path.exists(path):
+                write_library(path, table)
+            yield name, params, lambda path=path: read_library_table(path), 1
+
+    if not selected(args, 'library_append_entry'):
+        return
+    write_library(journal_library, table)
+    counter = itertools.count()
+
+    def append_entry():
+        with contextlib.redirect_stdout(io.StringIO()):
+            save_entry_to_library(journal_library, f"appended_{next(counter)}", wavelengths, spectrum)
+
+    yield 'library_append_entry', params, append_entry, 20
+
+
+def iter_cases(args):
+    """
+    Generate the benchmark cases of the chosen cubes and libraries, creating
+    the synthetic data on the way; data only needed by benchmarks that
+    --only leaves out is not created.
+
+    Yields:
+    tuple: (name, params, function, calls per run)
+    """
+    rng = np.random.default_rng(args.seed)
+    tables = {}
+    for n_entries in args.libraries:
+        tables[n_entries] = synthetic_library(n_entries, parse_shape(args.cubes[0])[2], seed=args.seed)
+        if selected(args, *LIBRARY_BENCHMARKS):
+            yield from _library_cases(tables[n_entries], args.data_dir, args)
+
+    if not selected(args, *CUBE_BENCHMARKS, *SAM_BENCHMARKS):
+        return
+    for cube in args.cubes:
+        shape = parse_shape(cube)
+        path = None
+        if args.mmap or np.prod(shape) * 2 > MMAP_BYTES:
+            path = os.path.join(args.data_dir, f"cube_{format_shape(shape)}_{args.seed}.npy")
+        print(f"# Preparing {format_shape(shape)} cube" + (f" at {path}" if path else ""), file=sys.stderr)
+        image_data = synthetic_cube(shape, path, seed=args.seed)
+        metadata = as_metadata(synthetic_metadata(shape[2]))
+        cube_name = format_shape(shape) + ('-mmap' if path else '')
+
+        yield from _cube_cases(image_data, metadata, cube_name, rng)
+        if not selected(args, *SAM_BENCHMARKS):
+            continue
+        for n_entries in args.libraries:
+            table = tables.get(n_entries)
+            if table is None or table.spectra.shape[1] != shape[2]:
+                table = synthetic_library(n_entries, shape[2], seed=args.seed)
+            yield from _sam_cases(image_data, metadata, cube_name, table, args, rng)
+
+
+def environment():
+    """Machine and software the benchmarks ran on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit,
+    }
+
+
+def compare_results(results, baseline, threshold):
+    """
+    Compare benchmark results with a baseline run.
+
+    Parameters:
+    results (list): Result records of this run
+    baseline (dict): Results file of an earlier run
+    threshold (float): Slowdown ratio (median / baseline median) that counts
+        as a regression
+
+    Returns:
+    list: (key, baseline median, ratio, status) for every result, status being
+        'regression', 'faster', 'ok' or 'new'
+    """
+    previous = {record['key']: record['median'] for record in baseline.get('results', [])}
+    comparison = []
+    for record in results:
+        before = previous.get(record['key'])
+        if before is None:
+            comparison.append((record['key'], None, None, 'new'))
+            continue
+        ratio = record['median'] / before if before > 0 else float('inf')
+        if ratio > threshold and record['median'] - before > MIN_REGRESSION_SECONDS:
+            status = 'regression'
+        elif ratio < 1 / threshold:
+            status = 'faster'
+        else:
+            status = 'ok'
+        comparison.append((record['key'], before, ratio, status))
+    return comparison
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.3f} s"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--preset', default='salinas', choices=sorted(PRESETS),
+                        help="Cube shapes and library sizes to run (default: salinas)")
+    parser.add_argument('--cube', action='append', dest='cubes',
+                        help="Cube shape as ROWSxCOLSxBANDS instead of the preset's (repeatable)")
+    parser.add_argument('--libraries', help="Comma-separated library sizes instead of the preset's")
+    parser.add_argument('--only', action='append',
+                        help="Only run benchmarks whose name matches this pattern, e.g. 'sam_*' (repeatable)")
+    parser.add_argument('--mmap', action='store_true', help="Memory-map every cube from the data directory")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'spectravis-benchmarks'),
+                        help="Where synthetic cubes and libraries are written (large cubes are kept for reuse)")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument('--max-time', type=float, default=10.0, help="Time budget per benchmark in seconds")
+    parser.add_argument('--workers', type=int, default=default_workers(),
+                        help="Workers of the parallel classification case (default: all CPUs)")
+    parser.add_argument('--max-classify-entries', type=int, default=1000,
+                        help="Only classify the scene against libraries up to this size")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument('-o', '--output', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="Results file of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="Slowdown ratio against the baseline that counts as a regression")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    preset = PRESETS[args.preset]
+    args.cubes = args.cubes or preset['cubes']
+    args.libraries = ([int(n) for n in args.libraries.split(',')] if args.libraries
+                      else preset['libraries'])
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    results = []
+    try:
+        for name, params, func, number in iter_cases(args):
+            if not selected(args, name):
+                continue
+            key = benchmark_key(name, params)
+            times = measure(func, args.repeat, number, args.max_time)
+            results.append({
+                'key': key,
+                'name': name,
+                'params': params,
+                'number': number,
+                'times': times,
+                'min': min(times),
+                'median': statistics.median(times),
+            })
+            print(f"{key}\t{_format_seconds(results[-1]['median'])}", file=sys.stderr)
+    finally:
+        shutdown_pool()
+        # Libraries are cheap to regenerate; large cubes are kept for the next run
+        for name in os.listdir(args.data_dir):
+            if name.startswith('library_'):
+                path = os.path.join(args.data_dir, name)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+    report = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'arguments': {'preset': args.preset, 'cubes': args.cubes, 'libraries': args.libraries,
+                      'repeat': args.repeat, 'workers': args.workers, 'seed': args.seed},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    if baseline is None:
+        print("benchmark\tmedian\tmin")
+        for record in results:
+            print(f"{record['key']}\t{_format_seconds(record['median'])}\t{_format_seconds(record['min'])}")
+        return 0
+
+    if baseline.get('environment', {}).get('platform') != report['environment']['platform']:
+        print("# Baseline was recorded on a different platform; ratios may not be meaningful", file=sys.stderr)
+    comparison = compare_results(results, baseline, args.threshold)
+    print("benchmark\tmedian\tbaseline\tratio\tstatus")
+    for record, (key, before, ratio, status) in zip(results, comparison):
+        ratio_text = '-' if ratio is None else f"{ratio:.2f}"
+        print(f"{key}\t{_format_seconds(record['median'])}\t{_format_seconds(before)}\t{ratio_text}\t{status}")
+
+    regressions = [key for key, _, _, status in comparison if status == 'regression']
+    if regressions:
+        print(f"# {len(regressions)} regression(s) over {args.threshold:.2f}x: " + ', '.join(regressions),
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import os
+import numpy as np
+from utils.cubeIO import load_cube
+from utils.spectralLib import LibraryTable
+
+# Wavelength range (nm) of the synthetic sensor, close to AVIRIS / Salinas
+SYNTHETIC_WAVELENGTH_RANGE = (380.0, 2500.0)
+
+# Number of materials mixed into every synthetic cube and library
+N_ENDMEMBERS = 16
+
+# Side (pixels) of the square fields the synthetic scene is made of
+FIELD_SIZE = 32
+
+# Cube values generated and written per block of rows
+_BLOCK_ELEMENTS = 2 ** 24
+
+
+def parse_shape(text):
+    """
+    Parse a cube shape written as ROWSxCOLSxBANDS, e.g. '512x217x204'.
+
+    Parameters:
+    text (str): Shape specification
+
+    Returns:
+    tuple: (rows, cols, bands)
+    """
+    shape = tuple(int(v) for v in text.lower().split('x'))
+    if len(shape) != 3 or min(shape) < 1:
+        raise ValueError(f"Expected a cube shape as ROWSxCOLSxBANDS, got '{text}'")
+    return shape
+
+
+def format_shape(shape):
+    """Inverse of parse_shape."""
+    return 'x'.join(str(v) for v in shape)
+
+
+def synthetic_wavelengths(n_bands):
+    """
+    Evenly spaced wavelengths over the synthetic sensor range.
+
+    Parameters:
+    n_bands (int): Number of bands
+
+    Returns:
+    ndarray: Wavelength (nm) of each band
+    """
+    return np.linspace(*SYNTHETIC_WAVELENGTH_RANGE, n_bands)
+
+
+def synthetic_metadata(n_bands):
+    """
+    Metadata with evenly spaced wavelengths over the synthetic sensor range,
+    in the same form as data/metadata.json.
+
+    Parameters:
+    n_bands (int): Number of bands
+
+    Returns:
+    dict: Metadata with 'band_to_wavelength'
+    """
+    wavelengths = synthetic_wavelengths(n_bands)
+    return {"band_to_wavelength": {str(band): [band, float(w)]
+                                   for band, w in enumerate(wavelengths, start=1)}}
+
+
+def endmember_spectra(wavelengths, n_endmembers=N_ENDMEMBERS, seed=0):
+    """
+    Smooth, positive material spectra: a sloped continuum with a few
+    Gaussian absorption features, scaled to typical radiance DNs.
+
+    Parameters:
+    wavelengths (ndarray): Wavelength of each band
+    n_endmembers (int): Number of materials
+    seed (int): Random seed
+
+    Returns:
+    ndarray: (n_endmembers, bands) float64 spectra
+    """
+    rng = np.random.default_rng(seed)
+    x = (np.asarray(wavelengths, dtype=np.float64) - SYNTHETIC_WAVELENGTH_RANGE[0]) / np.ptp(SYNTHETIC_WAVELENGTH_RANGE)
+
+    continuum = rng.uniform(0.3, 1.0, (n_endmembers, 1)) + rng.uniform(-0.4, 0.4, (n_endmembers, 1)) * x
+    centres = rng.uniform(0.0, 1.0, (n_endmembers, 5, 1))
+    widths = rng.uniform(0.01, 0.08, (n_endmembers, 5, 1))
+    depths = rng.uniform(0.05, 0.5, (n_endmembers, 5, 1))
+    absorption = (depths * np.exp(-0.5 * np.square((x - centres) / widths))).sum(axis=1)
+    spectra = np.clip(continuum * (1.0 - np.minimum(absorption, 0.9)), 0.02, None)
+    return spectra * rng.uniform(2000, 8000, (n_endmembers, 1))
+
+
+def _cube_block(start, stop, cols, fields, endmembers, rng):
+    """Rows start:stop of a synthetic scene as (rows, cols, bands) int16."""
+    rows = np.arange(start, stop)[:, np.newaxis] // FIELD_SIZE
+    field_cols = np.arange(cols)[np.newaxis, :] // FIELD_SIZE
+    primary = fields[rows, field_cols].ravel()
+    secondary = rng.integers(0, len(endmembers), primary.size)
+
+    # Every pixel mixes its field's material with a random one, with
+    # brightness variation and sensor noise
+    weight = rng.uniform(0.7, 1.0, (primary.size, 1)).astype(np.float32)
+    brightness = rng.uniform(0.85, 1.15, (primary.size, 1)).astype(np.float32)
+    values = endmembers[primary] * weight
+    values += endmembers[secondary] * (1.0 - weight)
+    values *= brightness
+    values += rng.normal(0.0, 20.0, values.shape).astype(np.float32)
+    return np.clip(values, 0, np.iinfo(np.int16).max).astype(np.int16).reshape(stop - start, cols, -1)
+
+
+def synthetic_cube(shape, path=None, seed=0):
+    """
+    Generate a synthetic scene of mixed materials laid out in square fields.
+
+    Without a path the cube is returned in memory. With a path it is written
+    block by block to a .npy file (so cubes larger than RAM can be made) and
+    returned memory-mapped; an existing file of the same shape is reused,
+    since the content only depends on the shape and seed.
+
+    Parameters:
+    shape (tuple): (rows, cols, bands)
+    path (str): .npy file to write and memory-map (in memory if None)
+    seed (int): Random seed
+
+    Returns:
+    ndarray: (rows, cols, bands) int16 cube (np.memmap when path is given)
+    """
+    rows, cols, bands = shape
+    if path is not None and os.path.exists(path):
+        image_data = load_cube(path)
+        if image_data.shape == tuple(shape) and image_data.dtype == np.int16:
+            return image_data
+
+    rng = np.random.default_rng(seed)
+    endmembers = endmember_spectra(synthetic_wavelengths(bands), seed=seed).astype(np.float32)
+    fields = rng.integers(0, len(endmembers), (-(-rows // FIELD_SIZE), -(-cols // FIELD_SIZE)))
+
+    if path is None:
+        image_data = np.empty(shape, dtype=np.int16)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = path + '.tmp.npy'
+        image_data = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.int16, shape=tuple(shape))
+
+    block_rows = max(1, _BLOCK_ELEMENTS // (cols * bands))
+    for start in range(0, rows, block_rows):
+        stop = min(start + block_rows, rows)
+        image_data[start:stop] = _cube_block(start, stop, cols, fields, endmembers, rng)
+
+    if path is None:
+        return image_data
+    image_data.flush()
+    del image_data
+    os.replace(temp_path, path)
+    return load_cube(path)
+
+
+def synthetic_library(n_entries, n_bands, seed=0):
+    """
+    Generate a spectral library of noisy variants of the synthetic materials,
+    on the wavelengths of a synthetic cube.
+
+    Parameters:
+    n_entries (int): Number of entries
+    n_bands (int): Number of bands of the cube the library is made for
+    seed (int): Random seed (the same as the cube's, so entries match it)
+
+    Returns:
+    LibraryTable: The library
+    """
+    rng = np.random.default_rng(seed + 1)
+    wavelengths = synthetic_wavelengths(n_bands)
+    endmembers = endmember_spectra(wavelengths, seed=seed)
+
+    materials = rng.integers(0, len(endmembers), n_entries)
+    scale = rng.uniform(0.8, 1.2, (n_entries, 1))
+    spectra = endmembers[materials] * scale * (1.0 + rng.normal(0.0, 0.03, (n_entries, n_bands)))
+    spectra = np.round(np.clip(spectra, 0, None)).astype(np.float32)
+
+    labels = [f"material_{m}_{i}" for i, m in enumerate(materials)]
+    entries = [{"label": label} for label in labels]
+    return LibraryTable(wavelengths, spectra, labels, entries, integer_values=True)
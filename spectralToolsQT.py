@@ -1,26 +1,82 @@
 import sys
+import time
 import numpy as np
 import json
 import os
 import matplotlib.pyplot as plt
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
                              QLabel, QLineEdit, QMessageBox, QDialog, QSpinBox,
-                             QTabWidget, QMainWindow, QApplication)
-from PyQt5.QtCore import Qt
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+                             QDoubleSpinBox, QComboBox, QTabWidget, QMainWindow, QApplication,
+                             QProgressBar, QCheckBox, QFileDialog, QTableWidget, QTableWidgetItem)
+from PyQt5.QtCore import Qt, QTimer
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT
-from utils.FCC import create_rgb_image
-from utils.pixelSpectrum import get_pixel_spectrum
-from utils.analyseSAM import compare_pixel_to_library
-from utils.spectralLib import save_entry_to_library, view_library
-from utils.canvasHandler import CanvasHandler
+from matplotlib.widgets import LassoSelector, PolygonSelector, RectangleSelector
+from utils.FCC import render_cache
+from utils.overviewPyramid import FCCDisplay
+from utils.pixelSpectrum import get_pixel_spectrum, get_wavelengths
+from utils.analyseSAM import compare_pixel_to_library, compile_library
+from utils.classifySAM import classify_scene
+from utils.similarityMetrics import METRICS, get_metric
+from utils.continuumRemoval import continuum_cache, get_continuum_removed_cube
+from utils.pcaTransform import get_transform, transform_cache
+from utils.roiStats import polygon_mask, rectangle_mask, region_statistics
+from utils.libraryBuilder import (build_class_library, class_names_path, default_ignore_labels, load_class_names,
+                                  load_label_raster)
+from utils.parallelTiles import default_workers
+from utils.spectralLib import save_entry_to_library, save_entries_to_library, read_library_table
+from utils.canvasHandler import BlitManager, CanvasHandler, autoscale_changed
+from utils.qtTasks import get_task_runner
+from utils.cubeIO import load_cube
+from utils.spectralMetadata import as_metadata
+from utils.instrumentation import dump_profile, profiler, span
+
+# Largest selection the visualization tab accepts (e.g. long transects)
+MAX_SELECTED_PIXELS = 100000
+
+# Number of best library matches the SAM tab shows by default
+DEFAULT_TOP_K = 10
+
+# Ways of selecting the spectrum to save on the library tab
+ROI_MODES = ('pixel', 'rectangle', 'polygon', 'lasso')
+
+# Milliseconds between refreshes of the live profile numbers
+PROFILE_REFRESH_MS = 1000
+
+# Number of stages the status bar shows while profiling
+PROFILE_STATUS_SPANS = 3
+
+
+class FigureCanvas(FigureCanvasQTAgg):
+    """Qt canvas whose full redraws are timed as the span 'canvas.draw'."""
+
+    def draw(self):
+        with span('canvas.draw'):
+            super().draw()
+
+
+def create_metric_input():
+    """Combo box listing the registered similarity metrics (data = metric name)."""
+    metric_input = QComboBox()
+    for name, metric in METRICS.items():
+        metric_input.addItem(metric.label, name)
+    return metric_input
+
+
+def create_threshold_input():
+    """Spin box for a similarity score threshold; fine enough for SID scores."""
+    threshold_input = QDoubleSpinBox()
+    threshold_input.setDecimals(5)
+    threshold_input.setRange(0.0, 10.0)
+    threshold_input.setSingleStep(0.005)
+    return threshold_input
 
 
 class SpectralVisualizationWidget(QWidget):
     def __init__(self, image_data, metadata, max_pixels=10):
         super().__init__()
         self.image_data = image_data
-        self.metadata = metadata
+        self.metadata = as_metadata(metadata)
         self.max_pixels = max_pixels
         
         # State tracking
@@ -37,8 +93,9 @@ class SpectralVisualizationWidget(QWidget):
         layout.addWidget(self.canvas)
         
         # RGB Image setup (left subplot)
-        self.rgb_image = create_rgb_image(self.image_data)
-        self.ax1.imshow(self.rgb_image)
+        self.fcc = FCCDisplay(self.image_data, self.metadata)
+        self.rgb_image = self.fcc.rgb_image
+        self.fcc.show(self.ax1)
         self.ax1.set_title(f"Click on the image to select up to {self.max_pixels} pixels")
         
         # Spectrum plot setup (right subplot)
@@ -52,13 +109,24 @@ class SpectralVisualizationWidget(QWidget):
         # Max pixels input
         pixels_label = QLabel("Max Pixels:")
         self.max_pixels_input = QSpinBox()
-        self.max_pixels_input.setRange(1, 20)
+        self.max_pixels_input.setRange(1, MAX_SELECTED_PIXELS)
         self.max_pixels_input.setValue(self.max_pixels)
         self.max_pixels_input.valueChanged.connect(self.update_max_pixels)
         
         controls_layout.addWidget(pixels_label)
         controls_layout.addWidget(self.max_pixels_input)
         
+        # How the selected spectra are drawn
+        controls_layout.addWidget(QLabel("Spectra:"))
+        self.spectrum_mode_input = QComboBox()
+        self.spectrum_mode_input.addItem("Auto", 'auto')
+        self.spectrum_mode_input.addItem("Lines", 'lines')
+        self.spectrum_mode_input.addItem("Collection", 'collection')
+        self.spectrum_mode_input.addItem("Envelope", 'envelope')
+        self.spectrum_mode_input.addItem("Density", 'density')
+        self.spectrum_mode_input.currentIndexChanged.connect(self.update_spectrum_mode)
+        controls_layout.addWidget(self.spectrum_mode_input)
+        
         # Reset button
         reset_button = QPushButton("Reset Selection")
         reset_button.clicked.connect(self.reset_selection)
@@ -69,6 +137,26 @@ class SpectralVisualizationWidget(QWidget):
         undo_button.clicked.connect(self.undo_last_selection)
         controls_layout.addWidget(undo_button)
         
+        # FCC contrast stretch
+        controls_layout.addWidget(QLabel("Stretch:"))
+        self.stretch_input = QComboBox()
+        self.stretch_input.addItem("Percentile 2-98%", 'percentile')
+        self.stretch_input.addItem("Min/Max per Band", 'minmax')
+        self.stretch_input.addItem("Min/Max Global", 'global')
+        self.stretch_input.addItem("Histogram Equalization", 'equalize')
+        self.stretch_input.setCurrentIndex(self.stretch_input.findData(self.fcc.stretch))
+        self.stretch_input.currentIndexChanged.connect(self.update_stretch)
+        controls_layout.addWidget(self.stretch_input)
+        
+        # FCC of three bands or of the leading PCA/MNF components
+        controls_layout.addWidget(QLabel("Composite:"))
+        self.composite_input = QComboBox()
+        self.composite_input.addItem("Bands", 'bands')
+        self.composite_input.addItem("PCA 1-3", 'pca')
+        self.composite_input.addItem("MNF 1-3", 'mnf')
+        self.composite_input.currentIndexChanged.connect(self.update_composite)
+        controls_layout.addWidget(self.composite_input)
+        
         layout.addLayout(controls_layout)
         self.setLayout(layout)
         
@@ -81,7 +169,7 @@ class SpectralVisualizationWidget(QWidget):
             self.figure, 
             self.ax1,  # Pass RGB image subplot 
             self.ax2,  # Pass spectrum subplot
-            self.rgb_image, 
+            self.fcc, 
             self.image_data, 
             self.metadata, 
             self.max_pixels
@@ -96,23 +184,54 @@ class SpectralVisualizationWidget(QWidget):
         self.ax1.set_title(f"Click on the image to select up to {self.max_pixels} pixels")
         self.canvas.draw()
 
+    def update_spectrum_mode(self):
+        """Switch between per-pixel lines, a line collection and an envelope"""
+        self.canvas_handler.set_spectrum_mode(self.spectrum_mode_input.currentData())
+
+    def update_stretch(self):
+        """Re-render the FCC with the selected contrast stretch and composite"""
+        self.fcc = FCCDisplay(self.image_data, self.metadata, stretch=self.stretch_input.currentData(),
+                              composite=self.composite_input.currentData())
+        self.rgb_image = self.fcc.rgb_image
+        self.canvas_handler.rgb_image = self.fcc
+        self.canvas_handler.redraw_image()
+    
+    def update_composite(self):
+        """Fit (or load) the PCA/MNF transform in the background, then re-render the FCC"""
+        composite = self.composite_input.currentData()
+        if composite == 'bands':
+            get_task_runner().cancel('fit-transform')
+            self.update_stretch()
+            return
+        
+        def fit(context, method):
+            # The transform is cached, so switching back and forth is immediate
+            get_transform(self.image_data, method, self.metadata.band_mask, progress=context.progress)
+        
+        get_task_runner().submit(
+            'fit-transform',
+            fit,
+            composite,
+            on_result=lambda _: self.update_stretch(),
+            on_error=lambda error: QMessageBox.critical(self, "Error", f"Could not compute {composite.upper()}: {error}"),
+            description=f"Computing {composite.upper()} transform"
+        )
+
     def reset_selection(self):
         """Reset the pixel selection and clear the plot"""
         self.canvas_handler.reset()
-        self.canvas.draw()
 
     def undo_last_selection(self):
         """
         Undo the last pixel selection.
         """
         self.canvas_handler.undo_last_selection()
-        self.canvas.draw()
 
 class SpectralLibraryCreationWidget(QWidget):
     def __init__(self, image_data, metadata, library_path):
         super().__init__()
         self.image_data = image_data
-        self.metadata = metadata
+        self.metadata = as_metadata(metadata)
         self.library_path = library_path
         
         # State tracking
@@ -120,6 +239,10 @@ class SpectralLibraryCreationWidget(QWidget):
         self.current_pixel_data = None
         self.current_wavelengths = None
         self.selected_pixel = None
+        # Statistics of the selected region (None when a single pixel is selected)
+        self.current_region = None
+        self.roi_selector = None
+        self.roi_band = None
         
         self.init_ui()
     
@@ -132,8 +255,9 @@ class SpectralLibraryCreationWidget(QWidget):
         layout.addWidget(self.canvas)
         
         # RGB Image setup
-        self.rgb_image = create_rgb_image(self.image_data)
-        self.ax1.imshow(self.rgb_image)
+        self.fcc = FCCDisplay(self.image_data, self.metadata)
+        self.rgb_image = self.fcc.rgb_image
+        self.fcc.show(self.ax1)
         self.ax1.set_title("Click on pixels to add to spectral library")
         
         # Spectrum setup
@@ -141,9 +265,29 @@ class SpectralLibraryCreationWidget(QWidget):
         self.ax2.set_xlabel("Wavelength (nm)")
         self.ax2.set_ylabel("Radiance (DN)")
         
+        # Marker, title and spectrum are updated in place and blitted
+        self.blit_manager = BlitManager(self.canvas)
+        self.marker, = self.ax1.plot([], [], 'o', color='red', markersize=10)
+        self.spectrum_line, = self.ax2.plot([], [])
+        for artist in (self.marker, self.ax1.title, self.spectrum_line):
+            self.blit_manager.add_artist(artist)
+        
+        # Region outline and min/max spectra of the last ROI
+        self.roi_outline, = self.ax1.plot([], [], '-', color='red', linewidth=1.5)
+        self.roi_min_line, = self.ax2.plot([], [], '--', color='grey', linewidth=0.8)
+        self.roi_max_line, = self.ax2.plot([], [], '--', color='grey', linewidth=0.8)
+        
         # Controls
         controls_layout = QHBoxLayout()
         
+        # Single pixels or regions of interest
+        controls_layout.addWidget(QLabel("Selection:"))
+        self.selection_input = QComboBox()
+        for mode in ROI_MODES:
+            self.selection_input.addItem(mode.capitalize(), mode)
+        self.selection_input.currentIndexChanged.connect(self.update_selection_mode)
+        controls_layout.addWidget(self.selection_input)
+        
         # Label input
         self.label_input = QLineEdit()
         self.label_input.setPlaceholderText("Enter library entry label")
@@ -160,20 +304,111 @@ class SpectralLibraryCreationWidget(QWidget):
         view_library_button.clicked.connect(self.display_library)
         controls_layout.addWidget(view_library_button)
         
+        # One entry per class of a ground-truth map
+        build_button = QPushButton("Build From Labels...")
+        build_button.clicked.connect(self.build_from_labels)
+        controls_layout.addWidget(build_button)
+        
         layout.addLayout(controls_layout)
         self.setLayout(layout)
         
         # Connect click event
         self.canvas.mpl_connect('button_press_event', self.on_click)
     
+    def update_selection_mode(self):
+        mode = self.selection_input.currentData()
+        if self.roi_selector is not None:
+            self.roi_selector.set_active(False)
+            self.roi_selector.disconnect_events()
+            self.roi_selector = None
+        
+        # Regions are drawn with matplotlib's selector widgets
+        if mode == 'rectangle':
+            self.roi_selector = RectangleSelector(
+                self.ax1, lambda press, release: self.select_region(
+                    'rectangle', [(press.ydata, press.xdata), (release.ydata, release.xdata)]),
+                useblit=True, button=[1], interactive=False)
+        elif mode == 'polygon':
+            # Esc starts a new polygon
+            self.roi_selector = PolygonSelector(
+                self.ax1, lambda vertices: self.select_region('polygon', [(y, x) for x, y in vertices]),
+                useblit=True)
+        elif mode == 'lasso':
+            self.roi_selector = LassoSelector(
+                self.ax1, lambda vertices: self.select_region('lasso', [(y, x) for x, y in vertices]),
+                useblit=True, button=[1])
+        self.canvas.draw_idle()
+    
+    def select_region(self, mode, vertices):
+        """
+        Compute the statistics of a region drawn on the FCC in the background.
+
+        Parameters:
+        mode (str): 'rectangle', 'polygon' or 'lasso'
+        vertices (list): (row, col) corners (rectangle) or polygon vertices
+        """
+        if mode == 'rectangle':
+            bbox, mask = rectangle_mask(vertices[0], vertices[1], self.image_data.shape)
+            (r0, c0), (r1, c1) = vertices
+            outline = [(r0, c0), (r0, c1), (r1, c1), (r1, c0)]
+        else:
+            bbox, mask = polygon_mask(vertices, self.image_data.shape)
+            outline = vertices
+        outline = np.array(list(outline) + [outline[0]])
+        self.roi_outline.set_data(outline[:, 1], outline[:, 0])
+        self.marker.set_data([], [])
+        self.canvas.draw_idle()
+        
+        def compute(context):
+            return region_statistics(self.image_data, bbox, mask)
+        
+        get_task_runner().submit(
+            'roi-statistics',
+            compute,
+            on_result=lambda stats: self.show_region(stats, mode, bbox),
+            on_error=lambda error: QMessageBox.warning(self, "Error", f"Could not compute region statistics: {error}"),
+            description=f"Computing statistics of {int(mask.sum())} pixels"
+        )
+    
+    def show_region(self, stats, mode, bbox):
+        wavelengths = get_wavelengths(self.metadata, self.image_data.shape[2])
+        self.current_region = stats
+        self.current_wavelengths = wavelengths
+        self.current_pixel_data = stats['mean']
+        self.selected_pixel = None
+        
+        self.ax1.set_title(f"Selected {mode.capitalize()}: {stats['count']} pixels")
+        self.spectrum_line.set_data(wavelengths, stats['mean'])
+        self.roi_min_line.set_data(wavelengths, stats['min'])
+        self.roi_max_line.set_data(wavelengths, stats['max'])
+        if self.roi_band is not None:
+            self.roi_band.remove()
+        self.roi_band = self.ax2.fill_between(wavelengths, stats['mean'] - stats['std'],
+                                              stats['mean'] + stats['std'], alpha=0.3)
+        self.ax2.set_title("Region Mean ± Std (dashed: min/max)")
+        self.ax2.relim()
+        self.ax2.autoscale_view()
+        self.canvas.draw_idle()
+    
+    def clear_region(self):
+        self.current_region = None
+        self.roi_outline.set_data([], [])
+        self.roi_min_line.set_data([], [])
+        self.roi_max_line.set_data([], [])
+        if self.roi_band is not None:
+            self.roi_band.remove()
+            self.roi_band = None
+            self.ax2.set_title("Pixel Spectrum")
+            self.canvas.draw_idle()
+    
     def on_click(self, event):
-        if event.inaxes == self.ax1:
+        if event.inaxes == self.ax1 and self.selection_input.currentData() == 'pixel':
+            click_time = time.perf_counter()
             row, col = int(event.ydata), int(event.xdata)
             self.selected_pixel = (row, col)
+            self.clear_region()
             
-            self.ax1.clear()
-            self.ax1.imshow(self.rgb_image)
-            self.ax1.scatter(col, row, color='red', s=100)
+            self.marker.set_data([col], [row])
             self.ax1.set_title(f"Selected Pixel: ({row}, {col})")
             
             wavelengths, pixel_data = get_pixel_spectrum(
@@ -185,13 +420,8 @@ class SpectralLibraryCreationWidget(QWidget):
             self.current_wavelengths = wavelengths
             self.current_pixel_data = pixel_data
             
-            self.ax2.clear()
-            self.ax2.plot(wavelengths, pixel_data)
-            self.ax2.set_title("Pixel Spectrum")
-            self.ax2.set_xlabel("Wavelength (nm)")
-            self.ax2.set_ylabel("Radiance (DN)")
-            
-            self.canvas.draw()
+            self.spectrum_line.set_data(wavelengths, pixel_data)
+            self.blit_manager.update(click_time, full=autoscale_changed(self.ax2))
     
     def save_entry(self):
         label = self.label_input.text().strip()
@@ -202,25 +432,68 @@ class SpectralLibraryCreationWidget(QWidget):
         
         if (self.current_pixel_data is None or 
             self.current_wavelengths is None or 
-            self.selected_pixel is None):
-            QMessageBox.warning(self, "Error", "Please select a pixel first!")
+            (self.selected_pixel is None and self.current_region is None)):
+            QMessageBox.warning(self, "Error", "Please select a pixel or region first!")
             return
         
         try:
-            save_entry_to_library(
-                self.library_path,
-                label,
-                self.current_wavelengths,
-                self.current_pixel_data
-            )
+            if self.current_region is not None:
+                # One entry for the whole region: the mean spectrum plus its statistics
+                stats = self.current_region
+                save_entry_to_library(
+                    self.library_path,
+                    label,
+                    self.current_wavelengths,
+                    stats['mean'],
+                    statistics={name: values for name, values in stats.items()
+                                if name not in ('count', 'mean')},
+                    pixel_count=int(stats['count'])
+                )
+            else:
+                save_entry_to_library(
+                    self.library_path,
+                    label,
+                    self.current_wavelengths,
+                    self.current_pixel_data
+                )
             QMessageBox.information(self, "Success", f"Saved entry: {label}")
             self.label_input.clear()
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Could not save entry: {str(e)}")
     
+    def build_from_labels(self):
+        labels_path, _ = QFileDialog.getOpenFileName(
+            self, "Open Label Raster", "", "Label rasters (*.npy *.hdr);;All files (*)")
+        if not labels_path:
+            return
+        
+        def build(context, labels_path):
+            labels = load_label_raster(labels_path)
+            names_path = class_names_path(labels_path)
+            library = build_class_library(
+                self.image_data,
+                labels,
+                get_wavelengths(self.metadata, self.image_data.shape[2]),
+                load_class_names(names_path) if names_path else None,
+                ignore_labels=default_ignore_labels(names_path),
+                progress=context.progress
+            )
+            save_entries_to_library(self.library_path, library)
+            return library
+        
+        get_task_runner().submit(
+            'build-library',
+            build,
+            labels_path,
+            on_result=lambda library: QMessageBox.information(
+                self, "Success", f"Saved {len(library)} class entries to the library"),
+            on_error=lambda error: QMessageBox.critical(self, "Error", f"Could not build library: {error}"),
+            description=f"Building library from {os.path.basename(labels_path)}"
+        )
+    
     def display_library(self):
         try:
-            library = view_library(self.library_path)
+            library = read_library_table(self.library_path)
             
             # Create a new dialog to display library
             dialog = QDialog(self)
@@ -232,10 +505,9 @@ class SpectralLibraryCreationWidget(QWidget):
             lib_canvas = FigureCanvas(lib_fig)
             layout.addWidget(lib_canvas)
             
-            for label, entry in library.items():
-                wavelengths = list(map(int, entry['spectrum'].keys()))
-                pixel_data = list(entry['spectrum'].values())
-                lib_ax.plot(wavelengths, pixel_data, label=label)
+            for label, spectrum in zip(library.labels, library.spectra):
+                valid = ~np.isnan(spectrum)
+                lib_ax.plot(library.wavelengths[valid], spectrum[valid], label=label)
             
             lib_ax.set_xlabel("Wavelength (nm)")
             lib_ax.set_ylabel("Radiance (DN)")
@@ -252,14 +524,12 @@ class SAMComparisonWidget(QWidget):
     def __init__(self, image_data, metadata, library_path):
         super().__init__()
         self.image_data = image_data
-        self.metadata = metadata
+        self.metadata = as_metadata(metadata)
         self.library_path = library_path
         
         # State tracking
         self.selected_pixel = None
-        
-        # Load library
-        self.library = self._load_library()
+        self.scores = None
         
         self.init_ui()
     
@@ -272,62 +542,149 @@ class SAMComparisonWidget(QWidget):
         layout.addWidget(self.canvas)
         
         # RGB Image setup
-        self.rgb_image = create_rgb_image(self.image_data)
-        self.ax1.imshow(self.rgb_image)
+        self.fcc = FCCDisplay(self.image_data, self.metadata)
+        self.rgb_image = self.fcc.rgb_image
+        self.fcc.show(self.ax1)
         self.ax1.set_title("Click on RGB image to select a pixel")
         
+        # The selection marker is moved rather than the image redrawn
+        self.blit_manager = BlitManager(self.canvas)
+        self.marker, = self.ax1.plot([], [], 'o', color='red', markersize=10)
+        self.blit_manager.add_artist(self.marker)
+        self.blit_manager.add_artist(self.ax1.title)
+        
         # SAM Comparison Plot setup
         self.ax2.set_title("SAM Comparison")
         self.ax2.set_xlabel("Library Entry")
         self.ax2.set_ylabel("SAM Score (radians)")
         
+        # Controls
+        controls_layout = QHBoxLayout()
+        
+        # How library wavelengths are matched to the image bands
+        controls_layout.addWidget(QLabel("Band Matching:"))
+        self.resampling_input = QComboBox()
+        self.resampling_input.addItem("Nearest", 'nearest')
+        self.resampling_input.addItem("Gaussian SRF", 'gaussian')
+        controls_layout.addWidget(self.resampling_input)
+        
+        # Only the best matches are searched for and plotted
+        controls_layout.addWidget(QLabel("Top K:"))
+        self.top_k_input = QSpinBox()
+        self.top_k_input.setRange(1, 1000)
+        self.top_k_input.setValue(DEFAULT_TOP_K)
+        self.top_k_input.valueChanged.connect(self.refresh_comparison)
+        controls_layout.addWidget(self.top_k_input)
+        
+        # Match continuum-removed spectra (absorption features only)
+        self.continuum_input = QCheckBox("Continuum Removal")
+        self.continuum_input.toggled.connect(self.refresh_comparison)
+        controls_layout.addWidget(self.continuum_input)
+        
+        # Similarity metric and its confidence thresholds
+        controls_layout.addWidget(QLabel("Metric:"))
+        self.metric_input = create_metric_input()
+        self.metric_input.currentIndexChanged.connect(self.update_metric)
+        controls_layout.addWidget(self.metric_input)
+        controls_layout.addWidget(QLabel("High Confidence ≤"))
+        self.high_confidence_input = create_threshold_input()
+        controls_layout.addWidget(self.high_confidence_input)
+        controls_layout.addWidget(QLabel("Low Confidence ≤"))
+        self.low_confidence_input = create_threshold_input()
+        controls_layout.addWidget(self.low_confidence_input)
+        self.set_default_thresholds()
+        self.high_confidence_input.valueChanged.connect(self.update_thresholds)
+        self.low_confidence_input.valueChanged.connect(self.update_thresholds)
+        controls_layout.addStretch()
+        
+        layout.addLayout(controls_layout)
         self.setLayout(layout)
         
         # Connect click event
         self.canvas.mpl_connect('button_press_event', self.on_click)
     
-    def _load_library(self):
-        try:
-            if os.path.exists(self.library_path):
-                with open(self.library_path, 'r') as f:
-                    return json.load(f)
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Could not load library: {str(e)}")
-        return {}
+    def refresh_comparison(self):
+        if self.selected_pixel:
+            self.update_comparison_plot()
+    
+    def set_default_thresholds(self):
+        high, low = get_metric(self.metric_input.currentData()).thresholds
+        self.high_confidence_input.setValue(high)
+        self.low_confidence_input.setValue(low)
+    
+    def update_metric(self):
+        # Thresholds of one metric mean nothing for another
+        for spin_box in (self.high_confidence_input, self.low_confidence_input):
+            spin_box.blockSignals(True)
+        self.set_default_thresholds()
+        for spin_box in (self.high_confidence_input, self.low_confidence_input):
+            spin_box.blockSignals(False)
+        if self.selected_pixel:
+            self.update_comparison_plot()
+    
+    def update_thresholds(self):
+        # Only the colouring depends on the thresholds
+        if self.scores:
+            self.plot_scores(self.scores)
     
     def on_click(self, event):
         if event.inaxes == self.ax1:
+            click_time = time.perf_counter()
             row, col = int(event.ydata), int(event.xdata)
             self.selected_pixel = (row, col)
             
-            self.ax1.clear()
-            self.ax1.imshow(self.rgb_image)
-            self.ax1.scatter(col, row, color='red', s=100)
+            self.marker.set_data([col], [row])
             self.ax1.set_title(f"Selected Pixel: ({row}, {col})")
+            self.blit_manager.update(click_time)
             
+            # Scores are computed in the background; a newer click supersedes them
             self.update_comparison_plot()
-            
-            self.canvas.draw()
     
     def update_comparison_plot(self):
-        if not self.selected_pixel or not self.library:
+        if not self.selected_pixel:
             QMessageBox.warning(self, "Error", "No pixel or library data available!")
             return
         
-        try:
-            sam_scores = compare_pixel_to_library(
+        def compare(context, pixel, resampling, top_k, metric, continuum_removal):
+            # Always reflects entries saved since the tab was opened
+            return compare_pixel_to_library(
                 self.image_data, 
                 self.metadata, 
-                self.selected_pixel, 
-                self.library_path
+                pixel, 
+                self.library_path,
+                resampling=resampling,
+                top_k=top_k,
+                metric=metric,
+                continuum_removal=continuum_removal
             )
+        
+        get_task_runner().submit(
+            'sam-comparison',
+            compare,
+            self.selected_pixel,
+            self.resampling_input.currentData(),
+            self.top_k_input.value(),
+            self.metric_input.currentData(),
+            self.continuum_input.isChecked(),
+            on_result=self.plot_scores,
+            on_error=lambda error: QMessageBox.critical(self, "Error", f"SAM comparison failed: {error}"),
+            description=f"Comparing pixel {self.selected_pixel} to the library"
+        )
+    
+    def plot_scores(self, sam_scores):
+        try:
+            if not sam_scores:
+                QMessageBox.warning(self, "Error", "No pixel or library data available!")
+                return
+            self.scores = sam_scores
             
             labels = list(sam_scores.keys())
-            scores = [entry['sam_score'] for entry in sam_scores.values()]
+            scores = [entry['score'] for entry in sam_scores.values()]
+            metric = get_metric(next(iter(sam_scores.values()))['metric'])
             
             # Confidence thresholds
-            sam_high_confidence = 0.03
-            sam_low_confidence = 0.1
+            sam_high_confidence = self.high_confidence_input.value()
+            sam_low_confidence = self.low_confidence_input.value()
             
             # Determine color and best match for each confidence category
             colors = []
@@ -370,13 +727,13 @@ class SAMComparisonWidget(QWidget):
                 # Position text slightly above the bar
                 self.ax2.text(bar.get_x() + bar.get_width()/2, 
                             bar.get_height(), 
-                            f'{score:.4f}\n{conf_text}', 
+                            f'{score:.4g}\n{conf_text}', 
                             ha='center', 
                             va='bottom')
             
-            self.ax2.set_title(f"SAM Scores for Selected Pixel")
+            self.ax2.set_title(f"Best {len(sam_scores)} Matches for Selected Pixel")
             self.ax2.set_xlabel("Library Entry")
-            self.ax2.set_ylabel("SAM Score (radians)")
+            self.ax2.set_ylabel(f"{metric.label} ({metric.units})" if metric.units else metric.label)
             self.ax2.set_xticklabels(labels, rotation=45, ha='right')
             
             # Confidence lines
@@ -404,15 +761,251 @@ class SAMComparisonWidget(QWidget):
             self.ax2.legend(handles=legend_elements, loc='best', bbox_to_anchor=(1.05, 1), borderaxespad=0.)
             
             plt.tight_layout()
+            self.canvas.draw_idle()
         
         except Exception as e:
             QMessageBox.critical(self, "Error", f"SAM comparison failed: {str(e)}")
 
+class SAMClassificationWidget(QWidget):
+    def __init__(self, image_data, metadata, library_path):
+        super().__init__()
+        self.image_data = image_data
+        self.metadata = as_metadata(metadata)
+        self.library_path = library_path
+        
+        # Classification results
+        self.class_map = None
+        self.min_angle = None
+        self.labels = []
+        
+        self.init_ui()
+    
+    def init_ui(self):
+        layout = QVBoxLayout()
+        
+        # Matplotlib figure
+        self.figure, self.ax = plt.subplots(figsize=(8, 6))
+        self.canvas = FigureCanvas(self.figure)
+        layout.addWidget(self.canvas)
+        
+        # RGB Image setup
+        self.fcc = FCCDisplay(self.image_data, self.metadata)
+        self.rgb_image = self.fcc.rgb_image
+        self.fcc.show(self.ax)
+        self.ax.set_title("Classify the scene against the spectral library")
+        
+        # Controls
+        controls_layout = QHBoxLayout()
+        
+        # How library wavelengths are matched to the image bands
+        controls_layout.addWidget(QLabel("Band Matching:"))
+        self.resampling_input = QComboBox()
+        self.resampling_input.addItem("Nearest", 'nearest')
+        self.resampling_input.addItem("Gaussian SRF", 'gaussian')
+        controls_layout.addWidget(self.resampling_input)
+        
+        # Similarity metric used to assign classes
+        controls_layout.addWidget(QLabel("Metric:"))
+        self.metric_input = create_metric_input()
+        self.metric_input.currentIndexChanged.connect(self.update_metric)
+        controls_layout.addWidget(self.metric_input)
+        
+        # Maximum score for a pixel to be assigned a class (0 = no limit)
+        controls_layout.addWidget(QLabel("Max Score:"))
+        self.max_angle_input = create_threshold_input()
+        controls_layout.addWidget(self.max_angle_input)
+        self.update_metric()
+        
+        self.continuum_input = QCheckBox("Continuum Removal")
+        controls_layout.addWidget(self.continuum_input)
+        
+        # Overlay opacity
+        controls_layout.addWidget(QLabel("Opacity:"))
+        self.opacity_input = QDoubleSpinBox()
+        self.opacity_input.setRange(0.0, 1.0)
+        self.opacity_input.setSingleStep(0.1)
+        self.opacity_input.setValue(0.6)
+        self.opacity_input.valueChanged.connect(self.plot_class_map)
+        controls_layout.addWidget(self.opacity_input)
+        
+        # Number of worker processes for the scene pass
+        controls_layout.addWidget(QLabel("Workers:"))
+        self.workers_input = QSpinBox()
+        self.workers_input.setRange(1, max(64, default_workers()))
+        self.workers_input.setValue(default_workers())
+        controls_layout.addWidget(self.workers_input)
+        
+        # Classify button
+        classify_button = QPushButton("Classify Scene")
+        classify_button.clicked.connect(self.classify)
+        controls_layout.addWidget(classify_button)
+        
+        layout.addLayout(controls_layout)
+        
+        toolbar = NavigationToolbar2QT(self.canvas, self)
+        layout.addWidget(toolbar)
+        
+        self.setLayout(layout)
+    
+    def update_metric(self):
+        # Start from the metric's low-confidence limit
+        self.max_angle_input.setValue(get_metric(self.metric_input.currentData()).thresholds[1])
+    
+    def classify(self):
+        def run(context, resampling, max_angle, n_workers, metric, continuum_removal):
+            library = read_library_table(self.library_path)
+            wavelengths = get_wavelengths(self.metadata, self.image_data.shape[2])
+            compiled_library = compile_library(
+                library,
+                wavelengths,
+                resampling=resampling,
+                continuum_removal=continuum_removal
+            )
+            if len(compiled_library) == 0:
+                return None
+            
+            # The continuum-removed cube is cached, so classifying again is cheaper
+            image_data = self.image_data
+            if continuum_removal:
+                image_data = get_continuum_removed_cube(self.image_data, wavelengths,
+                                                        compiled_library.band_indices)
+            
+            context.check()
+            class_map, min_angle, _ = classify_scene(
+                image_data,
+                compiled_library,
+                max_angle=max_angle,
+                n_workers=n_workers,
+                progress=context.progress,
+                metric=metric
+            )
+            return class_map, min_angle, [str(label) for label in compiled_library.labels]
+        
+        # Runs in the background; clicking again restarts the classification
+        get_task_runner().submit(
+            'sam-classification',
+            run,
+            self.resampling_input.currentData(),
+            self.max_angle_input.value() or None,
+            self.workers_input.value(),
+            self.metric_input.currentData(),
+            self.continuum_input.isChecked(),
+            on_result=self.show_classification,
+            on_error=lambda error: QMessageBox.critical(self, "Error", f"SAM classification failed: {error}"),
+            description="Classifying scene"
+        )
+    
+    def show_classification(self, result):
+        if result is None:
+            QMessageBox.warning(self, "Error", "No library entries match the image wavelengths!")
+            return
+        self.class_map, self.min_angle, self.labels = result
+        self.plot_class_map()
+    
+    def plot_class_map(self):
+        if self.class_map is None:
+            return
+        
+        from matplotlib.colors import ListedColormap
+        from matplotlib.patches import Patch
+        
+        n_classes = len(self.labels)
+        colors = plt.get_cmap('tab20')(np.arange(n_classes) % 20)
+        
+        self.ax.clear()
+        self.fcc.show(self.ax)
+        self.ax.imshow(
+            np.ma.masked_less(self.class_map, 0),
+            cmap=ListedColormap(colors),
+            vmin=-0.5,
+            vmax=n_classes - 0.5,
+            alpha=self.opacity_input.value(),
+            interpolation='nearest'
+        )
+        self.ax.set_title("SAM Classification Map")
+        
+        legend_elements = [Patch(facecolor=color, label=label)
+                           for color, label in zip(colors, self.labels)]
+        self.ax.legend(handles=legend_elements, loc='upper left', bbox_to_anchor=(1.02, 1), borderaxespad=0.)
+        
+        self.canvas.draw()
+
+class ProfileDialog(QDialog):
+    """
+    Debug panel listing the spans, counters and histograms of the session
+    profile, refreshed while it is open.
+    """
+
+    COLUMNS = ("Kind", "Name", "Count", "Total (ms)", "Mean (ms)", "p95 (ms)", "Max (ms)")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Profile")
+        layout = QVBoxLayout()
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        layout.addWidget(self.table)
+
+        button_layout = QHBoxLayout()
+        reset_button = QPushButton("Reset")
+        reset_button.clicked.connect(self.reset)
+        save_button = QPushButton("Save Profile...")
+        save_button.clicked.connect(self.save_profile)
+        button_layout.addWidget(reset_button)
+        button_layout.addWidget(save_button)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+        self.resize(700, 500)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(PROFILE_REFRESH_MS)
+        self.refresh()
+
+    def refresh(self):
+        snapshot = profiler.snapshot()
+        rows = []
+        # Spans are durations in seconds, shown in milliseconds
+        for name, summary in snapshot['spans'].items():
+            rows.append(("span", name, summary['count']) + tuple(
+                f"{summary[key] * 1000.0:.2f}" for key in ('total', 'mean', 'p95', 'max')))
+        for name, summary in snapshot['histograms'].items():
+            rows.append(("histogram", name, summary['count']) + tuple(
+                f"{summary[key]:.6g}" for key in ('total', 'mean', 'p95', 'max')))
+        for name, value in snapshot['counters'].items():
+            rows.append(("counter", name, value, "", "", "", ""))
+
+        self.table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            for j, value in enumerate(row):
+                self.table.setItem(i, j, QTableWidgetItem(str(value)))
+
+    def reset(self):
+        profiler.reset()
+        self.refresh()
+
+    def save_profile(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Save Profile", "profile.json", "JSON Files (*.json)")
+        if not path:
+            return
+        try:
+            dump_profile(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Could not save profile: {str(e)}")
+
+    def done(self, result):
+        self.timer.stop()
+        super().done(result)
+
 class SpectralAnalysisTool(QMainWindow):
     def __init__(self, image_data, metadata, spectral_library):
         super().__init__()
+        start = time.perf_counter()
         self.image_data = image_data
-        self.metadata = metadata
+        self.metadata = as_metadata(metadata)
         self.spectral_library = spectral_library
         
         self.setWindowTitle("Spectral Analysis Toolbox")
@@ -430,19 +1023,119 @@ class SpectralAnalysisTool(QMainWindow):
         self.tabs = QTabWidget()
         main_layout.addWidget(self.tabs)
         
-        # Create tabs
-        self.visualization_tab = SpectralVisualizationWidget(self.image_data, self.metadata)
-        self.library_tab = SpectralLibraryCreationWidget(self.image_data, self.metadata, self.spectral_library)
-        self.sam_tab = SAMComparisonWidget(self.image_data, self.metadata, self.spectral_library)
+        # Tabs are built the first time they are shown: each one creates a
+        # figure and an FCC, and most sessions only use one or two of them
+        self.tab_specs = [
+            ('visualization_tab', "Spectral Visualization",
+             lambda: SpectralVisualizationWidget(self.image_data, self.metadata)),
+            ('library_tab', "Spectral Library Creation",
+             lambda: SpectralLibraryCreationWidget(self.image_data, self.metadata, self.spectral_library)),
+            ('sam_tab', "SAM Comparison",
+             lambda: SAMComparisonWidget(self.image_data, self.metadata, self.spectral_library)),
+            ('classification_tab', "SAM Classification",
+             lambda: SAMClassificationWidget(self.image_data, self.metadata, self.spectral_library)),
+        ]
+        # Seconds spent building the window and each tab
+        self.timings = {}
+        for attribute, title, _ in self.tab_specs:
+            setattr(self, attribute, None)
+            placeholder = QWidget()
+            placeholder.setLayout(QVBoxLayout())
+            placeholder.layout().setContentsMargins(0, 0, 0, 0)
+            self.tabs.addTab(placeholder, title)
+        self.tabs.currentChanged.connect(self.build_tab)
+        
+        # Status bar reporting background tasks
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.hide()
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(lambda: get_task_runner().cancel())
+        self.cancel_button.hide()
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+        
+        # Live timings of the slowest stages, only while profiling
+        # (SPECTRAVIS_PROFILE is set)
+        if profiler.enabled:
+            self.profile_label = QLabel()
+            self.profile_button = QPushButton("Profile")
+            self.profile_button.clicked.connect(self.show_profile)
+            self.statusBar().addPermanentWidget(self.profile_label)
+            self.statusBar().addPermanentWidget(self.profile_button)
+            self.profile_timer = QTimer(self)
+            self.profile_timer.timeout.connect(self.update_profile_status)
+            self.profile_timer.start(PROFILE_REFRESH_MS)
+        
+        task_runner = get_task_runner()
+        task_runner.message.connect(self.statusBar().showMessage)
+        task_runner.progress.connect(self.show_progress)
+        
+        self.build_tab(self.tabs.currentIndex())
+        self.timings['window'] = time.perf_counter() - start
+    
+    def build_tab(self, index):
+        """
+        Create the widget of a tab the first time it is shown.
+        
+        Parameters:
+        index (int): Tab index
+        
+        Returns:
+        QWidget: The tab's widget
+        """
+        if index < 0:
+            return None
+        attribute, title, factory = self.tab_specs[index]
+        widget = getattr(self, attribute)
+        if widget is None:
+            start = time.perf_counter()
+            with span(f"gui.{attribute}"):
+                widget = factory()
+            self.tabs.widget(index).layout().addWidget(widget)
+            setattr(self, attribute, widget)
+            self.timings[attribute] = time.perf_counter() - start
+            self.statusBar().showMessage(f"{title} ready in {self.timings[attribute]:.2f} s", 5000)
+        return widget
+    
+    def show_progress(self, done, total):
+        running = total >= 0
+        self.progress_bar.setVisible(running)
+        self.cancel_button.setVisible(running)
+        if running:
+            # A zero range shows a busy indicator while the amount of work is unknown
+            self.progress_bar.setRange(0, total)
+            self.progress_bar.setValue(done)
+    
+    def update_profile_status(self):
+        """Show the stages with the most total time in the status bar."""
+        spans = profiler.snapshot()['spans']
+        slowest = sorted(spans.items(), key=lambda item: -item[1]['total'])[:PROFILE_STATUS_SPANS]
+        self.profile_label.setText("  ".join(
+            f"{name}: {summary['count']}x {summary['mean'] * 1000.0:.1f} ms" for name, summary in slowest))
+    
+    def show_profile(self):
+        ProfileDialog(self).exec_()
+    
+    def closeEvent(self, event):
+        if profiler.enabled:
+            self.profile_timer.stop()
+        task_runner = get_task_runner()
+        task_runner.message.disconnect(self.statusBar().showMessage)
+        task_runner.progress.disconnect(self.show_progress)
+        # Stop background work before the widgets it reports to go away
+        task_runner.cancel()
+        task_runner.wait()
         
-        # Add tabs
-        self.tabs.addTab(self.visualization_tab, "Spectral Visualization")
-        self.tabs.addTab(self.library_tab, "Spectral Library Creation")
-        self.tabs.addTab(self.sam_tab, "SAM Comparison")
+        # Release the shared FCC renders, continuum hulls and transforms of this cube
+        render_cache.invalidate(self.image_data)
+        continuum_cache.invalidate(self.image_data)
+        transform_cache.invalidate(self.image_data)
+        super().closeEvent(event)
 
 def main():
     # Load the hyperspectral data cube
-    image_data = np.load('data/Salinas_corrected.npy')
+    image_data = load_cube('data/Salinas_corrected.npy')
 
     # Load the metadata
     with open('data/metadata.json', 'r') as f:
@@ -0,0 +1,340 @@
+"""
+Headless command-line interface for batch processing.
+
+    python spectravis.py classify CUBE LIBRARY -o classes.npy [--metric sid]
+    python spectravis.py extract CUBE --pixel 10,20 --transect 0,0,100,100 -o spectra.npy
+    python spectravis.py build-lib CUBE --entry grass=10,20 -o library.slib
+    python spectravis.py build-lib CUBE --labels ground_truth.npy -o library.slib
+    python spectravis.py stats CUBE -o stats.npz
+    python spectravis.py transform CUBE --method mnf -n 10 -o reduced.npy
+
+Only numpy and the utils modules a command needs are imported (never Qt or
+matplotlib), so it starts quickly and runs on servers without a display.
+Cubes are memory-mapped and processed in blocks of rows.
+"""
+import argparse
+import json
+import os
+import sys
+
+
+def _load_cube_and_metadata(args, required=True):
+    """
+    Open the cube and its metadata. ENVI headers provide the metadata
+    themselves; --metadata overrides it.
+    """
+    from utils.cubeIO import load_cube, load_envi
+    from utils.spectralMetadata import as_metadata
+
+    metadata = None
+    if args.cube.lower().endswith('.hdr'):
+        image_data, metadata = load_envi(args.cube)
+    else:
+        image_data = load_cube(args.cube)
+
+    if args.metadata:
+        with open(args.metadata, 'r') as f:
+            metadata = json.load(f)
+
+    # ENVI headers without wavelengths give no metadata
+    if not metadata or "band_to_wavelength" not in metadata:
+        if required:
+            raise SystemExit("error: no wavelength metadata; pass --metadata")
+        return image_data, None
+
+    metadata = as_metadata(metadata)
+    metadata.check_cube(image_data)
+    return image_data, metadata
+
+
+def _parse_pixel(text):
+    """'row,col' -> (row, col)"""
+    row, col = (int(v) for v in text.split(','))
+    return row, col
+
+
+def _collect_pixels(args):
+    import numpy as np
+    from utils.spectrumSelection import transect_pixels
+
+    pixels = [np.array(args.pixel or [], dtype=np.intp).reshape(-1, 2)]
+    if args.pixels:
+        if args.pixels.endswith('.npy'):
+            pixels.append(np.load(args.pixels).astype(np.intp).reshape(-1, 2))
+        else:
+            pixels.append(np.loadtxt(args.pixels, delimiter=',', dtype=np.intp, ndmin=2))
+    for transect in args.transect or []:
+        r0, c0, r1, c1 = (int(v) for v in transect.split(','))
+        pixels.append(transect_pixels((r0, c0), (r1, c1)))
+    return np.concatenate(pixels)
+
+
+def _check_pixels(image_data, pixels):
+    rows, cols = image_data.shape[:2]
+    outside = (pixels[:, 0] < 0) | (pixels[:, 0] >= rows) | (pixels[:, 1] < 0) | (pixels[:, 1] >= cols)
+    if outside.any():
+        raise SystemExit(f"error: pixel {tuple(pixels[outside][0].tolist())} lies outside the "
+                         f"{rows} x {cols} image")
+
+
+def cmd_classify(args):
+    import numpy as np
+    from utils.analyseSAM import compile_library
+    from utils.classifySAM import classify_scene
+    from utils.spectralLib import read_library_table
+    from utils.similarityMetrics import get_metric
+
+    try:
+        get_metric(args.metric)
+    except ValueError as e:
+        raise SystemExit(f"error: {e}")
+
+    image_data, metadata = _load_cube_and_metadata(args)
+    compiled_library = compile_library(read_library_table(args.library), metadata.wavelengths,
+                                       resampling=args.resampling, continuum_removal=args.continuum_removal)
+    if len(compiled_library) == 0:
+        raise SystemExit("error: no library entries match the image wavelengths")
+    if args.continuum_removal:
+        from utils.continuumRemoval import ContinuumRemovedCube
+        image_data = ContinuumRemovedCube(image_data, metadata.wavelengths, compiled_library.band_indices)
+
+    def progress(done, total):
+        if not args.quiet:
+            print(f"\rClassified {done}/{total} rows", end='', file=sys.stderr, flush=True)
+
+    class_map, min_angle, _ = classify_scene(
+        image_data,
+        compiled_library,
+        max_angle=args.max_angle,
+        rule_image_path=args.rule_image,
+        n_workers=args.workers,
+        progress=progress,
+        metric=args.metric
+    )
+    if not args.quiet:
+        print(file=sys.stderr)
+
+    np.save(args.output, class_map)
+    if args.min_angle:
+        np.save(args.min_angle, min_angle)
+
+    # Class indices refer to this label list; -1 marks unclassified pixels
+    labels_path = os.path.splitext(args.output)[0] + '.labels.json'
+    with open(labels_path, 'w') as f:
+        json.dump({"labels": [str(label) for label in compiled_library.labels],
+                   "unclassified": -1}, f, indent=4)
+
+    counts = np.bincount(class_map.ravel() + 1, minlength=len(compiled_library) + 1)
+    for label, count in zip(["(unclassified)"] + list(compiled_library.labels), counts):
+        print(f"{label}\t{count}")
+
+
+def cmd_extract(args):
+    import numpy as np
+    from utils.spectrumSelection import read_pixel_spectra
+
+    image_data, metadata = _load_cube_and_metadata(args, required=False)
+    pixels = _collect_pixels(args)
+    if len(pixels) == 0:
+        raise SystemExit("error: no pixels given (use --pixel, --pixels or --transect)")
+    _check_pixels(image_data, pixels)
+
+    np.save(args.output, read_pixel_spectra(image_data, pixels))
+    if args.pixels_output:
+        np.save(args.pixels_output, pixels)
+    if args.wavelengths_output:
+        if metadata is None:
+            raise SystemExit("error: --wavelengths-output needs wavelength metadata")
+        np.save(args.wavelengths_output, metadata.wavelengths[:image_data.shape[2]])
+    print(f"Extracted {len(pixels)} spectra to {args.output}")
+
+
+def cmd_build_lib(args):
+    import numpy as np
+    from utils.spectralLib import load_library, make_library_entry, write_library
+    from utils.spectrumSelection import read_pixel_spectra
+
+    image_data, metadata = _load_cube_and_metadata(args)
+    wavelengths = metadata.wavelengths[:image_data.shape[2]]
+
+    entries = []
+    for text in args.entry or []:
+        label, pixel = text.rsplit('=', 1)
+        entries.append((label, _parse_pixel(pixel)))
+    if args.entries:
+        with open(args.entries, 'r') as f:
+            for line in f:
+                if line.strip() and not line.lstrip().startswith('#'):
+                    label, row, col = (v.strip() for v in line.rsplit(',', 2))
+                    entries.append((label, (int(row), int(col))))
+    if not entries and not args.labels:
+        raise SystemExit("error: no entries given (use --entry, --entries or --labels)")
+
+    library = load_library(args.output) if args.append and os.path.exists(args.output) else {}
+
+    if args.labels:
+        from utils.libraryBuilder import (build_class_library, class_names_path, default_ignore_labels,
+                                          load_class_names, load_label_raster)
+
+        labels = load_label_raster(args.labels)
+        names_path = args.class_names or class_names_path(args.labels)
+        class_names = load_class_names(names_path) if names_path else None
+        # A class map from classify marks unclassified pixels with -1, not 0
+        ignore_labels = tuple(args.ignore) if args.ignore else default_ignore_labels(names_path)
+        classes = build_class_library(image_data, labels, wavelengths, class_names,
+                                      ignore_labels=ignore_labels, min_count=args.min_count)
+        for label, entry in classes.items():
+            print(f"{label}\t{entry['pixel_count']}")
+        library.update(classes)
+
+    if entries:
+        pixels = np.array([pixel for _, pixel in entries], dtype=np.intp)
+        _check_pixels(image_data, pixels)
+        spectra = read_pixel_spectra(image_data, pixels)
+        for (label, _), spectrum in zip(entries, spectra):
+            library[label] = make_library_entry(label, wavelengths, spectrum)
+
+    write_library(args.output, library)
+    print(f"Wrote {len(library)} entries to {args.output}")
+
+
+def cmd_stats(args):
+    import numpy as np
+    from utils.bandStatistics import compute_band_statistics
+
+    image_data, metadata = _load_cube_and_metadata(args, required=False)
+    stats = compute_band_statistics(image_data, n_workers=args.workers)
+    if metadata is not None:
+        stats['wavelength'] = metadata.wavelengths[:image_data.shape[2]]
+
+    if args.output and args.output.endswith('.npz'):
+        np.savez(args.output, **stats)
+        return
+
+    columns = [key for key in ('wavelength', 'mean', 'std', 'min', 'max') if key in stats]
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({key: np.asarray(value).tolist() for key, value in stats.items()}, f, indent=4)
+        return
+
+    print(f"# {stats['count']} pixels")
+    print("band\t" + "\t".join(columns))
+    for band in range(image_data.shape[2]):
+        print(f"{band + 1}\t" + "\t".join(f"{stats[key][band]:.6g}" for key in columns))
+
+
+def cmd_transform(args):
+    from utils.pcaTransform import ProjectedCube, load_or_fit_transform
+
+    image_data, metadata = _load_cube_and_metadata(args, required=False)
+    band_mask = metadata.band_mask if metadata is not None else None
+
+    def reporter(verb):
+        def progress(done, total):
+            if not args.quiet:
+                end = '\n' if done == total else ''
+                print(f"\r{verb} {done}/{total} rows", end=end, file=sys.stderr, flush=True)
+        return progress
+
+    transform = load_or_fit_transform(image_data, args.method, band_mask, path=args.transform,
+                                      n_workers=args.workers, progress=reporter("Fitted"))
+    if args.output:
+        ProjectedCube(image_data, transform, args.components).materialize(args.output, args.workers,
+                                                                           reporter("Projected"))
+
+    ratio = transform.explained_variance_ratio
+    print(f"# {args.method.upper()} of {transform.n_pixels} pixels, {len(transform.mean)} bands")
+    print("component\teigenvalue\tratio\tcumulative")
+    for i in range(min(args.components, transform.n_components)):
+        print(f"{i + 1}\t{transform.eigenvalues[i]:.6g}\t{ratio[i]:.4f}\t{ratio[:i + 1].sum():.4f}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='spectravis', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profile', metavar='JSON',
+                        help="Time the processing stages and write the profile to this JSON file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_cube_arguments(subparser):
+        subparser.add_argument('cube', help="Cube (.npy, or ENVI .hdr header)")
+        subparser.add_argument('--metadata', help="Metadata JSON with band_to_wavelength")
+
+    classify = subparsers.add_parser('classify', help="Classify every pixel against a spectral library")
+    add_cube_arguments(classify)
+    classify.add_argument('library', help="Spectral library (.json or .slib)")
+    classify.add_argument('-o', '--output', required=True, help="Class map output (.npy, int32, -1 = unclassified)")
+    classify.add_argument('--metric', default='sam',
+                          help="Similarity metric: sam, sid, scm, euclidean or sid_sam (default: sam)")
+    classify.add_argument('--min-angle', help="Also write the best score per pixel to this .npy file")
+    classify.add_argument('--rule-image', help="Also write the score to every entry to this .npy file")
+    classify.add_argument('--max-angle', '--max-score', dest='max_angle', type=float,
+                          help="Leave pixels whose best score is above this unclassified (radians for SAM)")
+    classify.add_argument('--resampling', default='nearest', choices=('nearest', 'gaussian'),
+                          help="How library wavelengths are matched to the image bands")
+    classify.add_argument('--continuum-removal', action='store_true',
+                          help="Match continuum-removed spectra (cube and library divided by their convex hull)")
+    classify.add_argument('--workers', type=int, default=None, help="Worker processes (default: all CPUs)")
+    classify.add_argument('-q', '--quiet', action='store_true', help="Do not report progress")
+    classify.set_defaults(func=cmd_classify)
+
+    extract = subparsers.add_parser('extract', help="Extract pixel spectra to a .npy file")
+    add_cube_arguments(extract)
+    extract.add_argument('--pixel', type=_parse_pixel, action='append', help="Pixel as row,col (repeatable)")
+    extract.add_argument('--pixels', help="Pixels as an (n, 2) .npy file or row,col text file")
+    extract.add_argument('--transect', action='append', help="Every pixel on the line row0,col0,row1,col1 (repeatable)")
+    extract.add_argument('-o', '--output', required=True, help="Spectra output (.npy, pixels x bands)")
+    extract.add_argument('--pixels-output', help="Also write the (n, 2) pixel coordinates to this .npy file")
+    extract.add_argument('--wavelengths-output', help="Also write the band wavelengths to this .npy file")
+    extract.set_defaults(func=cmd_extract)
+
+    build_lib = subparsers.add_parser('build-lib', help="Build a spectral library from labelled pixels")
+    add_cube_arguments(build_lib)
+    build_lib.add_argument('--entry', action='append', help="Entry as label=row,col (repeatable)")
+    build_lib.add_argument('--entries', help="Text file with one label,row,col per line")
+    build_lib.add_argument('--labels', help="Ground-truth class map aligned to the cube (.npy or ENVI .hdr); "
+                                            "adds the mean spectrum of every class")
+    build_lib.add_argument('--class-names', help="Class names as JSON (default: <labels>.labels.json if present)")
+    build_lib.add_argument('--ignore', type=int, action='append',
+                           help="Label that is not a class (repeatable; default: 0, or -1 for a classify map)")
+    build_lib.add_argument('--min-count', type=int, default=1, help="Leave out classes with fewer pixels")
+    build_lib.add_argument('-o', '--output', required=True, help="Library output (.slib for binary, otherwise JSON)")
+    build_lib.add_argument('--append', action='store_true', help="Add to the existing library instead of replacing it")
+    build_lib.set_defaults(func=cmd_build_lib)
+
+    stats = subparsers.add_parser('stats', help="Per-band statistics over the whole cube")
+    add_cube_arguments(stats)
+    stats.add_argument('-o', '--output', help="Output (.npz or JSON); printed as a table if omitted")
+    stats.add_argument('--workers', type=int, default=1, help="Worker processes")
+    stats.set_defaults(func=cmd_stats)
+
+    transform = subparsers.add_parser('transform', help="Fit a PCA/MNF transform and write the reduced cube")
+    add_cube_arguments(transform)
+    transform.add_argument('--method', default='pca', choices=('pca', 'mnf'),
+                           help="Principal components, or minimum noise fraction (ordered by signal-to-noise)")
+    transform.add_argument('-n', '--components', type=int, default=10, help="Number of leading components")
+    transform.add_argument('-o', '--output', help="Reduced cube output (.npy, float32, rows x cols x components)")
+    transform.add_argument('--transform', help="Transform file to reuse or write "
+                                               "(default: <cube>.<method>.npz next to a .npy/ENVI cube)")
+    transform.add_argument('--workers', type=int, default=1, help="Worker processes")
+    transform.add_argument('-q', '--quiet', action='store_true', help="Do not report progress")
+    transform.set_defaults(func=cmd_transform)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile is None:
+        args.func(args)
+        return
+
+    from utils.instrumentation import dump_profile, profiler
+    profiler.set_enabled(True)
+    try:
+        args.func(args)
+    finally:
+        dump_profile(args.profile)
+
+
+if __name__ == "__main__":
+    main()
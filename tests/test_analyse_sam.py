@@ -0,0 +1,53 @@
+import json
+import numpy as np
+from utils.analyseSAM import calculate_sam_score, compare_pixel_to_library
+
+N_BANDS = 16
+WAVELENGTHS = [400 + 20 * band for band in range(N_BANDS)]
+METADATA = {"band_to_wavelength": {str(b): [b, float(w)] for b, w in enumerate(WAVELENGTHS, start=1)}}
+
+
+def reference_scores(pixel_spectrum, library):
+    """The original per-entry loop over the wavelengths both spectra share."""
+    pixel = dict(zip(WAVELENGTHS, pixel_spectrum))
+    scores = {}
+    for label, entry in library.items():
+        spectrum = {int(float(k)): v for k, v in entry['spectrum'].items()}
+        common = sorted(set(pixel) & set(spectrum))
+        if common:
+            scores[label] = calculate_sam_score(np.array([pixel[w] for w in common], dtype=np.float64),
+                                                np.array([spectrum[w] for w in common], dtype=np.float64))
+    return scores
+
+
+def make_library(rng, n_entries=40):
+    library = {}
+    for i in range(n_entries):
+        # Some entries cover only part of the cube's range
+        bands = range(N_BANDS) if i % 3 else range(i % N_BANDS, N_BANDS)
+        library[f"entry_{i}"] = {"spectrum": {str(WAVELENGTHS[b]): int(rng.integers(100, 5000)) for b in bands},
+                                 "pixel_coords": [i, i]}
+    return library
+
+
+def test_ranking_matches_per_entry_loop(tmp_path):
+    rng = np.random.default_rng(0)
+    library = make_library(rng)
+    library_path = str(tmp_path / "library.json")
+    with open(library_path, 'w') as f:
+        json.dump(library, f)
+    cube = rng.integers(100, 5000, (3, 3, N_BANDS)).astype(np.int16)
+
+    for pixel in [(0, 0), (1, 2), (2, 1)]:
+        expected = reference_scores(cube[pixel], library)
+        scores = compare_pixel_to_library(cube, METADATA, pixel, library_path)
+
+        assert set(scores) == set(expected)
+        for label, result in scores.items():
+            assert abs(result['sam_score'] - expected[label]) < 1e-5
+            assert result['pixel_coords'] == library[label]['pixel_coords']
+        ranked = [scores[label]['sam_score'] for label in scores]
+        assert ranked == sorted(ranked)
+
+        top = compare_pixel_to_library(cube, METADATA, pixel, library_path, top_k=5)
+        assert list(top) == sorted(expected, key=expected.get)[:5]
@@ -0,0 +1,54 @@
+import numpy as np
+from utils.bandAlignment import build_band_alignment
+
+# Cube bands every 10 nm; the library is sampled 3 nm off the cube grid and
+# covers only part of the cube's range
+CUBE_WAVELENGTHS = np.arange(400.0, 1001.0, 10.0)
+LIBRARY_WAVELENGTHS = np.arange(423.0, 904.0, 10.0)
+
+
+def library_spectra():
+    rng = np.random.default_rng(0)
+    return rng.uniform(100, 1000, (5, len(LIBRARY_WAVELENGTHS)))
+
+
+def test_nearest_alignment_on_a_shifted_grid():
+    alignment = build_band_alignment(LIBRARY_WAVELENGTHS, CUBE_WAVELENGTHS, 'nearest')
+
+    # Every cube band within half a band spacing of a library sample
+    expected = [band for band, w in enumerate(CUBE_WAVELENGTHS) if np.abs(LIBRARY_WAVELENGTHS - w).min() <= 5.0]
+    np.testing.assert_array_equal(alignment.band_indices, expected)
+    np.testing.assert_array_equal(LIBRARY_WAVELENGTHS[alignment.index_map],
+                                  CUBE_WAVELENGTHS[alignment.band_indices] + 3.0)
+
+    spectra = library_spectra()
+    np.testing.assert_allclose(alignment.apply(spectra), spectra[:, alignment.index_map], rtol=1e-6)
+
+
+def test_gaussian_alignment_on_a_shifted_grid():
+    alignment = build_band_alignment(LIBRARY_WAVELENGTHS, CUBE_WAVELENGTHS, 'gaussian', fwhm=20.0)
+    covered = CUBE_WAVELENGTHS[alignment.band_indices]
+    assert covered.min() >= LIBRARY_WAVELENGTHS.min() and covered.max() <= LIBRARY_WAVELENGTHS.max()
+
+    spectra = library_spectra()
+    resampled = alignment.apply(spectra)
+    sigma = 20.0 / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+    for column, centre in enumerate(covered):
+        # Gaussian spectral response truncated at three standard deviations
+        offsets = (LIBRARY_WAVELENGTHS - centre) / sigma
+        weights = np.where(np.abs(offsets) <= 3.0, np.exp(-0.5 * offsets ** 2), 0.0)
+        expected = spectra @ weights / weights.sum()
+        np.testing.assert_allclose(resampled[:, column], expected, rtol=1e-5)
+
+
+def test_gaussian_alignment_skips_missing_values():
+    alignment = build_band_alignment(LIBRARY_WAVELENGTHS, CUBE_WAVELENGTHS, 'gaussian', fwhm=20.0)
+    spectra = np.full((1, len(LIBRARY_WAVELENGTHS)), 500.0)
+    spectra[0, 10:20] = np.nan
+
+    resampled = alignment.apply(spectra)[0]
+    measured = ~np.isnan(resampled)
+    np.testing.assert_allclose(resampled[measured], 500.0, rtol=1e-6)
+    # Bands whose whole response falls on missing values stay NaN
+    covered = CUBE_WAVELENGTHS[alignment.band_indices]
+    assert not measured[(covered > LIBRARY_WAVELENGTHS[11]) & (covered < LIBRARY_WAVELENGTHS[18])].any()
@@ -0,0 +1,65 @@
+import json
+import numpy as np
+import pytest
+import spectravis
+
+WAVELENGTHS = [450.0, 550.0, 650.0, 750.0, 850.0]
+
+
+def write_envi(tmp_path, cube, wavelengths=None):
+    """Write a BSQ int16 ENVI cube, with or without a wavelength list."""
+    rows, cols, bands = cube.shape
+    header = ["ENVI", f"samples = {cols}", f"lines = {rows}", f"bands = {bands}",
+              "header offset = 0", "data type = 2", "interleave = bsq", "byte order = 0"]
+    if wavelengths is not None:
+        header.append("wavelength = { " + ", ".join(str(w) for w in wavelengths) + " }")
+    header_path = tmp_path / "cube.hdr"
+    header_path.write_text("\n".join(header) + "\n")
+    cube.transpose(2, 0, 1).astype('<i2').tofile(tmp_path / "cube.img")
+    return str(header_path)
+
+
+def write_metadata(tmp_path):
+    path = tmp_path / "metadata.json"
+    path.write_text(json.dumps({"band_to_wavelength": {str(b): [b, w] for b, w in enumerate(WAVELENGTHS, start=1)}}))
+    return str(path)
+
+
+@pytest.fixture
+def cube():
+    rng = np.random.default_rng(0)
+    return rng.integers(100, 1000, (6, 4, len(WAVELENGTHS))).astype(np.int16)
+
+
+def test_header_without_wavelengths_stats(tmp_path, cube):
+    header_path = write_envi(tmp_path, cube)
+    output = tmp_path / "stats.npz"
+    spectravis.main(['stats', header_path, '-o', str(output)])
+    with np.load(output) as stats:
+        assert stats['count'] == 24
+        np.testing.assert_allclose(stats['mean'], cube.reshape(-1, cube.shape[2]).mean(axis=0))
+
+
+def test_header_without_wavelengths_extract(tmp_path, cube):
+    header_path = write_envi(tmp_path, cube)
+    output = tmp_path / "spectra.npy"
+    spectravis.main(['extract', header_path, '--pixel', '2,3', '-o', str(output)])
+    np.testing.assert_array_equal(np.load(output)[0], cube[2, 3])
+
+
+def test_header_without_wavelengths_uses_metadata_option(tmp_path, cube):
+    header_path = write_envi(tmp_path, cube)
+    library_path = tmp_path / "library.json"
+    library_path.write_text(json.dumps({
+        "a": {"label": "a", "spectrum": {str(int(w)): int(v) for w, v in zip(WAVELENGTHS, cube[0, 0])}},
+    }))
+    output = tmp_path / "classes.npy"
+    spectravis.main(['classify', header_path, str(library_path), '--metadata', write_metadata(tmp_path),
+                     '-o', str(output), '--workers', '1', '-q'])
+    assert np.load(output)[0, 0] == 0
+
+
+def test_header_without_wavelengths_requires_metadata(tmp_path, cube):
+    header_path = write_envi(tmp_path, cube)
+    with pytest.raises(SystemExit):
+        spectravis.main(['classify', header_path, str(tmp_path / "library.json"), '-o', str(tmp_path / "c.npy")])
@@ -0,0 +1,65 @@
+import numpy as np
+from utils.analyseSAM import compare_pixel_to_library, compile_library
+from utils.FCC import STRETCH_MODES, get_rgb_image
+from utils.continuumRemoval import (ContinuumRemovedCube, continuum_hull, get_continuum_removed_cube,
+                                   remove_continuum)
+
+WAVELENGTHS = np.linspace(400.0, 1000.0, 12)
+
+
+def reference_hull(spectrum, wavelengths):
+    """Upper hull of one spectrum, one band at a time."""
+    hull = []
+    for band in range(len(spectrum)):
+        while len(hull) >= 2:
+            a, b = hull[-2], hull[-1]
+            cross = ((wavelengths[b] - wavelengths[a]) * (spectrum[band] - spectrum[a])
+                     - (spectrum[b] - spectrum[a]) * (wavelengths[band] - wavelengths[a]))
+            if cross < 0:
+                break
+            hull.pop()
+        hull.append(band)
+    return np.interp(wavelengths, wavelengths[hull], spectrum[hull])
+
+
+def test_hull_matches_reference():
+    spectra = np.random.default_rng(0).uniform(100, 1000, (20, len(WAVELENGTHS)))
+    hulls = continuum_hull(spectra, WAVELENGTHS)
+    for spectrum, hull in zip(spectra, hulls):
+        np.testing.assert_allclose(hull, reference_hull(spectrum, WAVELENGTHS), rtol=1e-5)
+
+
+def test_band_mask_restricts_hull():
+    spectra = np.random.default_rng(1).uniform(100, 1000, (5, len(WAVELENGTHS)))
+    bands = np.arange(3, 9)
+    cube = ContinuumRemovedCube(spectra[np.newaxis], WAVELENGTHS, bands)
+    np.testing.assert_allclose(cube[0][:, bands], remove_continuum(spectra[:, bands], WAVELENGTHS[bands]),
+                               rtol=1e-5)
+    assert not cube[0][:, :3].any() and not cube[0][:, 9:].any()
+
+
+def test_partially_covering_library_matches_its_own_pixel():
+    # An absorption feature in the covered bands, and a peak outside them
+    # that would lift the whole-cube hull over the covered bands
+    pixel = np.full(len(WAVELENGTHS), 500.0)
+    pixel[6] = 300.0
+    pixel[-1] = 2000.0
+    covered = slice(0, 9)
+    library = {"material": {"spectrum": {str(w): float(v)
+                                         for w, v in zip(WAVELENGTHS[covered], pixel[covered])}}}
+    cube = pixel[np.newaxis, np.newaxis, :]
+    metadata = {"band_to_wavelength": {str(b): [b, float(w)] for b, w in enumerate(WAVELENGTHS, start=1)}}
+
+    compiled = compile_library(library, WAVELENGTHS, continuum_removal=True)
+    assert len(compiled.band_indices) == 9
+    scores = compare_pixel_to_library(cube, metadata, (0, 0), compiled_library=compiled, continuum_removal=True)
+    assert scores["material"]["sam_score"] < 1e-3
+
+
+def test_fcc_renders_do_not_evict_continuum_cubes():
+    cube = np.random.default_rng(2).uniform(100, 1000, (6, 5, len(WAVELENGTHS)))
+    removed = get_continuum_removed_cube(cube, WAVELENGTHS)
+    for band in range(len(WAVELENGTHS) - 2):
+        for stretch in STRETCH_MODES:
+            get_rgb_image(cube, bands=(band, band + 1, band + 2), stretch=stretch)
+    assert get_continuum_removed_cube(cube, WAVELENGTHS) is removed
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from utils.FCC import STRETCH_MODES, FCCRenderCache, compute_stretch, create_rgb_image
+from utils.overviewPyramid import OverviewPyramid
+
+BANDS = (2, 1, 0)
+
+
+def nodata_cube():
+    cube = np.random.default_rng(0).uniform(100, 1000, (40, 30, 4)).astype(np.float32)
+    cube[3, 4, :] = np.nan
+    cube[10, :, 1] = np.nan
+    return cube
+
+
+@pytest.mark.parametrize('stretch', STRETCH_MODES)
+def test_nan_pixels_do_not_spread(stretch):
+    cube = nodata_cube()
+    rgb = create_rgb_image(cube, bands=BANDS, stretch=stretch)
+
+    nodata = np.isnan(cube[:, :, list(BANDS)])
+    assert np.isfinite(rgb).all()
+    assert (rgb[nodata] == 0).all()
+    assert rgb[~nodata].max() > 0.9 and rgb[~nodata].min() < 0.1
+
+
+@pytest.mark.parametrize('stretch', STRETCH_MODES)
+def test_pyramid_ignores_nan_pixels(stretch):
+    pyramid = OverviewPyramid(nodata_cube(), BANDS, n_levels=2, stretch=stretch)
+    assert np.isfinite(pyramid.stretch.lower).all() and np.isfinite(pyramid.stretch.upper).all()
+    assert np.isfinite(pyramid.normalize(pyramid.levels[0])).all()
+
+
+def test_all_nan_channel_has_no_range():
+    cube = nodata_cube()
+    cube[:, :, 0] = np.nan
+    fcc_stretch = compute_stretch(cube, BANDS, 'percentile')
+    assert fcc_stretch.lower[2] == fcc_stretch.upper[2] == 0
+
+
+def test_percentile_lists_share_the_cached_composite():
+    cache = FCCRenderCache()
+    cube = nodata_cube()
+    rgb = cache.get(cube, bands=BANDS, stretch='percentile', percentiles=[2, 98])
+    assert cache.get(cube, bands=BANDS, stretch='percentile', percentiles=(2.0, 98.0)) is rgb
+    assert len(cache) == 1
+
+
+def hot_pixel_cube():
+    cube = nodata_cube()
+    cube[5, 5:8, :] = 1e6
+    return cube
+
+
+def test_percentile_stretch_clips_hot_pixels():
+    cube = hot_pixel_cube()
+    fcc_stretch = compute_stretch(cube, BANDS, 'percentile', percentiles=(2, 98))
+
+    for channel, band in enumerate(BANDS):
+        values = cube[:, :, band][np.isfinite(cube[:, :, band])]
+        lower, upper = np.percentile(values, (2, 98))
+        assert fcc_stretch.lower[channel] == pytest.approx(lower, rel=1e-5)
+        assert fcc_stretch.upper[channel] == pytest.approx(upper, rel=1e-5)
+        assert fcc_stretch.upper[channel] < 1000
+
+    rgb = create_rgb_image(cube, bands=BANDS, stretch='percentile', percentiles=(2, 98))
+    assert (rgb[5, 5:8] == 1).all()
+    # Only the clipped upper tail saturates
+    assert np.mean(rgb == 1) == pytest.approx(0.02, abs=0.005)
+
+
+def test_equalize_stretch_flattens_the_histogram():
+    cube = hot_pixel_cube()
+    rgb = create_rgb_image(cube, bands=BANDS, stretch='equalize')
+
+    valid = np.isfinite(cube[:, :, list(BANDS)])
+    for channel in range(3):
+        values = rgb[..., channel][valid[..., channel]]
+        # Each quarter of the output range holds about a quarter of the pixels
+        counts, _ = np.histogram(values, bins=4, range=(0, 1))
+        np.testing.assert_allclose(counts / len(values), 0.25, atol=0.03)
+    assert (rgb[5, 5:8] == 1).all()
+    assert (rgb[~valid] == 0).all()
@@ -0,0 +1,60 @@
+import json
+import numpy as np
+import spectravis
+from utils.libraryBuilder import class_statistics
+
+WAVELENGTHS = [450.0, 550.0, 650.0, 750.0, 850.0]
+
+# Four clearly different materials
+MATERIALS = {
+    "Black": [100, 110, 120, 130, 140],
+    "Green": [200, 900, 300, 800, 250],
+    "Dry": [900, 850, 800, 750, 700],
+    "Brown": [300, 400, 600, 800, 1000],
+}
+
+
+def test_class_statistics_matches_per_class_reference():
+    rng = np.random.default_rng(0)
+    cube = rng.normal(500.0, 50.0, (20, 15, 4))
+    labels = rng.integers(0, 4, (20, 15))
+    stats = class_statistics(cube, labels, ignore_labels=(0,), max_block_elements=100)
+
+    np.testing.assert_array_equal(stats['classes'], [1, 2, 3])
+    for i, value in enumerate(stats['classes']):
+        pixels = cube[labels == value]
+        assert stats['pixel_count'][i] == len(pixels)
+        np.testing.assert_allclose(stats['mean'][i], pixels.mean(axis=0))
+        np.testing.assert_allclose(stats['variance'][i], pixels.var(axis=0))
+
+
+def test_classify_map_round_trips_to_library(tmp_path):
+    # One material per row block, so classify assigns every library class
+    spectra = np.array(list(MATERIALS.values()), dtype=np.int16)
+    cube = np.repeat(spectra, 3, axis=0)[:, np.newaxis, :].repeat(5, axis=1)
+    np.save(tmp_path / "cube.npy", cube)
+
+    metadata_path = tmp_path / "metadata.json"
+    metadata_path.write_text(json.dumps(
+        {"band_to_wavelength": {str(b): [b, w] for b, w in enumerate(WAVELENGTHS, start=1)}}))
+    library_path = tmp_path / "library.json"
+    library_path.write_text(json.dumps({
+        label: {"label": label, "spectrum": {str(int(w)): v for w, v in zip(WAVELENGTHS, values)}}
+        for label, values in MATERIALS.items()
+    }))
+
+    classes_path = tmp_path / "classes.npy"
+    spectravis.main(['classify', str(tmp_path / "cube.npy"), str(library_path), '--metadata', str(metadata_path),
+                     '-o', str(classes_path), '--workers', '1', '-q'])
+    assert set(np.unique(np.load(classes_path))) == {0, 1, 2, 3}
+
+    output = tmp_path / "rebuilt.json"
+    spectravis.main(['build-lib', str(tmp_path / "cube.npy"), '--metadata', str(metadata_path),
+                     '--labels', str(classes_path), '-o', str(output)])
+    with open(output) as f:
+        rebuilt = json.load(f)
+
+    assert list(rebuilt) == list(MATERIALS)
+    for label, values in MATERIALS.items():
+        assert rebuilt[label]['pixel_count'] == 15
+        assert list(rebuilt[label]['spectrum'].values()) == values
@@ -0,0 +1,47 @@
+import os
+import numpy as np
+from benchmarks.synthetic import synthetic_library, synthetic_wavelengths
+from utils.analyseSAM import compile_library
+from utils.libraryIndex import INDEX_SUFFIX, SpectralAngleIndex, get_library_index
+
+
+def compiled_library(n_entries=2000, n_bands=30):
+    return compile_library(synthetic_library(n_entries, n_bands), synthetic_wavelengths(n_bands))
+
+
+def exhaustive_top_k(library, spectrum, k):
+    scores = library.score_spectrum(spectrum)
+    return np.argsort(scores, kind='stable')[:k]
+
+
+def test_search_matches_exhaustive():
+    library = compiled_library()
+    index = SpectralAngleIndex.build(library)
+    rng = np.random.default_rng(1)
+    for spectrum in library.matrix[rng.integers(0, len(library), 5)] * 1000 + rng.normal(0, 1, (5, 30)):
+        indices, _ = index.search(spectrum, k=10)
+        assert set(indices) == set(exhaustive_top_k(library, spectrum, 10))
+
+
+def test_save_leaves_no_temp_files(tmp_path):
+    library = compiled_library(200)
+    index_path = str(tmp_path / ("library.json" + INDEX_SUFFIX))
+    SpectralAngleIndex.build(library).save(index_path)
+    SpectralAngleIndex.build(library).save(index_path)
+    assert os.listdir(tmp_path) == ["library.json" + INDEX_SUFFIX]
+    assert SpectralAngleIndex.load(index_path, library) is not None
+
+
+def test_corrupt_index_is_rebuilt(tmp_path):
+    library = compiled_library(200)
+    library_path = str(tmp_path / "library.json")
+    index_path = library_path + INDEX_SUFFIX
+    get_library_index(library, library_path)
+
+    # Truncate the saved index, as an interrupted write would
+    with open(index_path, 'r+b') as f:
+        f.truncate(os.path.getsize(index_path) // 2)
+    assert SpectralAngleIndex.load(index_path, library) is None
+
+    rebuilt = get_library_index(compile_library(synthetic_library(200, 30), synthetic_wavelengths(30)), library_path)
+    assert SpectralAngleIndex.load(index_path, rebuilt.compiled_library) is not None
@@ -0,0 +1,35 @@
+import numpy as np
+from utils.parallelTiles import SharedCube, attach_cube, iter_tiled
+
+
+def tile_sums(tile):
+    return tile.sum(axis=(1, 2))
+
+
+def test_memmap_views_attach_without_a_copy(tmp_path):
+    path = str(tmp_path / "cube.npy")
+    np.save(path, np.arange(24 * 10 * 6, dtype=np.float32).reshape(24, 10, 6))
+    cube = np.load(path, mmap_mode='r')
+
+    for view in (cube, cube[5:17], cube[3:, 2:8, 1:4], cube[::2]):
+        with SharedCube(view) as shared:
+            assert shared.handle['kind'] == 'memmap'
+            np.testing.assert_array_equal(attach_cube(shared.handle), view)
+
+
+def test_in_memory_views_use_shared_memory():
+    view = np.arange(60, dtype=np.float32).reshape(5, 4, 3)[1:]
+    with SharedCube(view) as shared:
+        assert shared.handle['kind'] == 'shm'
+        np.testing.assert_array_equal(attach_cube(shared.handle), view)
+
+
+def test_workers_match_a_serial_pass(tmp_path):
+    path = str(tmp_path / "cube.npy")
+    np.save(path, np.random.default_rng(0).uniform(0, 1, (30, 8, 5)).astype(np.float32))
+    cube = np.load(path, mmap_mode='r')[4:]
+
+    serial = np.concatenate([sums for _, sums in iter_tiled(tile_sums, cube, n_workers=1, tile_rows=7)])
+    parallel = np.concatenate([sums for _, sums in iter_tiled(tile_sums, cube, n_workers=2, tile_rows=7)])
+    np.testing.assert_allclose(parallel, serial)
+    np.testing.assert_allclose(serial, cube.sum(axis=(1, 2)), rtol=1e-5)
@@ -0,0 +1,44 @@
+import os
+import numpy as np
+from benchmarks.synthetic import synthetic_cube
+from utils.FCC import STRETCH_MODES, get_rgb_image
+from utils.pcaTransform import (ProjectedCube, SpectralTransform, fit_transform, get_component_cube, get_transform,
+                                load_or_fit_transform)
+
+
+def test_fit_matches_covariance_eigendecomposition():
+    cube = synthetic_cube((40, 30, 12))
+    transform = fit_transform(cube, 'pca', tile_rows=7)
+    pixels = cube.reshape(-1, 12).astype(np.float64)
+    eigenvalues = np.linalg.eigvalsh(np.cov(pixels, rowvar=False))[::-1]
+    np.testing.assert_allclose(transform.eigenvalues, eigenvalues, rtol=1e-8, atol=1e-6 * eigenvalues[0])
+
+    scores = ProjectedCube(cube, transform, 3)[5:30:2, 3:20]
+    expected = (pixels - pixels.mean(axis=0)) @ transform.components[:, :3]
+    np.testing.assert_allclose(scores, expected.reshape(40, 30, 3)[5:30:2, 3:20], rtol=1e-4, atol=1e-2)
+
+
+def test_corrupt_transform_is_refitted(tmp_path):
+    cube = synthetic_cube((20, 10, 8))
+    path = str(tmp_path / "cube.pca.npz")
+    first = load_or_fit_transform(cube, 'pca', path=path)
+    assert os.listdir(tmp_path) == ["cube.pca.npz"]
+
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+    assert SpectralTransform.load(path) is None
+
+    refitted = load_or_fit_transform(cube, 'pca', path=path)
+    np.testing.assert_allclose(refitted.components, first.components)
+    assert SpectralTransform.load(path) is not None
+
+
+def test_fcc_renders_do_not_evict_transforms():
+    cube = synthetic_cube((20, 15, 12))
+    transform = get_transform(cube, 'pca')
+    components = get_component_cube(cube, 'pca')
+    for band in range(10):
+        for stretch in STRETCH_MODES:
+            get_rgb_image(cube, bands=(band, band + 1, band + 2), stretch=stretch)
+    assert get_transform(cube, 'pca') is transform
+    assert get_component_cube(cube, 'pca') is components
@@ -0,0 +1,56 @@
+import threading
+import numpy as np
+from utils.FCC import FCCRenderCache
+
+
+def test_concurrent_access_keeps_the_cache_bounded():
+    cache = FCCRenderCache(max_entries=4)
+    cubes = [np.zeros(1) for _ in range(3)]
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def worker(seed):
+        barrier.wait()
+        try:
+            for i in range(500):
+                cube = cubes[(seed + i) % 3]
+                cache.get_or_render(cube, ('test', i % 5), object)
+                if i % 50 == 0:
+                    cache.invalidate(cube)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(cache) <= 4
+
+
+def test_racing_renders_share_the_first_result():
+    cache = FCCRenderCache()
+    cube = np.zeros(1)
+    results = []
+
+    def render():
+        # Another caller renders and caches the same entry meanwhile
+        if not results:
+            results.append(None)
+            results[0] = cache.get_or_render(cube, ('rgb',), object)
+        return object()
+
+    assert cache.get_or_render(cube, ('rgb',), render) is results[0]
+    assert cache.get_or_render(cube, ('rgb',), object) is results[0]
+
+
+def test_invalidate_drops_one_cube():
+    cache = FCCRenderCache()
+    first, second = np.zeros(1), np.zeros(1)
+    cache.get_or_render(first, ('a',), lambda: 1)
+    cache.get_or_render(second, ('a',), lambda: 2)
+    cache.invalidate(first)
+    assert len(cache) == 1
+    assert cache.get_or_render(second, ('a',), lambda: 3) == 2
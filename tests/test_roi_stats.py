@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from utils.roiStats import polygon_mask, read_region_pixels, rectangle_mask, region_statistics
+
+SHAPE = (30, 40, 6)
+
+
+def cube():
+    return np.random.default_rng(0).integers(0, 4000, SHAPE).astype(np.int16)
+
+
+def full_mask(bbox, mask):
+    """The region as a mask over the whole image."""
+    out = np.zeros(SHAPE[:2], dtype=bool)
+    out[bbox[0]:bbox[1], bbox[2]:bbox[3]] = mask
+    return out
+
+
+def reference_polygon_mask(vertices):
+    """Even-odd test of every pixel centre against every edge."""
+    rows, cols = np.mgrid[:SHAPE[0], :SHAPE[1]]
+    inside = np.zeros(SHAPE[:2], dtype=bool)
+    for (y0, x0), (y1, x1) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        crosses = (y0 <= rows) != (y1 <= rows)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = x0 + (rows - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (cols < x)
+    return inside
+
+
+def test_rectangle_mask_covers_the_rounded_corners():
+    bbox, mask = rectangle_mask((12.4, 30.6), (3.6, -5.0), SHAPE)
+    assert bbox == (4, 13, 0, 32)
+    assert mask.all() and mask.shape == (9, 32)
+
+
+@pytest.mark.parametrize('vertices', [
+    [(2.5, 3.5), (20.2, 8.7), (11.0, 35.3)],
+    # Self-crossing lasso: the even-odd rule leaves the overlap out
+    [(1.2, 1.7), (25.3, 30.1), (25.6, 2.2), (1.5, 33.4)],
+    # Partly outside the image
+    [(-5.0, -5.0), (10.3, 50.0), (35.0, 12.6)],
+])
+def test_polygon_mask_matches_even_odd_reference(vertices):
+    bbox, mask = polygon_mask(vertices, SHAPE)
+    np.testing.assert_array_equal(full_mask(bbox, mask), reference_polygon_mask(np.array(vertices)))
+
+
+def test_region_statistics_match_numpy():
+    data = cube()
+    bbox, mask = polygon_mask([(2.5, 3.5), (20.2, 8.7), (11.0, 35.3)], SHAPE)
+    pixels = data[full_mask(bbox, mask)].astype(np.float64)
+
+    stats = region_statistics(data, bbox, mask, percentiles=(5, 50, 95))
+    assert stats['count'] == len(pixels)
+    np.testing.assert_allclose(stats['mean'], np.mean(pixels, axis=0))
+    np.testing.assert_allclose(stats['std'], np.std(pixels, axis=0))
+    np.testing.assert_array_equal(stats['min'], pixels.min(axis=0))
+    np.testing.assert_array_equal(stats['max'], pixels.max(axis=0))
+    for p in (5, 50, 95):
+        np.testing.assert_allclose(stats[f"p{p}"], np.percentile(pixels, p, axis=0))
+
+
+def test_region_pixels_are_read_in_blocks():
+    data = cube()
+    bbox, mask = rectangle_mask((5, 7), (25, 19), SHAPE)
+    np.testing.assert_array_equal(read_region_pixels(data, bbox, mask, max_block_elements=100),
+                                  data[5:26, 7:20].reshape(-1, SHAPE[2]))
+
+
+def test_empty_region_is_rejected():
+    bbox, mask = polygon_mask([(2.2, 2.2), (2.4, 2.8), (2.3, 2.5)], SHAPE)
+    with pytest.raises(ValueError):
+        region_statistics(cube(), bbox, mask)
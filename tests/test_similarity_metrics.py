@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from utils.analyseSAM import compile_library
+from utils.similarityMetrics import METRICS, lowest_scores
+
+N_BANDS = 12
+WAVELENGTHS = np.linspace(400.0, 1000.0, N_BANDS)
+
+
+def sam(x, y):
+    return np.arccos(np.clip(x @ y / (np.linalg.norm(x) * np.linalg.norm(y)), -1, 1))
+
+
+def sid(x, y):
+    p, q = x / x.sum(), y / y.sum()
+    return np.sum(p * np.log(p / q)) + np.sum(q * np.log(q / p))
+
+
+# Scalar reference for one pixel against one entry, over the entry's bands
+REFERENCES = {
+    'sam': sam,
+    'sid': sid,
+    'scm': lambda x, y: np.arccos(np.clip(np.corrcoef(x, y)[0, 1], -1, 1)),
+    'euclidean': lambda x, y: np.linalg.norm(x - y) / np.linalg.norm(x),
+    'sid_sam': lambda x, y: sid(x, y) * np.tan(sam(x, y)),
+}
+
+
+def test_every_metric_has_a_reference():
+    assert set(METRICS) == set(REFERENCES)
+
+
+@pytest.mark.parametrize('metric', sorted(METRICS))
+def test_metric_matches_reference(metric):
+    rng = np.random.default_rng(0)
+    library = {}
+    for i in range(8):
+        # Half the entries cover only part of the bands
+        bands = range(N_BANDS) if i % 2 else range(i // 2, N_BANDS - 1)
+        library[f"entry_{i}"] = {"spectrum": {repr(float(WAVELENGTHS[b])): float(rng.uniform(100, 1000))
+                                              for b in bands}}
+    compiled = compile_library(library, WAVELENGTHS)
+    pixels = rng.uniform(100, 1000, (6, N_BANDS))
+    # One pixel close to an entry, where scores are small differences
+    pixels[0, compiled.band_indices] = compiled.spectra[1] * 1.001
+
+    scores = compiled.score_spectra(pixels, metric)
+    for row, pixel in enumerate(pixels):
+        values = pixel[compiled.band_indices]
+        for column in range(len(compiled)):
+            mask = compiled.band_mask[column]
+            expected = REFERENCES[metric](values[mask], compiled.spectra[column][mask].astype(np.float64))
+            assert scores[row, column] == pytest.approx(expected, rel=1e-3, abs=1e-5)
+
+
+def test_lowest_scores_puts_nan_last():
+    indices, scores = lowest_scores(np.array([0.3, np.nan, 0.1, 0.2]), 3)
+    assert indices.tolist() == [2, 3, 0]
+    assert scores.tolist() == [0.1, 0.2, 0.3]
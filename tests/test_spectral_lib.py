@@ -0,0 +1,71 @@
+import os
+import numpy as np
+import pytest
+import utils.spectralLib as spectralLib
+from utils.spectralLib import (compact_library, compact_library_in_background, convert_library, is_binary_library,
+                               journal_path, library_table_to_dict, load_library, read_library_table,
+                               save_entry_to_library, write_library)
+
+WAVELENGTHS = [450.0, 550.0, 650.0]
+
+
+def test_compaction_folds_journal(tmp_path):
+    library_path = str(tmp_path / "library.json")
+    save_entry_to_library(library_path, "a", WAVELENGTHS, [1, 2, 3])
+    save_entry_to_library(library_path, "b", WAVELENGTHS, [4, 5, 6])
+    before = load_library(library_path)
+
+    assert compact_library(library_path)
+    assert not os.path.exists(journal_path(library_path))
+    assert load_library(library_path) == before
+
+
+def test_compaction_skips_when_library_is_rewritten(tmp_path, monkeypatch):
+    library_path = str(tmp_path / "library.json")
+    save_entry_to_library(library_path, "a", WAVELENGTHS, [1, 2, 3])
+    bulk = {"bulk": {"spectrum": {"500.0": 7}}}
+
+    # A bulk write lands between compaction's merge and its write
+    apply_changes = spectralLib._apply_changes_to_dict
+
+    def apply_then_write(library, changes):
+        merged = apply_changes(library, changes)
+        write_library(library_path, bulk)
+        return merged
+
+    monkeypatch.setattr(spectralLib, "_apply_changes_to_dict", apply_then_write)
+    assert not compact_library(library_path)
+    assert load_library(library_path) == bulk
+
+
+def test_background_compaction_failure_warns(tmp_path, monkeypatch, capsys):
+    def fail(library_path):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(spectralLib, "compact_library", fail)
+    with pytest.warns(RuntimeWarning, match="disk full"):
+        compact_library_in_background(str(tmp_path / "library.json")).join()
+    assert capsys.readouterr().out == ""
+
+
+def test_binary_library_round_trip(tmp_path):
+    json_path, binary_path = str(tmp_path / "library.json"), str(tmp_path / "library.slib")
+    library = {
+        "a": {"spectrum": {"450": 1, "550": 2, "650": 3}, "pixel_coords": [1, 2]},
+        # Entries on different wavelengths, with extra fields
+        "b": {"spectrum": {"500.5": 7, "550": 8}, "source": "roi", "statistics": {"n_pixels": 4}},
+        "c": {"spectrum": {}},
+    }
+    write_library(json_path, library)
+
+    convert_library(json_path, binary_path)
+    assert is_binary_library(binary_path) and not is_binary_library(json_path)
+    assert load_library(binary_path) == library
+
+    table = read_library_table(binary_path, mmap=True)
+    assert isinstance(table.spectra, np.memmap)
+    assert table.labels == ["a", "b", "c"]
+    assert library_table_to_dict(table) == library
+
+    convert_library(binary_path, str(tmp_path / "back.json"))
+    assert load_library(str(tmp_path / "back.json")) == library
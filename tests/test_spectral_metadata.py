@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from utils.FCC import create_rgb_image, default_rgb_bands
+from utils.spectralMetadata import DEFAULT_RGB_WAVELENGTHS, SpectralMetadata
+
+WAVELENGTHS = np.linspace(400.0, 2500.0, 204)
+
+
+def metadata(bad_bands=()):
+    return SpectralMetadata({"band_to_wavelength": {str(b): [b, float(w)] for b, w in enumerate(WAVELENGTHS, 1)},
+                             "bad_bands": list(bad_bands)})
+
+
+def test_nearest_band_skips_bad_bands():
+    nearest = metadata().nearest_band(685.0)
+    assert metadata(bad_bands=[nearest + 1]).nearest_band(685.0) in (nearest - 1, nearest + 1)
+
+
+def test_rgb_bands_stay_inside_a_band_subset():
+    # A cube holding the first 20 bands (400-600 nm) of the metadata
+    cube = np.random.default_rng(0).uniform(0, 1, (6, 5, 20)).astype(np.float32)
+    bands = default_rgb_bands(cube, metadata())
+    assert max(bands) < 20
+    assert bands[0] == 19
+    assert create_rgb_image(cube, metadata()).shape == (6, 5, 3)
+
+
+def test_rgb_bands_of_a_full_cube():
+    bands = metadata().rgb_bands(n_bands=204)
+    spacing = WAVELENGTHS[1] - WAVELENGTHS[0]
+    np.testing.assert_allclose(WAVELENGTHS[list(bands)], DEFAULT_RGB_WAVELENGTHS, atol=spacing / 2)
+
+
+def test_cube_with_more_bands_than_metadata_is_rejected():
+    with pytest.raises(ValueError):
+        metadata().check_cube(np.zeros((2, 2, 205)))
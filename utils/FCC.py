@@ -1,15 +1,384 @@
+import threading
+import weakref
+from collections import OrderedDict
 import numpy as np
+from utils.spectralMetadata import as_metadata
+from utils.instrumentation import count, timed
 
-def create_rgb_image(image_data):
-    # Adjust the indices to match the visible spectrum
-    red_band = image_data[:, :, 32]  # Example index for red
-    green_band = image_data[:, :, 15]  # Example index for green
-    blue_band = image_data[:, :, 6]  # Example index for blue
+# Band indices used when no metadata is available to pick bands by wavelength
+DEFAULT_RGB_BANDS = (32, 15, 6)
 
-    # Stack bands to create an RGB image
-    rgb_image = np.stack((red_band, green_band, blue_band), axis=-1)
+# Stretches understood by create_rgb_image: one min/max over all three
+# channels (the original behaviour), min/max per channel, per-channel
+# percentile clip, and per-channel histogram equalization
+STRETCH_MODES = ('global', 'minmax', 'percentile', 'equalize')
 
-    # Normalize to [0, 1] for visualization
-    rgb_image = (rgb_image - np.min(rgb_image)) / (np.max(rgb_image) - np.min(rgb_image))
+# Percentiles clipped by the 'percentile' stretch
+DEFAULT_PERCENTILES = (2.0, 98.0)
 
-    return rgb_image
+# Percentile and equalization statistics come from at most this many pixels
+STRETCH_SAMPLE_PIXELS = 1_000_000
+
+# Quantile steps per channel for the 'equalize' stretch
+EQUALIZE_BINS = 1024
+
+# Upper bound on the number of values read per block when streaming the cube
+FCC_BLOCK_ELEMENTS = 2 ** 22
+
+
+def default_rgb_bands(image_data, metadata=None):
+    """
+    Pick the FCC bands of a cube when none are given explicitly.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    metadata (SpectralMetadata or dict): Used to pick the cube bands nearest
+        the default red/green/blue wavelengths
+
+    Returns:
+    tuple: Zero-based (red, green, blue) band indices
+    """
+    if metadata is None:
+        return DEFAULT_RGB_BANDS
+    return as_metadata(metadata).rgb_bands(n_bands=image_data.shape[2])
+
+
+def read_fcc_bands(image_data, bands, row_start, row_stop, col_start=0, col_stop=None):
+    """
+    Read the three FCC bands of a window of the cube.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    bands (tuple): Zero-based (red, green, blue) band indices
+    row_start, row_stop, col_start, col_stop (int): Window in pixels
+
+    Returns:
+    ndarray: (rows, cols, 3) float32 unstretched values
+    """
+    window = image_data[row_start:row_stop, col_start:col_stop]
+    out = np.empty(window.shape[:2] + (3,), dtype=np.float32)
+    for channel, band in enumerate(bands):
+        out[:, :, channel] = window[:, :, band]
+    return out
+
+
+def _fcc_block_rows(image_data):
+    return max(1, FCC_BLOCK_ELEMENTS // max(1, image_data.shape[1] * 3))
+
+
+def update_range(values, lower, upper):
+    """
+    Widen per-channel bounds in place to cover the finite values of a block.
+    NaN (nodata in float cubes) and infinite values are skipped.
+
+    Parameters:
+    values (ndarray): (n, 3) band values
+    lower (ndarray): (3,) float32 running minimum, updated in place
+    upper (ndarray): (3,) float32 running maximum, updated in place
+    """
+    finite = np.isfinite(values)
+    np.minimum(lower, np.where(finite, values, np.inf).min(axis=0, initial=np.inf), out=lower)
+    np.maximum(upper, np.where(finite, values, -np.inf).max(axis=0, initial=-np.inf), out=upper)
+
+
+def sample_fcc_bands(image_data, bands, max_pixels=STRETCH_SAMPLE_PIXELS):
+    """
+    Read the FCC bands on a regular grid of at most max_pixels pixels.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    bands (tuple): Zero-based (red, green, blue) band indices
+    max_pixels (int): Largest number of pixels to read
+
+    Returns:
+    ndarray: (n_pixels, 3) float32 values
+    """
+    rows, cols = image_data.shape[:2]
+    step = max(1, int(np.ceil(np.sqrt(rows * cols / max_pixels))))
+    sample = np.empty((len(range(0, rows, step)), len(range(0, cols, step)), 3), dtype=np.float32)
+    for channel, band in enumerate(bands):
+        sample[:, :, channel] = image_data[::step, ::step, band]
+    return sample.reshape(-1, 3)
+
+
+class FCCStretch:
+    """
+    Mapping from band values to displayable [0, 1] values.
+
+    Linear stretches are described by a lower and upper value per channel;
+    'equalize' maps each channel through its empirical cumulative
+    distribution, sampled at evenly spaced quantiles. Non-finite values
+    (NaN nodata) are mapped to 0.
+
+    Attributes:
+    mode (str): One of STRETCH_MODES
+    lower (ndarray): Value mapped to 0, per channel
+    upper (ndarray): Value mapped to 1, per channel
+    edges (list): 'equalize' only - increasing quantile values per channel
+    cdf (list): 'equalize' only - cumulative fraction at each edge
+    """
+
+    def __init__(self, mode, lower, upper, edges=None, cdf=None):
+        self.mode = mode
+        # A channel without any finite value has no range
+        self.lower = np.nan_to_num(np.asarray(lower, dtype=np.float32), nan=0.0, posinf=0.0, neginf=0.0)
+        self.upper = np.nan_to_num(np.asarray(upper, dtype=np.float32), nan=0.0, posinf=0.0, neginf=0.0)
+        self.edges = edges
+        self.cdf = cdf
+
+    def apply(self, values, out=None):
+        """
+        Stretch band values into [0, 1].
+
+        Parameters:
+        values (ndarray): (..., 3) unstretched values
+        out (ndarray): Optional float32 array to write into (may be values)
+
+        Returns:
+        ndarray: (..., 3) float32 stretched values
+        """
+        if out is None:
+            out = np.empty(values.shape, dtype=np.float32)
+        # Found before out (which may be values) is overwritten
+        invalid = ~np.isfinite(values)
+        if not invalid.any():
+            invalid = None
+
+        if self.mode == 'equalize':
+            for channel in range(3):
+                out[..., channel] = np.interp(values[..., channel], self.edges[channel],
+                                              self.cdf[channel], left=0.0, right=1.0)
+        else:
+            scale = self.upper - self.lower
+            scale[scale == 0] = 1.0
+            np.subtract(values, self.lower, out=out, casting='unsafe')
+            out /= scale
+            np.clip(out, 0.0, 1.0, out=out)
+
+        if invalid is not None:
+            out[invalid] = 0.0
+        return out
+
+
+def compute_stretch(image_data, bands, stretch='global', percentiles=DEFAULT_PERCENTILES,
+                    sample_pixels=STRETCH_SAMPLE_PIXELS):
+    """
+    Work out an FCC stretch without holding more than a block of the cube.
+
+    Min/max stretches are exact and computed in one streaming pass over row
+    blocks; percentile and equalization statistics are estimated from a
+    regular subsample of the scene. Only finite values count, so NaN
+    nodata pixels do not affect the stretch.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    bands (tuple): Zero-based (red, green, blue) band indices
+    stretch (str): One of STRETCH_MODES
+    percentiles (tuple): 'percentile' only - lower and upper percentile
+    sample_pixels (int): Pixels sampled for percentile/equalize statistics
+
+    Returns:
+    FCCStretch: The stretch
+    """
+    if stretch not in STRETCH_MODES:
+        raise ValueError(f"Unknown stretch: {stretch}")
+
+    if stretch in ('global', 'minmax'):
+        lower = np.full(3, np.inf, dtype=np.float32)
+        upper = np.full(3, -np.inf, dtype=np.float32)
+        block_rows = _fcc_block_rows(image_data)
+        for start in range(0, image_data.shape[0], block_rows):
+            block = read_fcc_bands(image_data, bands, start, start + block_rows).reshape(-1, 3)
+            update_range(block, lower, upper)
+        if stretch == 'global':
+            lower[:], upper[:] = lower.min(), upper.max()
+        return FCCStretch(stretch, lower, upper)
+
+    sample = sample_fcc_bands(image_data, bands, sample_pixels)
+    finite = np.isfinite(sample)
+    if stretch == 'percentile':
+        lower, upper = np.empty(3), np.empty(3)
+        for channel in range(3):
+            values = sample[finite[:, channel], channel]
+            if len(values):
+                lower[channel], upper[channel] = np.percentile(values, percentiles)
+            else:
+                lower[channel] = upper[channel] = 0.0
+        return FCCStretch(stretch, lower, upper)
+
+    edges, cdf = [], []
+    lower = np.full(3, np.inf, dtype=np.float32)
+    upper = np.full(3, -np.inf, dtype=np.float32)
+    update_range(sample, lower, upper)
+    # Quantiles rather than a fixed-width histogram, so a few hot pixels
+    # cannot squeeze every other value into the first bin
+    levels = np.linspace(0.0, 1.0, EQUALIZE_BINS + 1)
+    for channel in range(3):
+        values = sample[finite[:, channel], channel]
+        if len(values):
+            edges.append(np.quantile(values, levels))
+            cdf.append(levels)
+        else:
+            edges.append(np.zeros(1))
+            cdf.append(np.zeros(1))
+    return FCCStretch(stretch, lower, upper, edges=edges, cdf=cdf)
+
+
+@timed('fcc.render')
+def create_rgb_image(image_data, metadata=None, bands=None, stretch='global',
+                     percentiles=DEFAULT_PERCENTILES, out=None):
+    """
+    Create a false colour composite from three bands of the cube.
+
+    The composite is written block by block into a single float32 buffer,
+    so only a block of the cube is held in memory at a time.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    metadata (SpectralMetadata or dict): Used to pick the bands nearest the
+        default red/green/blue wavelengths
+    bands (tuple): Explicit zero-based (red, green, blue) band indices
+    stretch (str): One of STRETCH_MODES; 'percentile' is robust to hot pixels
+    percentiles (tuple): 'percentile' only - lower and upper percentile
+    out (ndarray): Optional (rows, cols, 3) float32 buffer to write into
+
+    Returns:
+    ndarray: RGB image normalized to [0, 1]
+    """
+    if bands is None:
+        bands = default_rgb_bands(image_data, metadata)
+
+    fcc_stretch = compute_stretch(image_data, bands, stretch, percentiles)
+
+    rows, cols = image_data.shape[:2]
+    if out is None:
+        out = np.empty((rows, cols, 3), dtype=np.float32)
+
+    block_rows = _fcc_block_rows(image_data)
+    for start in range(0, rows, block_rows):
+        stop = min(start + block_rows, rows)
+        block = read_fcc_bands(image_data, bands, start, stop)
+        fcc_stretch.apply(block, out=out[start:stop])
+
+    return out
+
+
+class FCCRenderCache:
+    """
+    LRU cache of rendered FCC images shared by all tabs.
+
+    Entries are keyed on the identity of the cube, the band triple and the
+    stretch parameters (stretch mode and percentiles), so tabs showing the
+    same composite share one RGB array. Cached arrays are read-only. The
+    cache is thread-safe, since background tasks render into it as well as
+    the GUI thread.
+    """
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, image_data, metadata=None, bands=None, **stretch_params):
+        """
+        Return the FCC for the given cube and parameters, rendering it on a miss.
+
+        Parameters:
+        image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+        metadata (SpectralMetadata or dict): Used to pick default bands
+        bands (tuple): Explicit zero-based (red, green, blue) band indices
+        **stretch_params: Passed on to create_rgb_image
+
+        Returns:
+        ndarray: Read-only RGB image
+        """
+        if bands is None:
+            bands = default_rgb_bands(image_data, metadata)
+        bands = tuple(int(b) for b in bands)
+        # Lists are not hashable, and [2, 98] and (2.0, 98.0) are the same stretch
+        if 'percentiles' in stretch_params:
+            stretch_params['percentiles'] = tuple(float(p) for p in stretch_params['percentiles'])
+
+        def render():
+            rgb_image = create_rgb_image(image_data, bands=bands, **stretch_params)
+            rgb_image.flags.writeable = False
+            return rgb_image
+
+        return self.get_or_render(image_data, ('rgb', bands, tuple(sorted(stretch_params.items()))), render)
+
+    def get_or_render(self, image_data, key, render):
+        """
+        Return the cached render of a cube under key, calling render() on a miss.
+
+        Parameters:
+        image_data (ndarray): Cube the render belongs to
+        key (tuple): Hashable description of the render
+        render (callable): Produces the render when it is not cached
+
+        Returns:
+        object: The cached or newly produced render
+        """
+        key = (id(image_data),) + tuple(key)
+
+        with self._lock:
+            result = self._lookup(image_data, key)
+        if result is not None:
+            count('render_cache.hit')
+            return result
+
+        # Render outside the lock so other renders are not held up meanwhile
+        count('render_cache.miss')
+        result = render()
+
+        with self._lock:
+            # Another thread may have rendered the same entry meanwhile;
+            # keep the first so every caller shares one object
+            cached = self._lookup(image_data, key)
+            if cached is not None:
+                return cached
+            self._entries[key] = (weakref.ref(image_data), result)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def _lookup(self, image_data, key):
+        entry = self._entries.get(key)
+        # id() can be reused once a cube is freed, so check it is the same object
+        if entry is not None and entry[0]() is image_data:
+            self._entries.move_to_end(key)
+            return entry[1]
+        return None
+
+    def invalidate(self, image_data=None):
+        """
+        Drop cached images for one cube, or everything if no cube is given.
+
+        Parameters:
+        image_data (ndarray): Cube whose renders should be dropped
+        """
+        with self._lock:
+            if image_data is None:
+                self._entries.clear()
+                return
+            for key in [k for k, (ref, _) in self._entries.items() if ref() is image_data or ref() is None]:
+                del self._entries[key]
+
+
+# Render cache shared by every widget in the application
+render_cache = FCCRenderCache()
+
+
+def get_rgb_image(image_data, metadata=None, bands=None, **stretch_params):
+    """
+    Return the FCC for a cube from the shared render cache.
+
+    Parameters are as for FCCRenderCache.get.
+
+    Returns:
+    ndarray: Read-only RGB image
+    """
+    return render_cache.get(image_data, metadata, bands, **stretch_params)
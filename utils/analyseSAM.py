@@ -1,7 +1,12 @@
+import os
 import numpy as np
-import matplotlib.pyplot as plt
-import json
-from utils.pixelSpectrum import get_pixel_spectrum
+from utils.pixelSpectrum import get_pixel_spectrum, get_wavelengths
+from utils.spectralLib import LibraryTable, library_table_from_dict, read_library_table, library_signature
+from utils.bandAlignment import get_band_alignment
+from utils.libraryIndex import get_library_index
+from utils.similarityMetrics import get_metric, lowest_scores
+from utils.continuumRemoval import get_continuum_removed_cube, remove_continuum
+from utils.instrumentation import timed
 
 def calculate_sam_score(spectrum1, spectrum2):
     """
@@ -23,60 +28,228 @@ def calculate_sam_score(spectrum1, spectrum2):
     
     return sam_score
 
-def compare_pixel_to_library(image_data, metadata, pixel, library_path='data/spectral_library.json'):
+
+class CompiledLibrary:
+    """
+    Spectral library compiled against the wavelengths of a cube.
+
+    Every entry is stored as one row of a band-aligned, pre-normalized
+    (n_entries, n_bands) float32 matrix, so a pixel is scored against the
+    whole library with a single matrix-vector product. Other similarity
+    metrics (see utils.similarityMetrics) work from the aligned spectra and
+    keep their precomputed library terms on the compiled library.
+
+    Attributes:
+    labels (ndarray): Entry labels, one per matrix row
+    matrix (ndarray): Unit-norm library spectra, zero where an entry has no value
+    band_mask (ndarray): True where an entry has a value for a band
+    band_indices (ndarray): Cube band index of every matrix column
+    pixel_coords (list): Source pixel coordinates of each entry (or None)
+    spectra (ndarray): Band-aligned library spectra, zero where an entry has no value
+    """
+
+    def __init__(self, labels, matrix, band_mask, band_indices, pixel_coords, spectra=None):
+        self.labels = labels
+        self.matrix = matrix
+        self.band_mask = band_mask
+        self.band_indices = band_indices
+        self.pixel_coords = pixel_coords
+        self.spectra = spectra if spectra is not None else matrix
+        # When every entry covers every band the pixel norm is shared by all rows
+        self.uniform_bands = bool(band_mask.all())
+        self._metric_terms = {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def metric_terms(self, metric='sam'):
+        """
+        Library-side terms of a similarity metric, computed on first use.
+
+        Parameters:
+        metric (str): Registered metric name
+
+        Returns:
+        object: Terms for get_metric(metric).score()
+        """
+        if metric not in self._metric_terms:
+            self._metric_terms[metric] = get_metric(metric).prepare(self)
+        return self._metric_terms[metric]
+
+    def score_spectrum(self, spectrum, metric='sam'):
+        """
+        Score a cube spectrum against every entry.
+
+        Parameters:
+        spectrum (ndarray): Spectrum with one value per cube band
+        metric (str): Registered metric name
+
+        Returns:
+        ndarray: Score for each entry (radians for SAM), in library order
+        """
+        return self.score_spectra(np.asarray(spectrum)[np.newaxis, :], metric)[0]
+
+    @timed('sam.score')
+    def score_spectra(self, spectra, metric='sam'):
+        """
+        Score many cube spectra against every entry.
+
+        Parameters:
+        spectra (ndarray): (n_spectra, n_cube_bands) spectra
+        metric (str): Registered metric name
+
+        Returns:
+        ndarray: (n_spectra, n_entries) scores (radians for SAM)
+        """
+        values = np.asarray(spectra, dtype=np.float32)[:, self.band_indices]
+        return get_metric(metric).score(values, self.metric_terms(metric))
+
+    def rank(self, scores, indices=None, metric='sam'):
+        """
+        Convert per-entry scores into the sorted mapping used by the widgets.
+
+        Parameters:
+        scores (ndarray): Score for each entry, in library order
+        indices (ndarray): If given, scores belong to these entries only
+        metric (str): Metric the scores were computed with
+
+        Returns:
+        dict: Label -> {'score', 'metric', 'pixel_coords'}, lowest score
+            first; SAM results also carry 'sam_score'
+        """
+        if indices is None:
+            indices = np.arange(len(scores))
+        order = np.argsort(scores, kind='stable')
+        ranked = {}
+        for i in order:
+            entry = {
+                'score': float(scores[i]),
+                'metric': metric,
+                'pixel_coords': self.pixel_coords[indices[i]]
+            }
+            if metric == 'sam':
+                entry['sam_score'] = entry['score']
+            ranked[str(self.labels[indices[i]])] = entry
+        return ranked
+
+
+@timed('sam.compile')
+def compile_library(library, wavelengths, resampling='nearest', continuum_removal=False):
+    """
+    Compile a spectral library into a band-aligned, pre-normalized matrix.
+
+    The library is resampled onto the cube bands with a band alignment that
+    is computed once per (library wavelengths, cube wavelengths) pair, so a
+    library measured on another sensor costs a single matrix product.
+    Entries without any value on the covered bands are dropped.
+
+    Parameters:
+    library (dict or LibraryTable): Spectral library in either form
+    wavelengths (list): Wavelength of each cube band
+    resampling (str): 'nearest' or 'gaussian' (see utils.bandAlignment)
+    continuum_removal (bool): Divide every entry by its convex hull (over the
+        bands it covers), to be matched against a ContinuumRemovedCube
+        restricted to band_indices
+
+    Returns:
+    CompiledLibrary: Compiled library ready for scoring
+    """
+    table = library if isinstance(library, LibraryTable) else library_table_from_dict(library)
+
+    alignment = get_band_alignment(table.wavelengths, wavelengths, resampling)
+    spectra = alignment.apply(table.spectra)
+    band_indices = alignment.band_indices
+    band_mask = ~np.isnan(spectra)
+
+    # Skip entries with no common wavelengths
+    keep = band_mask.any(axis=1)
+    spectra, band_mask = spectra[keep], band_mask[keep]
+    labels = np.array(table.labels, dtype=object)[keep]
+    pixel_coords = [entry.get('pixel_coords', None)
+                    for entry, kept in zip(table.entries, keep) if kept]
+
+    # Drop cube bands that no remaining entry covers
+    covered = band_mask.any(axis=0)
+    spectra, band_mask, band_indices = spectra[:, covered], band_mask[:, covered], band_indices[covered]
+
+    if continuum_removal:
+        spectra = remove_continuum(np.where(band_mask, spectra, 0.0),
+                                   np.asarray(wavelengths, dtype=np.float64)[band_indices], band_mask)
+
+    matrix = np.where(band_mask, spectra, 0.0).astype(np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    return CompiledLibrary(labels, matrix, band_mask, band_indices, pixel_coords,
+                           np.where(band_mask, spectra, 0.0).astype(np.float32))
+
+
+_compiled_cache = {}
+
+def _get_compiled_library(library_path, wavelengths, resampling='nearest', continuum_removal=False):
+    """
+    Compile the library at the given path, reusing the previous result while
+    neither the file nor its journal has changed.
+    """
+    key = (os.path.abspath(library_path), library_signature(library_path), tuple(wavelengths), resampling,
+           continuum_removal)
+    if key not in _compiled_cache:
+        _compiled_cache.clear()
+        _compiled_cache[key] = compile_library(read_library_table(library_path), wavelengths, resampling,
+                                               continuum_removal)
+    return _compiled_cache[key]
+
+
+@timed('sam.compare')
+def compare_pixel_to_library(image_data, metadata, pixel, library_path='data/spectral_library.json',
+                             compiled_library=None, resampling='nearest', top_k=None, metric='sam',
+                             continuum_removal=False):
     """
     Compare a pixel's spectrum to a spectral library.
+
+    With top_k only the best matches are returned. SAM matches are found
+    through the library's spectral angle index (see utils.libraryIndex),
+    which scores only the entries that could still beat the k-th match;
+    the result and its angles are identical to an exhaustive comparison.
     
     Parameters:
     image_data (ndarray): Hyperspectral image data cube
     metadata (dict): Metadata containing wavelength information
     pixel (tuple): Pixel coordinates (row, col)
-    library_path (str): Path to the spectral library JSON
+    library_path (str): Path to the spectral library (JSON or binary)
+    compiled_library (CompiledLibrary): Precompiled library; compiled from
+        library_path when not given
+    resampling (str): Band matching used when compiling ('nearest' or 'gaussian')
+    top_k (int): Return only this many best matches (all entries if None)
+    metric (str): Similarity metric (see utils.similarityMetrics.METRICS)
+    continuum_removal (bool): Match continuum-removed spectra; a given
+        compiled_library must then be compiled with continuum_removal=True
     
     Returns:
-    dict: SAM scores and library entry details
+    dict: Scores and library entry details, best match first
     """
-    # Load the library from the JSON file
-    with open(library_path, 'r') as f:
-        library = json.load(f)
+    wavelengths = get_wavelengths(metadata, image_data.shape[2])
+    index_path = None
+    if compiled_library is None:
+        compiled_library = _get_compiled_library(library_path, wavelengths, resampling, continuum_removal)
+        index_path = library_path
+
+    if continuum_removal:
+        # Hulls are computed per tile and cached, so nearby clicks are free;
+        # they span the library's bands so both sides share one continuum
+        image_data = get_continuum_removed_cube(image_data, wavelengths, compiled_library.band_indices)
 
     # Get the pixel's spectrum
-    wavelengths, pixel_spectrum = get_pixel_spectrum(image_data, metadata, pixel)
-
-    # Convert the pixel spectrum to a dictionary for easier matching
-    pixel_spectrum_dict = dict(zip(wavelengths, pixel_spectrum))
-
-    # Calculate SAM scores
-    sam_scores = {}
-    for label, entry in library.items():
-        # Extract the library's spectrum as a dictionary
-        lib_spectrum_dict = entry['spectrum']
-
-        #convert botht he dictionary keys to int
-        lib_spectrum_dict = {int(k):v for k,v in lib_spectrum_dict.items()}
-        pixel_spectrum_dict = {int(k):v for k,v in pixel_spectrum_dict.items()}
-
-        # Ensure that the wavelengths are the same between the pixel and library spectrum
-        common_wavelengths = set(pixel_spectrum_dict.keys()).intersection(lib_spectrum_dict.keys())
-        
-        if len(common_wavelengths) == 0:
-            continue  # Skip if no common wavelengths
-
-        # Create common wavelength arrays for both pixel and library spectra
-        common_wavelengths = sorted(common_wavelengths)  # Sorting ensures consistency
-        pixel_common_values = np.array([pixel_spectrum_dict[w] for w in common_wavelengths])
-        lib_common_values = np.array([lib_spectrum_dict[w] for w in common_wavelengths])
-
-        # Calculate SAM score using common wavelengths
-        sam_score = calculate_sam_score(pixel_common_values, lib_common_values)
-        
-        # Store the SAM score and the pixel coordinates from the library
-        sam_scores[label] = {
-            'sam_score': float(sam_score),
-            'pixel_coords': entry.get('pixel_coords', None)  # Use None if not available
-        }
-
-    # Sort scores from lowest to highest
-    sorted_scores = dict(sorted(sam_scores.items(), key=lambda x: x[1]['sam_score']))
-
-    return sorted_scores
\ No newline at end of file
+    _, pixel_spectrum = get_pixel_spectrum(image_data, metadata, pixel)
+
+    if top_k is not None and metric == 'sam':
+        index = get_library_index(compiled_library, index_path)
+        indices, sam_scores = index.search(pixel_spectrum, top_k)
+        return compiled_library.rank(sam_scores, indices)
+
+    # Score against every entry at once and sort from lowest to highest
+    scores = compiled_library.score_spectrum(pixel_spectrum, metric)
+    if top_k is not None:
+        indices, scores = lowest_scores(scores, top_k)
+        return compiled_library.rank(scores, indices, metric)
+    return compiled_library.rank(scores, metric=metric)
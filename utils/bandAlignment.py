@@ -0,0 +1,154 @@
+from functools import lru_cache
+import numpy as np
+
+# Resampling methods understood by build_band_alignment
+RESAMPLING_METHODS = ('nearest', 'gaussian')
+
+# A Gaussian's FWHM spans 2 * sqrt(2 * ln 2) standard deviations
+_FWHM_TO_SIGMA = 1.0 / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+
+
+class BandAlignment:
+    """
+    Precomputed correspondence from library wavelengths to cube bands.
+
+    The library spectra are mapped onto the covered cube bands with one
+    matrix product, weights (n_covered_bands, n_library_bands). For the
+    'nearest' method every row holds a single 1, which is kept as an index
+    map and applied by column selection instead.
+
+    Attributes:
+    method (str): 'nearest' or 'gaussian'
+    band_indices (ndarray): Cube bands covered by the library
+    index_map (ndarray): Library column used for each covered band (nearest)
+    weights (ndarray): Spectral response weights for each covered band (gaussian)
+    """
+
+    def __init__(self, method, band_indices, index_map=None, weights=None):
+        self.method = method
+        self.band_indices = band_indices
+        self.index_map = index_map
+        self.weights = weights
+
+    def apply(self, spectra):
+        """
+        Resample library spectra onto the covered cube bands.
+
+        Missing library values (NaN) are left out of each weighted average;
+        a band whose whole response falls on missing values stays NaN.
+
+        Parameters:
+        spectra (ndarray): (n_entries, n_library_bands) library spectra
+
+        Returns:
+        ndarray: (n_entries, n_covered_bands) float32 resampled spectra
+        """
+        spectra = np.asarray(spectra, dtype=np.float32)
+        if self.index_map is not None:
+            return spectra[:, self.index_map]
+
+        valid = ~np.isnan(spectra)
+        weighted = np.where(valid, spectra, 0.0) @ self.weights.T
+        coverage = valid.astype(np.float32) @ self.weights.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Require most of the response to fall on measured values
+            return np.where(coverage > 0.5, weighted / coverage, np.nan).astype(np.float32)
+
+
+def _band_spacing(wavelengths):
+    """Median spacing between neighbouring wavelengths (1 if unknown)."""
+    if len(wavelengths) < 2:
+        return 1.0
+    return float(np.median(np.abs(np.diff(np.sort(wavelengths)))))
+
+
+def build_band_alignment(library_wavelengths, cube_wavelengths, method='nearest',
+                         max_distance=None, fwhm=None):
+    """
+    Work out how library wavelengths map onto cube bands.
+
+    Parameters:
+    library_wavelengths (ndarray): Wavelengths of the library columns (nm)
+    cube_wavelengths (ndarray): Centre wavelength of each cube band (nm)
+    method (str): 'nearest' picks the closest library wavelength for each band;
+        'gaussian' integrates the library over a Gaussian spectral response
+    max_distance (float): Nearest only - largest accepted distance (nm);
+        defaults to half the cube band spacing
+    fwhm (float or ndarray): Gaussian only - response FWHM per band (nm);
+        defaults to the cube band spacing
+
+    Returns:
+    BandAlignment: Alignment for the cube bands the library covers
+    """
+    if method not in RESAMPLING_METHODS:
+        raise ValueError(f"Unknown resampling method: {method}")
+
+    library_wavelengths = np.asarray(library_wavelengths, dtype=np.float64)
+    cube_wavelengths = np.asarray(cube_wavelengths, dtype=np.float64)
+    spacing = _band_spacing(cube_wavelengths)
+
+    if len(library_wavelengths) == 0:
+        empty = np.array([], dtype=np.intp)
+        return BandAlignment(method, empty, index_map=empty)
+
+    if method == 'nearest':
+        if max_distance is None:
+            max_distance = spacing / 2.0
+        order = np.argsort(library_wavelengths)
+        sorted_wavelengths = library_wavelengths[order]
+
+        # Pick the closer of the library wavelengths either side of each band centre
+        if len(order) == 1:
+            nearest = np.zeros(len(cube_wavelengths), dtype=np.intp)
+        else:
+            right = np.clip(np.searchsorted(sorted_wavelengths, cube_wavelengths), 1, len(order) - 1)
+            left = right - 1
+            use_left = (cube_wavelengths - sorted_wavelengths[left]
+                        <= sorted_wavelengths[right] - cube_wavelengths)
+            nearest = np.where(use_left, left, right)
+
+        distance = np.abs(sorted_wavelengths[nearest] - cube_wavelengths)
+        covered = np.flatnonzero(distance <= max_distance)
+        return BandAlignment(method, covered.astype(np.intp), index_map=order[nearest[covered]])
+
+    if fwhm is None:
+        fwhm = spacing
+    sigma = np.broadcast_to(np.asarray(fwhm, dtype=np.float64), cube_wavelengths.shape) * _FWHM_TO_SIGMA
+
+    # Only bands whose centre lies inside the library's range are covered
+    covered = np.flatnonzero((cube_wavelengths >= library_wavelengths.min())
+                             & (cube_wavelengths <= library_wavelengths.max()))
+    offsets = (library_wavelengths[np.newaxis, :] - cube_wavelengths[covered, np.newaxis]) \
+        / sigma[covered, np.newaxis]
+    weights = np.where(np.abs(offsets) <= 3.0, np.exp(-0.5 * np.square(offsets)), 0.0)
+
+    # A band narrower than the library sampling falls back to its nearest sample
+    empty_rows = weights.sum(axis=1) == 0
+    if empty_rows.any():
+        nearest = np.abs(offsets[empty_rows]).argmin(axis=1)
+        weights[np.flatnonzero(empty_rows), nearest] = 1.0
+
+    weights /= weights.sum(axis=1, keepdims=True)
+    return BandAlignment(method, covered.astype(np.intp), weights=weights.astype(np.float32))
+
+
+@lru_cache(maxsize=16)
+def _cached_alignment(library_wavelengths, cube_wavelengths, method, max_distance, fwhm):
+    return build_band_alignment(np.array(library_wavelengths), np.array(cube_wavelengths),
+                                method, max_distance, fwhm)
+
+
+def get_band_alignment(library_wavelengths, cube_wavelengths, method='nearest',
+                       max_distance=None, fwhm=None):
+    """
+    Cached build_band_alignment, so a library bound to a cube is aligned
+    once no matter how many times it is compiled.
+
+    Parameters are as for build_band_alignment (fwhm must be a scalar).
+
+    Returns:
+    BandAlignment: Alignment for the cube bands the library covers
+    """
+    return _cached_alignment(tuple(np.asarray(library_wavelengths, dtype=np.float64).tolist()),
+                             tuple(np.asarray(cube_wavelengths, dtype=np.float64).tolist()),
+                             method, max_distance, fwhm)
@@ -0,0 +1,57 @@
+import numpy as np
+from utils.parallelTiles import iter_tiled
+
+
+def _tile_statistics(tile):
+    """
+    Per-band count, mean, sum of squared deviations, min and max of one tile.
+    """
+    pixels = tile.reshape(-1, tile.shape[2]).astype(np.float64)
+    mean = pixels.mean(axis=0)
+    m2 = np.square(pixels - mean).sum(axis=0)
+    return pixels.shape[0], mean, m2, pixels.min(axis=0), pixels.max(axis=0)
+
+
+def compute_band_statistics(image_data, n_workers=1, tile_rows=None):
+    """
+    Calculate per-band statistics over the whole cube.
+
+    Tiles are reduced independently (in parallel when n_workers > 1) and
+    merged with the pairwise mean/variance update, so the cube is read once
+    and never held in memory as a whole.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    n_workers (int): Number of worker processes; default_workers() if None
+    tile_rows (int): Rows per tile; split evenly over the workers if None
+
+    Returns:
+    dict: 'count', and per-band 'mean', 'std', 'min' and 'max' arrays
+    """
+    bands = image_data.shape[2]
+    if n_workers == 1 and tile_rows is None:
+        tile_rows = max(1, 2 ** 22 // max(1, image_data.shape[1] * bands))
+
+    count = 0
+    mean = np.zeros(bands)
+    m2 = np.zeros(bands)
+    band_min = np.full(bands, np.inf)
+    band_max = np.full(bands, -np.inf)
+
+    for _, (n, tile_mean, tile_m2, tile_min, tile_max) in iter_tiled(
+            _tile_statistics, image_data, n_workers=n_workers, tile_rows=tile_rows):
+        total = count + n
+        delta = tile_mean - mean
+        mean = mean + delta * (n / total)
+        m2 = m2 + tile_m2 + np.square(delta) * (count * n / total)
+        count = total
+        band_min = np.minimum(band_min, tile_min)
+        band_max = np.maximum(band_max, tile_max)
+
+    return {
+        'count': count,
+        'mean': mean,
+        'std': np.sqrt(m2 / count) if count else np.full(bands, np.nan),
+        'min': band_min,
+        'max': band_max,
+    }
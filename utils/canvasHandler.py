@@ -1,123 +1,445 @@
+import time
+from collections import deque
+import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.image import NonUniformImage
 from matplotlib.widgets import Button
-from utils.pixelSpectrum import get_pixel_spectrum
+from utils.pixelSpectrum import get_wavelengths
+from utils.spectrumSelection import SpectrumSelection, read_pixel_spectra, transect_pixels
+from utils.instrumentation import observe, span
+
+# How the selected spectra are drawn: one line and legend entry per pixel,
+# all pixels as a single LineCollection, a mean/std/percentile envelope, or
+# a density image (2D histogram of value per band). 'auto' goes from lines
+# to a collection past MAX_LEGEND_LINES pixels and to a density image past
+# MAX_COLLECTION_LINES, whose drawing cost no longer grows with the selection.
+SPECTRUM_MODES = ('auto', 'lines', 'collection', 'envelope', 'density')
+
+# Largest selection drawn as individual lines in 'auto' mode
+MAX_LEGEND_LINES = 10
+
+# Largest selection drawn as a line collection in 'auto' mode
+MAX_COLLECTION_LINES = 500
+
+# Value bins of the 'density' image
+DENSITY_BINS = 256
+
+# Lower and upper percentile of the 'envelope' band
+ENVELOPE_PERCENTILES = (5, 95)
+
+
+class BlitManager:
+    """
+    Redraw a few animated artists over a cached copy of the figure.
+
+    Artists registered here are left out of normal draws. After every full
+    draw the rendered figure is saved as the background, and update()
+    restores it and paints only the animated artists on top, which costs a
+    fraction of a full redraw. It also records how long each click took
+    to reach the screen.
+    """
+
+    def __init__(self, canvas, max_samples=200):
+        self.canvas = canvas
+        self.artists = []
+        self._background = None
+        self._pending_click = None
+        self.latencies = deque(maxlen=max_samples)
+        self.cid = canvas.mpl_connect('draw_event', self.on_draw)
+
+    @property
+    def last_click_latency(self):
+        """Seconds from the last click to its repaint (None before any click)."""
+        return self.latencies[-1] if self.latencies else None
+
+    def add_artist(self, artist):
+        artist.set_animated(True)
+        self.artists.append(artist)
+        return artist
+
+    def remove_artist(self, artist):
+        if artist in self.artists:
+            self.artists.remove(artist)
+        artist.remove()
+
+    def on_draw(self, event):
+        """Save the background after a full draw and paint the animated artists."""
+        self._background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_animated()
+        if self._pending_click is not None:
+            self._record_latency(time.perf_counter() - self._pending_click)
+            self._pending_click = None
+
+    def _draw_animated(self):
+        figure = self.canvas.figure
+        for artist in self.artists:
+            if artist.figure is not None:
+                figure.draw_artist(artist)
+
+    def update(self, click_time=None, full=False):
+        """
+        Repaint after the animated artists changed.
+
+        Parameters:
+        click_time (float): time.perf_counter() of the click being handled
+        full (bool): Redraw the whole figure, e.g. because axis limits changed
+        """
+        if full or self._background is None or not getattr(self.canvas, 'supports_blit', True):
+            self._pending_click = click_time
+            self.canvas.draw_idle()
+            return
+
+        with span('canvas.blit'):
+            self.canvas.restore_region(self._background)
+            self._draw_animated()
+            self.canvas.blit(self.canvas.figure.bbox)
+        if click_time is not None:
+            self._record_latency(time.perf_counter() - click_time)
+
+    def _record_latency(self, seconds):
+        self.latencies.append(seconds)
+        observe('canvas.click_latency', seconds)
+
+    def get_latency_stats(self):
+        """
+        Summarize recorded click-to-paint latencies.
+
+        Returns:
+        dict: count, and mean/median/p95/max latency in milliseconds
+        """
+        if not self.latencies:
+            return {'count': 0}
+        samples = np.array(self.latencies) * 1000.0
+        return {
+            'count': len(samples),
+            'mean_ms': float(samples.mean()),
+            'median_ms': float(np.median(samples)),
+            'p95_ms': float(np.percentile(samples, 95)),
+            'max_ms': float(samples.max()),
+        }
+
+
+def autoscale_changed(ax):
+    """
+    Rescale an axis to its data and report whether the view limits moved.
+
+    Parameters:
+    ax (Axes): Axis whose artists changed
+
+    Returns:
+    bool: True if the limits changed, so a full redraw is needed
+    """
+    limits = (ax.get_xlim(), ax.get_ylim())
+    ax.relim()
+    ax.autoscale_view()
+    return (ax.get_xlim(), ax.get_ylim()) != limits
+
 
 class CanvasHandler:
-    def __init__(self, fig, ax1, ax2, rgb_image, image_data, metadata, max_pixels=5):
+    def __init__(self, fig, ax1, ax2, rgb_image, image_data, metadata, max_pixels=5,
+                 spectrum_mode='auto'):
         self.fig = fig
         self.ax1 = ax1  # RGB Image axis
         self.ax2 = ax2  # Spectrum axis
-        self.rgb_image = rgb_image
+        self.rgb_image = rgb_image  # RGB array or FCCDisplay
         self.image_data = image_data
         self.metadata = metadata
         self.max_pixels = max_pixels
-        self.selected_pixels = []
-        self.selected_pixel_data = []
+        self.spectrum_mode = spectrum_mode
+        self.wavelengths = np.asarray(get_wavelengths(metadata, image_data.shape[2]), dtype=np.float64)
+        self.selection = SpectrumSelection(image_data.shape[2])
+
+        # Artists of the current spectrum mode
+        self.spectrum_lines = []
+        self.collection = None
+        self.envelope_artists = []
+        self.density_image = None
+        self._density_state = None  # ((low, high), n binned, counts)
+        self.legend = None
+
+        # Markers, spectra and legend are blitted over the cached figure
+        self.blit_manager = BlitManager(self.fig.canvas)
 
         # Connect the event handler
         self.cid = self.fig.canvas.mpl_connect('button_press_event', self.on_click)
 
         # Initial image display
-        self.ax1.imshow(self.rgb_image)
+        self.show_image()
         self.ax1.set_title(f"Click on image to select up to {self.max_pixels} pixels")
         self.ax2.set_title("Pixel Spectrum")
         self.ax2.set_xlabel("Wavelength (nm)")
         self.ax2.set_ylabel("Radiance (DN)")
 
+    @property
+    def selected_pixels(self):
+        """Selected pixels as a list of (row, col) tuples."""
+        return [tuple(pixel) for pixel in self.selection.pixels.tolist()]
+
+    @property
+    def last_click_latency(self):
+        """Seconds from the last click to its repaint."""
+        return self.blit_manager.last_click_latency
+
+    def get_latency_stats(self):
+        """Click-to-paint latency summary, see BlitManager.get_latency_stats."""
+        return self.blit_manager.get_latency_stats()
+
+    def show_image(self):
+        """
+        Draw the FCC on the image axis, through its overview pyramid for large
+        scenes, along with the (persistent) selection marker.
+        """
+        if hasattr(self.rgb_image, 'show'):
+            self.rgb_image.show(self.ax1)
+        else:
+            self.ax1.imshow(self.rgb_image)
+        self.marker, = self.ax1.plot([], [], 'o', color='red', linestyle='none')
+        self.blit_manager.add_artist(self.marker)
+
     def on_click(self, event):
         """
         Handle mouse click events to select pixels from the image.
+        Shift-click selects every pixel on the line from the last selected pixel.
         """
-        if len(self.selected_pixels) < self.max_pixels and event.inaxes == self.ax1:
+        if len(self.selection) < self.max_pixels and event.inaxes == self.ax1:
+            click_time = time.perf_counter()
+
             # Get the x, y coordinates of the click (row, col)
             row, col = int(event.ydata), int(event.xdata)
-            self.selected_pixels.append((row, col))
+            if event.key == 'shift' and len(self.selection):
+                pixels = transect_pixels(tuple(self.selection.pixels[-1]), (row, col))[1:]
+            else:
+                pixels = [(row, col)]
 
-            # Update RGB image with selected pixels
-            self.update_image()
+            self.add_pixels(pixels, click_time)
 
-            # Get and plot pixel spectrum
-            wavelengths, pixel_data = get_pixel_spectrum(
-                self.image_data, 
-                self.metadata, 
-                (row, col)
-            )
-            self.selected_pixel_data.append((wavelengths, pixel_data))
-            
-            # Plot all selected pixel spectra
-            self.plot_spectra()
+    def add_pixels(self, pixels, click_time=None):
+        """
+        Select several pixels at once, e.g. a transect, up to max_pixels.
+
+        Parameters:
+        pixels (array-like): (n, 2) (row, col) coordinates
+        click_time (float): time.perf_counter() of the triggering click
+        """
+        rows, cols = self.image_data.shape[:2]
+        pixels = np.asarray(pixels, dtype=np.intp).reshape(-1, 2)
+        inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < rows) & (pixels[:, 1] >= 0) & (pixels[:, 1] < cols)
+        pixels = pixels[inside][:max(0, self.max_pixels - len(self.selection))]
+        if len(pixels) == 0:
+            return
+
+        self.selection.extend(pixels, read_pixel_spectra(self.image_data, pixels))
+
+        # Update RGB image with selected pixels and plot the spectra
+        self.update_image()
+        self.update_spectra(click_time)
 
     def undo_last_selection(self):
         """
         Remove the last pixel selection and its corresponding spectrum.
         """
-        if self.selected_pixels:
-            # Remove the last pixel and its spectrum
-            self.selected_pixels.pop()
-            self.selected_pixel_data.pop()
-
-            # Update the image and spectrum plot
+        if len(self.selection):
+            self.selection.pop()
             self.update_image()
-            self.plot_spectra()
+            self.update_spectra()
+
+    def set_spectrum_mode(self, mode):
+        """
+        Switch how the selected spectra are drawn.
+
+        Parameters:
+        mode (str): One of SPECTRUM_MODES
+        """
+        if mode not in SPECTRUM_MODES:
+            raise ValueError(f"Unknown spectrum mode: {mode}")
+        self.spectrum_mode = mode
+        self.update_spectra()
+
+    def _resolved_mode(self):
+        if self.spectrum_mode != 'auto':
+            return self.spectrum_mode
+        if len(self.selection) <= MAX_LEGEND_LINES:
+            return 'lines'
+        return 'collection' if len(self.selection) <= MAX_COLLECTION_LINES else 'density'
+
+    def _remove_artists(self, keep):
+        if keep != 'lines':
+            for line in self.spectrum_lines:
+                self.blit_manager.remove_artist(line)
+            self.spectrum_lines = []
+        if keep != 'collection' and self.collection is not None:
+            self.blit_manager.remove_artist(self.collection)
+            self.collection = None
+        if keep != 'density' and self.density_image is not None:
+            self.blit_manager.remove_artist(self.density_image)
+            self.density_image = None
+        for artist in self.envelope_artists:
+            self.blit_manager.remove_artist(artist)
+        self.envelope_artists = []
+        if self.legend is not None:
+            self.blit_manager.remove_artist(self.legend)
+            self.legend = None
+
+    def _draw_lines(self):
+        # Lines of pixels that are still selected are kept as they are
+        pixels, spectra = self.selection.pixels, self.selection.spectra
+        while len(self.spectrum_lines) > len(spectra):
+            self.blit_manager.remove_artist(self.spectrum_lines.pop())
+        for i in range(len(self.spectrum_lines), len(spectra)):
+            row, col = pixels[i]
+            line, = self.ax2.plot(self.wavelengths, spectra[i], label=f"Pixel ({row}, {col})")
+            self.spectrum_lines.append(self.blit_manager.add_artist(line))
+
+    def _draw_collection(self):
+        spectra = self.selection.spectra
+        segments = np.empty(spectra.shape + (2,), dtype=np.float64)
+        segments[:, :, 0] = self.wavelengths
+        segments[:, :, 1] = spectra
+        # Fade the lines as they pile up so dense regions stand out
+        alpha = float(np.clip(20.0 / max(1, len(spectra)), 0.05, 1.0))
+        if self.collection is None:
+            self.collection = self.blit_manager.add_artist(
+                LineCollection(segments, colors='tab:blue', linewidths=0.8)
+            )
+            self.ax2.add_collection(self.collection, autolim=False)
+        else:
+            self.collection.set_segments(segments)
+        self.collection.set_alpha(alpha)
+        self.collection.set_label(f"{len(spectra)} pixels")
+
+    def _draw_envelope(self):
+        spectra = self.selection.spectra
+        mean, std = spectra.mean(axis=0), spectra.std(axis=0)
+        lower, upper = np.percentile(spectra, ENVELOPE_PERCENTILES, axis=0)
+        low_pct, high_pct = ENVELOPE_PERCENTILES
+        artists = [
+            self.ax2.fill_between(self.wavelengths, lower, upper, color='tab:blue', alpha=0.15,
+                                  label=f"{low_pct}-{high_pct}th percentile"),
+            self.ax2.fill_between(self.wavelengths, mean - std, mean + std, color='tab:blue',
+                                  alpha=0.3, label="Mean ± std"),
+            self.ax2.plot(self.wavelengths, mean, color='tab:blue',
+                          label=f"Mean of {len(spectra)} pixels")[0],
+        ]
+        self.envelope_artists = [self.blit_manager.add_artist(artist) for artist in artists]
+
+    def _draw_density(self):
+        spectra = self.selection.spectra
+        low, high = float(spectra.min()), float(spectra.max())
+        if high == low:
+            high = low + 1.0
+
+        # Spectra added since the last update are binned on top of the
+        # existing counts, unless the value range moved or pixels were removed
+        state = self._density_state
+        if (self.density_image is None or state is None or state[0] != (low, high)
+                or state[1] > len(spectra)):
+            counts = np.zeros((DENSITY_BINS, spectra.shape[1]), dtype=np.int64)
+            start = 0
+        else:
+            counts, start = state[2], state[1]
+
+        new = spectra[start:]
+        bins = ((new - low) * (DENSITY_BINS / (high - low))).astype(np.intp)
+        np.clip(bins, 0, DENSITY_BINS - 1, out=bins)
+        flat = bins * spectra.shape[1] + np.arange(spectra.shape[1])
+        counts += np.bincount(flat.ravel(), minlength=counts.size).reshape(counts.shape)
+        self._density_state = ((low, high), len(spectra), counts)
+
+        order = np.argsort(self.wavelengths)
+        centres = low + (np.arange(DENSITY_BINS) + 0.5) * (high - low) / DENSITY_BINS
+        if self.density_image is None:
+            self.density_image = self.blit_manager.add_artist(
+                NonUniformImage(self.ax2, cmap='viridis', interpolation='nearest')
+            )
+            self.ax2.add_image(self.density_image)
+        self.density_image.set_data(self.wavelengths[order], centres,
+                                    np.log1p(counts[:, order]).astype(np.float32))
+        self.density_image.autoscale()
+
+    def _spectrum_limits_changed(self):
+        """Fit the spectrum axis to the selection; True if its limits moved."""
+        spectra = self.selection.spectra
+        if len(spectra) == 0:
+            return autoscale_changed(self.ax2)
+
+        limits = (self.ax2.get_xlim(), self.ax2.get_ylim())
+        x_margin = 0.05 * (self.wavelengths.max() - self.wavelengths.min() or 1.0)
+        y_min, y_max = float(spectra.min()), float(spectra.max())
+        y_margin = 0.05 * (y_max - y_min or 1.0)
+        self.ax2.set_xlim(self.wavelengths.min() - x_margin, self.wavelengths.max() + x_margin)
+        self.ax2.set_ylim(y_min - y_margin, y_max + y_margin)
+        return (self.ax2.get_xlim(), self.ax2.get_ylim()) != limits
+
+    def update_spectra(self, click_time=None):
+        """
+        Bring the spectrum axis in line with the selection and repaint it.
+
+        Parameters:
+        click_time (float): time.perf_counter() of the triggering click
+        """
+        mode = self._resolved_mode() if len(self.selection) else None
+        self._remove_artists(keep=mode)
+
+        if mode == 'lines':
+            self._draw_lines()
+        elif mode == 'collection':
+            self._draw_collection()
+        elif mode == 'envelope':
+            self._draw_envelope()
+        elif mode == 'density':
+            self._draw_density()
+        if mode not in (None, 'density'):
+            # 'best' placement scans every vertex, too slow for large selections
+            loc = 'best' if len(self.selection) <= MAX_LEGEND_LINES else 'upper right'
+            self.legend = self.blit_manager.add_artist(self.ax2.legend(loc=loc))
+
+        self.blit_manager.update(click_time, full=self._spectrum_limits_changed())
 
     def plot_spectra(self):
         """
         Plot spectra for all selected pixels with pixel coordinates in the legend.
         """
-        self.ax2.clear()
-        self.ax2.set_title("Pixel Spectrum")
-        self.ax2.set_xlabel("Wavelength (nm)")
-        self.ax2.set_ylabel("Radiance (DN)")
-
-        for (row, col), (wavelengths, pixel_data) in zip(self.selected_pixels, self.selected_pixel_data):
-            self.ax2.plot(wavelengths, pixel_data, label=f"Pixel ({row}, {col})")
-        
-        if self.selected_pixel_data:
-            # Add legend with pixel coordinates
-            self.ax2.legend(loc='best')
-        
-        self.fig.canvas.draw_idle()
+        self._remove_artists(keep=None)
+        self.update_spectra()
 
     def update_image(self):
         """
-        Update the image and replot the selected pixels.
+        Move the selection markers to the selected pixels.
         """
-        self.ax1.clear()  # Clear the previous scatter points and image
-        self.ax1.imshow(self.rgb_image)  # Replot the image
+        pixels = self.selection.pixels
+        self.marker.set_data(pixels[:, 1], pixels[:, 0])
+        # Smaller markers keep long transects readable
+        self.marker.set_markersize(6 if len(pixels) <= MAX_LEGEND_LINES else 2)
 
-        # Plot the selected pixels as a marker on the image
-        for (r, c) in self.selected_pixels:
-            self.ax1.scatter(c, r, color='red', label=f"Pixel ({r}, {c})")
-        
+    def redraw_image(self):
+        """
+        Redraw the image axis, e.g. after rgb_image was replaced.
+        """
+        self.blit_manager.remove_artist(self.marker)
+        self.ax1.clear()
+        self.show_image()
+        self.update_image()
         self.ax1.set_title(f"Click on the FCC image to select up to {self.max_pixels} pixels")
-        self.fig.canvas.draw_idle()  # Redraw the plot
+        self.blit_manager.update(full=True)
 
     def reset(self):
         """
         Reset the pixel selection and clear the plots.
         """
-        self.selected_pixels = []
-        self.selected_pixel_data = []
+        self.selection.clear()
         
-        # Reset RGB image
-        self.ax1.clear()
-        self.ax1.imshow(self.rgb_image)
+        # Reset markers
+        self.update_image()
         self.ax1.set_title(f"Click on the FCC image to select up to {self.max_pixels} pixels")
         
         # Reset spectrum plot
-        self.ax2.clear()
-        self.ax2.set_title("Pixel Spectrum")
-        self.ax2.set_xlabel("Wavelength (nm)")
-        self.ax2.set_ylabel("Radiance (DN)")
-        
-        self.fig.canvas.draw_idle()
+        self.clear_spectrum_plot()
 
     def clear_spectrum_plot(self):
         """
         Clear the spectrum plot.
         """
-        self.ax2.clear()
-        self.ax2.set_title("Pixel Spectrum")
-        self.ax2.set_xlabel("Wavelength (nm)")
-        self.ax2.set_ylabel("Radiance (DN)")
-        self.fig.canvas.draw_idle()
\ No newline at end of file
+        self._remove_artists(keep=None)
+        autoscale_changed(self.ax2)
+        self.blit_manager.update(full=True)
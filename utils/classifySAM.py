@@ -0,0 +1,160 @@
+import numpy as np
+from utils.parallelTiles import iter_tiled
+from utils.instrumentation import timed
+
+# Upper bound on the number of float32 values held per block (~64 MB)
+MAX_BLOCK_ELEMENTS = 2 ** 24
+
+
+def choose_block_rows(image_data, n_entries, max_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Pick the number of cube rows processed per block.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    n_entries (int): Number of library entries scored per pixel
+    max_elements (int): Budget of float32 values for one block
+
+    Returns:
+    int: Rows per block (at least 1)
+    """
+    rows, cols, bands = image_data.shape
+    per_row = cols * max(bands, n_entries, 1)
+    return int(min(rows, max(1, max_elements // per_row)))
+
+
+def classify_block(block, compiled_library, max_angle=None, metric='sam'):
+    """
+    Classify a block of cube rows against a compiled library.
+
+    Parameters:
+    block (ndarray): (block_rows, cols, bands) slice of the cube
+    compiled_library (CompiledLibrary): Library compiled for the cube
+    max_angle (float): Pixels whose best score exceeds this are left unclassified
+    metric (str): Similarity metric (see utils.similarityMetrics.METRICS)
+
+    Returns:
+    tuple: (class index block, min angle block, angle block)
+    """
+    block_rows, cols, bands = block.shape
+    angles = compiled_library.score_spectra(block.reshape(-1, bands), metric)
+
+    # Pixels that cannot be scored (e.g. all zeros) produce NaN angles
+    scorable = ~np.isnan(angles).all(axis=1)
+    best = np.full(angles.shape[0], -1, dtype=np.int32)
+    best[scorable] = np.nanargmin(angles[scorable], axis=1)
+
+    min_angle = np.full(angles.shape[0], np.nan, dtype=np.float32)
+    min_angle[scorable] = angles[scorable, best[scorable]]
+
+    if max_angle is not None:
+        best[min_angle > max_angle] = -1
+
+    return (best.reshape(block_rows, cols),
+            min_angle.reshape(block_rows, cols),
+            angles.reshape(block_rows, cols, -1))
+
+
+def _classify_tile(tile, compiled_library, max_angle, block_rows, keep_angles, metric):
+    """
+    Classify one tile of rows, block by block. Runs inside worker processes.
+    """
+    rows, cols, _ = tile.shape
+    class_map = np.empty((rows, cols), dtype=np.int32)
+    min_angle = np.empty((rows, cols), dtype=np.float32)
+    angles = np.empty((rows, cols, len(compiled_library)), dtype=np.float32) if keep_angles else None
+
+    for start in range(0, rows, block_rows):
+        stop = min(start + block_rows, rows)
+        best, angle, block_angles = classify_block(tile[start:stop], compiled_library, max_angle, metric)
+        class_map[start:stop] = best
+        min_angle[start:stop] = angle
+        if keep_angles:
+            angles[start:stop] = block_angles
+
+    return class_map, min_angle, angles
+
+
+@timed('classify.scene')
+def classify_scene(image_data, compiled_library, block_rows=None, max_angle=None,
+                   return_rule_image=False, rule_image_path=None, n_workers=1, tile_rows=None,
+                   progress=None, metric='sam'):
+    """
+    Classify every pixel of the cube against a compiled spectral library.
+
+    The cube is walked in blocks of rows so peak memory depends on the
+    block size rather than on the scene size. With more than one worker,
+    row tiles are classified in parallel processes that attach to the cube
+    instead of receiving a copy of it. Any registered similarity metric
+    can be used; the angle outputs then hold that metric's scores.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    compiled_library (CompiledLibrary): Library compiled for the cube
+    block_rows (int): Rows per block; chosen from a memory budget if None
+    max_angle (float): Pixels whose best score (angle for SAM) exceeds this get class -1
+    return_rule_image (bool): Also return the (rows, cols, n_entries) angle cube
+    rule_image_path (str): Write the angle cube to this .npy file (memory-mapped)
+        instead of holding it in RAM
+    n_workers (int): Number of worker processes; default_workers() if None
+    tile_rows (int): Rows per parallel tile; split evenly over the workers if None
+    progress (callable): Called as progress(rows_done, rows) after every tile;
+        an exception raised by it stops the classification
+    metric (str): Similarity metric (see utils.similarityMetrics.METRICS)
+
+    Returns:
+    tuple: (class_map, min_angle, rule_image). class_map holds indices into
+        compiled_library.labels (-1 = unclassified); rule_image is None unless
+        requested
+    """
+    rows, cols, _ = image_data.shape
+    n_entries = len(compiled_library)
+    if block_rows is None:
+        block_rows = choose_block_rows(image_data, n_entries)
+
+    class_map = np.full((rows, cols), -1, dtype=np.int32)
+    min_angle = np.full((rows, cols), np.nan, dtype=np.float32)
+
+    rule_image = None
+    if rule_image_path is not None:
+        rule_image = np.lib.format.open_memmap(
+            rule_image_path, mode='w+', dtype=np.float32, shape=(rows, cols, n_entries)
+        )
+    elif return_rule_image:
+        rule_image = np.empty((rows, cols, n_entries), dtype=np.float32)
+
+    if n_entries == 0:
+        return class_map, min_angle, rule_image
+
+    # Library terms are computed once here rather than in every worker
+    compiled_library.metric_terms(metric)
+
+    if n_workers == 1 and tile_rows is None:
+        # Serial path: blocks are the tiles, results go straight to the output
+        tile_rows = block_rows
+
+    tiles = iter_tiled(
+        _classify_tile,
+        image_data,
+        args=(compiled_library, max_angle, block_rows, rule_image is not None, metric),
+        n_workers=n_workers,
+        tile_rows=tile_rows
+    )
+    rows_done = 0
+    try:
+        for (start, stop), (best, angle, angles) in tiles:
+            class_map[start:stop] = best
+            min_angle[start:stop] = angle
+            if rule_image is not None:
+                rule_image[start:stop] = angles
+            rows_done += stop - start
+            if progress is not None:
+                progress(rows_done, rows)
+    finally:
+        # Cancels outstanding tiles if progress() aborted the loop
+        tiles.close()
+
+    if isinstance(rule_image, np.memmap):
+        rule_image.flush()
+
+    return class_map, min_angle, rule_image
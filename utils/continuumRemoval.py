@@ -0,0 +1,300 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.FCC import FCCRenderCache
+from utils.parallelTiles import iter_tiled
+from utils.instrumentation import timed
+
+# Values per tile of rows that is continuum-removed at once (~4 MB of float32)
+CONTINUUM_TILE_ELEMENTS = 2 ** 20
+
+# Continuum-removed tiles kept per cube; a cube up to this size is kept whole
+CONTINUUM_CACHE_BYTES = 2 ** 29
+
+# Continuum-removed cubes kept at once (one per cube and library band set)
+CONTINUUM_CACHE_ENTRIES = 2
+
+
+def continuum_hull(spectra, wavelengths, mask=None):
+    """
+    Upper convex hull (continuum) of many spectra at once.
+
+    Andrew's monotone chain, run over the bands for every spectrum in
+    parallel: each spectrum keeps its own stack of hull vertices in a column
+    of a (bands, n) array, and a band is pushed after popping, for all
+    spectra at once, the vertices that fall below the new chord. The Python
+    loop is over bands, never over spectra.
+
+    Parameters:
+    spectra (ndarray): (n, bands) spectra
+    wavelengths (ndarray): Increasing wavelength of each band
+    mask (ndarray): (n, bands) True where a spectrum has a value; bands
+        outside the mask are skipped (all bands if None)
+
+    Returns:
+    ndarray: (n, bands) float32 continuum, linearly interpolated between
+        hull vertices
+    """
+    y = np.asarray(spectra, dtype=np.float64)
+    x = np.asarray(wavelengths, dtype=np.float64)
+    n, bands = y.shape
+    columns = np.arange(n)
+
+    # Band-major layout keeps every per-band read contiguous
+    y_bands = np.ascontiguousarray(y.T)
+    stack = np.zeros((bands, n), dtype=np.intp)
+    size = np.zeros(n, dtype=np.intp)
+
+    for band in range(bands):
+        active = columns if mask is None else np.flatnonzero(mask[:, band])
+        # Pop the last vertex while it lies on or below the chord from the
+        # vertex before it to this band
+        pending = active[size[active] >= 2]
+        while len(pending):
+            a = stack[size[pending] - 2, pending]
+            b = stack[size[pending] - 1, pending]
+            y_a = y_bands[a, pending]
+            cross = ((x[b] - x[a]) * (y_bands[band, pending] - y_a)
+                     - (y_bands[b, pending] - y_a) * (x[band] - x[a]))
+            pending = pending[cross >= 0]
+            size[pending] -= 1
+            pending = pending[size[pending] >= 2]
+        stack[size[active], active] = band
+        size[active] += 1
+
+    # Hull vertices, then the vertex at or before / at or after every band
+    in_stack = np.arange(bands)[:, np.newaxis] < size
+    vertices = np.zeros((bands, n), dtype=bool)
+    vertices[stack[in_stack], np.nonzero(in_stack)[1]] = True
+
+    band_index = np.arange(bands)[:, np.newaxis]
+    previous = np.maximum.accumulate(np.where(vertices, band_index, 0), axis=0)
+    following = np.minimum.accumulate(np.where(vertices, band_index, bands - 1)[::-1], axis=0)[::-1]
+
+    y_previous = np.take_along_axis(y_bands, previous, axis=0)
+    y_following = np.take_along_axis(y_bands, following, axis=0)
+    span = x[following] - x[previous]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(span > 0, (x[:, np.newaxis] - x[previous]) / span, 0.0)
+    continuum = y_previous + (y_following - y_previous) * fraction
+    return np.ascontiguousarray(continuum.T, dtype=np.float32)
+
+
+@timed('continuum.remove')
+def remove_continuum(spectra, wavelengths, mask=None):
+    """
+    Divide spectra by their upper convex hull, so absorption features are
+    compared independently of the overall shape and brightness.
+
+    Parameters:
+    spectra (ndarray): (..., bands) spectra
+    wavelengths (ndarray): Increasing wavelength of each band
+    mask (ndarray): True where a spectrum has a value, either per spectrum
+        or one (bands,) mask for all of them (all bands if None)
+
+    Returns:
+    ndarray: float32 continuum-removed spectra, 1 on the hull and below 1
+        inside absorption features; 0 outside the mask or where the
+        continuum is not positive
+    """
+    spectra = np.asarray(spectra)
+    shape = spectra.shape
+    flat = spectra.reshape(-1, shape[-1])
+    flat_mask = None if mask is None else np.broadcast_to(mask, shape).reshape(-1, shape[-1])
+
+    continuum = continuum_hull(flat, wavelengths, flat_mask)
+    valid = continuum > 0
+    if flat_mask is not None:
+        valid &= flat_mask
+    removed = np.zeros(flat.shape, dtype=np.float32)
+    np.divide(flat, continuum, out=removed, where=valid)
+    return removed.reshape(shape)
+
+
+class ContinuumRemovedCube:
+    """
+    Continuum-removed view of a cube, computed lazily tile by tile.
+
+    Indexing works like the underlying cube (image_data[row, col],
+    image_data[start:stop], fancy pixel lists). Hulls are computed for
+    whole tiles of rows on first access and kept in an LRU cache, so
+    repeated clicks in the same area and repeated scene passes do not
+    recompute them. Parallel scene passes (utils.parallelTiles) use
+    tile_source(): a cube that fits in the cache is computed once across
+    the workers and then shared; larger cubes are transformed by each
+    worker on its own tiles.
+
+    Hulls can be restricted to some of the bands, so a pixel is
+    continuum-removed over the same bands as a compiled library that does
+    not cover the whole cube; the other bands are 0.
+
+    Attributes:
+    source (ndarray): The original cube
+    wavelengths (ndarray): Wavelength of every band
+    band_mask (ndarray): True for the bands the hulls span (None for all)
+    shape (tuple): Same as the source
+    dtype (dtype): float32
+    """
+
+    def __init__(self, image_data, wavelengths, bands=None, tile_rows=None,
+                 max_cache_bytes=CONTINUUM_CACHE_BYTES):
+        self.source = image_data
+        self.wavelengths = np.asarray(wavelengths, dtype=np.float64)[:image_data.shape[2]]
+        self.band_mask = None
+        if bands is not None:
+            self.band_mask = np.zeros(image_data.shape[2], dtype=bool)
+            self.band_mask[np.asarray(bands, dtype=np.intp)] = True
+        self.shape = image_data.shape
+        self.dtype = np.dtype(np.float32)
+        rows, cols, bands = self.shape
+        if tile_rows is None:
+            tile_rows = CONTINUUM_TILE_ELEMENTS // max(1, cols * bands)
+        self.tile_rows = int(min(rows, max(1, tile_rows)))
+        self.max_cache_bytes = max_cache_bytes
+        self._tiles = OrderedDict()
+        self._tiles_lock = threading.Lock()
+        self._full = None
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _tile(self, index):
+        # Clicks on the GUI thread and background scene passes share tiles
+        with self._tiles_lock:
+            tile = self._tiles.get(index)
+            if tile is not None:
+                self._tiles.move_to_end(index)
+                return tile
+
+        start = index * self.tile_rows
+        tile = remove_continuum(self.source[start:start + self.tile_rows], self.wavelengths, self.band_mask)
+        tile.flags.writeable = False
+        with self._tiles_lock:
+            self._tiles[index] = tile
+            max_tiles = max(1, self.max_cache_bytes // max(1, tile.nbytes))
+            while len(self._tiles) > max_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def read_rows(self, start, stop):
+        """
+        Continuum-removed rows start:stop.
+
+        Returns:
+        ndarray: (stop - start, cols, bands) float32 values (read-only when
+            served from the cache)
+        """
+        if self._full is not None:
+            return self._full[start:stop]
+        first, last = start // self.tile_rows, (max(start, stop - 1)) // self.tile_rows
+        if first == last:
+            offset = first * self.tile_rows
+            return self._tile(first)[start - offset:stop - offset]
+        offset = first * self.tile_rows
+        rows = np.concatenate([self._tile(i) for i in range(first, last + 1)])
+        return rows[start - offset:stop - offset]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows, rest = key[0], key[1:]
+
+        if isinstance(rows, (int, np.integer)):
+            row = int(rows) + (self.shape[0] if rows < 0 else 0)
+            return self.read_rows(row, row + 1)[(0,) + rest]
+        if isinstance(rows, slice) and (rows.step or 1) > 0:
+            start, stop, step = rows.indices(self.shape[0])
+            return self.read_rows(start, max(start, stop))[(slice(None, None, step),) + rest]
+
+        # Pixel lists: hulls of just the selected spectra
+        spatial = key[:2]
+        band_key = rest[1] if len(rest) > 1 else slice(None)
+        spectra = np.asarray(self.source[spatial + (slice(None),)])
+        return remove_continuum(spectra, self.wavelengths, self.band_mask)[..., band_key]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.materialize()
+        return values if dtype is None else values.astype(dtype)
+
+    def materialize(self, n_workers=1):
+        """
+        Compute the whole continuum-removed cube, keeping it if it fits in
+        the cache.
+
+        Parameters:
+        n_workers (int): Worker processes for the hull computation
+
+        Returns:
+        ndarray: (rows, cols, bands) float32 values
+        """
+        if self._full is not None:
+            return self._full
+
+        values = np.empty(self.shape, dtype=np.float32)
+        args = (self.wavelengths, self.band_mask)
+        for (start, stop), tile in iter_tiled(remove_continuum, self.source, args=args,
+                                              n_workers=n_workers, tile_rows=self.tile_rows):
+            values[start:stop] = tile
+        values.flags.writeable = False
+
+        if self.nbytes <= self.max_cache_bytes:
+            self._full = values
+            with self._tiles_lock:
+                self._tiles.clear()
+        return values
+
+    def tile_source(self, n_workers):
+        """
+        What parallel tile passes should share with their workers.
+
+        Parameters:
+        n_workers (int): Worker processes of the pass
+
+        Returns:
+        tuple: (cube, transform). Either the finished values and None, or
+            the source cube and (function, args) for the workers to apply
+            to every tile
+        """
+        if self.nbytes <= self.max_cache_bytes:
+            return self.materialize(n_workers), None
+        return self.source, (remove_continuum, (self.wavelengths, self.band_mask))
+
+
+# Continuum-removed cubes shared by every tab. Kept apart from the FCC
+# render cache, so changing a composite's bands or stretch never evicts
+# the hulls
+continuum_cache = FCCRenderCache(max_entries=CONTINUUM_CACHE_ENTRIES)
+
+
+def get_continuum_removed_cube(image_data, wavelengths, bands=None):
+    """
+    Return the continuum-removed view of a cube from the continuum cache,
+    so every tab and scene pass reuses the same computed hulls.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    wavelengths (list): Wavelength of each cube band
+    bands (ndarray): Cube bands the hulls span, e.g. the band_indices of a
+        compiled library (all bands if None)
+
+    Returns:
+    ContinuumRemovedCube: Lazily computed continuum-removed cube
+    """
+    wavelengths = tuple(float(w) for w in wavelengths[:image_data.shape[2]])
+    if bands is not None:
+        bands = tuple(sorted(set(int(band) for band in bands)))
+        # A library covering every band shares the whole-cube hulls
+        if len(bands) == image_data.shape[2]:
+            bands = None
+    return continuum_cache.get_or_render(
+        image_data, ('continuum', wavelengths, bands),
+        lambda: ContinuumRemovedCube(image_data, wavelengths, bands)
+    )
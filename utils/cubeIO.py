@@ -0,0 +1,190 @@
+import os
+import numpy as np
+from utils.instrumentation import timed
+
+
+@timed('cube.load')
+def load_cube(path, mmap=True):
+    """
+    Open a hyperspectral data cube stored as a .npy file or as ENVI raw data
+    (pass the .hdr file).
+
+    By default the file is memory-mapped read-only, so only the pages that
+    are actually indexed (a clicked pixel, the FCC bands, a block of rows)
+    are read from disk.
+
+    Parameters:
+    path (str): Path to the .npy cube (rows, cols, bands) or ENVI header
+    mmap (bool): Memory-map the file instead of reading it into RAM
+
+    Returns:
+    ndarray: Hyperspectral image data cube (np.memmap when mmap is True)
+    """
+    if path.lower().endswith('.hdr'):
+        return load_envi(path, mmap)[0]
+
+    image_data = np.load(path, mmap_mode='r' if mmap else None)
+    if image_data.ndim != 3:
+        raise ValueError(f"Expected a (rows, cols, bands) cube, got shape {image_data.shape}")
+    return image_data
+
+
+# ENVI "data type" codes supported by the reader
+ENVI_DATA_TYPES = {
+    1: 'u1',
+    2: 'i2',
+    3: 'i4',
+    4: 'f4',
+    5: 'f8',
+    12: 'u2',
+    13: 'u4',
+    14: 'i8',
+    15: 'u8',
+}
+
+# Axis order of the raw file for each interleave, and the transpose that
+# turns it into a (rows, cols, bands) view
+ENVI_INTERLEAVES = {
+    'bsq': (('bands', 'lines', 'samples'), (1, 2, 0)),
+    'bil': (('lines', 'bands', 'samples'), (0, 2, 1)),
+    'bip': (('lines', 'samples', 'bands'), (0, 1, 2)),
+}
+
+# Extensions tried, in order, for the binary file next to an ENVI header
+ENVI_DATA_EXTENSIONS = ('', '.img', '.dat', '.raw', '.bsq', '.bil', '.bip')
+
+
+def parse_envi_header(header_path):
+    """
+    Parse an ENVI .hdr file.
+
+    Parameters:
+    header_path (str): Path to the ENVI header
+
+    Returns:
+    dict: Header fields keyed by lower-case name; {...} values become lists
+        of strings, everything else is kept as a string
+    """
+    with open(header_path, 'r') as f:
+        lines = f.read().splitlines()
+
+    if not lines or lines[0].strip() != 'ENVI':
+        raise ValueError(f"{header_path} is not an ENVI header")
+
+    header = {}
+    i = 1
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        if '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        key, value = key.strip().lower(), value.strip()
+
+        if value.startswith('{'):
+            # Brace values may continue over several lines
+            while '}' not in value and i < len(lines):
+                value += ' ' + lines[i].strip()
+                i += 1
+            items = value.strip()[1:-1].split(',')
+            header[key] = [item.strip() for item in items if item.strip()]
+        else:
+            header[key] = value
+
+    return header
+
+
+def find_envi_data_file(header_path):
+    """
+    Locate the raw binary file that belongs to an ENVI header.
+
+    Parameters:
+    header_path (str): Path to the ENVI header
+
+    Returns:
+    str: Path to the raw data file
+    """
+    stem = os.path.splitext(header_path)[0]
+    for ext in ENVI_DATA_EXTENSIONS:
+        for path in (stem + ext, stem + ext.upper()):
+            if os.path.isfile(path):
+                return path
+    raise FileNotFoundError(f"No ENVI data file found for {header_path}")
+
+
+def envi_metadata(header):
+    """
+    Build SpectraVis metadata from the wavelength and bad-band fields of an
+    ENVI header.
+
+    Parameters:
+    header (dict): Parsed ENVI header
+
+    Returns:
+    dict: Metadata with 'band_to_wavelength' (and 'bad_bands' if the header
+        has a bad band list), or None if the header has no wavelengths
+    """
+    if 'wavelength' not in header:
+        return None
+
+    wavelengths = [float(w) for w in header['wavelength']]
+    units = header.get('wavelength units', 'nanometers').lower()
+    if units in ('micrometers', 'microns', 'um'):
+        wavelengths = [w * 1000.0 for w in wavelengths]
+
+    metadata = {
+        "band_to_wavelength": {
+            str(band): [band, wavelength] for band, wavelength in enumerate(wavelengths, start=1)
+        }
+    }
+    if 'bbl' in header:
+        # ENVI marks bad bands with 0 in the bad band list
+        metadata["bad_bands"] = [band for band, good in enumerate(header['bbl'], start=1)
+                                 if float(good) == 0]
+    return metadata
+
+
+@timed('cube.load_envi')
+def load_envi(header_path, mmap=True):
+    """
+    Open an ENVI raw cube (BSQ, BIL or BIP) as a (rows, cols, bands) array.
+
+    The raw file is memory-mapped in its own layout and exposed through a
+    transposed view, so nothing is copied or reordered in memory and pixel
+    spectra and band slices are read with the strides of the interleave.
+
+    Parameters:
+    header_path (str): Path to the ENVI .hdr file
+    mmap (bool): Memory-map the file instead of reading it into RAM
+
+    Returns:
+    tuple: (image_data, metadata) where metadata comes from envi_metadata
+    """
+    header = parse_envi_header(header_path)
+
+    data_type = int(header['data type'])
+    if data_type not in ENVI_DATA_TYPES:
+        raise ValueError(f"Unsupported ENVI data type: {data_type}")
+    byte_order = '>' if int(header.get('byte order', 0)) == 1 else '<'
+    dtype = np.dtype(byte_order + ENVI_DATA_TYPES[data_type])
+
+    interleave = header.get('interleave', 'bsq').lower()
+    if interleave not in ENVI_INTERLEAVES:
+        raise ValueError(f"Unsupported ENVI interleave: {interleave}")
+    axes, transpose = ENVI_INTERLEAVES[interleave]
+
+    dims = {
+        'lines': int(header['lines']),
+        'samples': int(header['samples']),
+        'bands': int(header['bands']),
+    }
+    shape = tuple(dims[axis] for axis in axes)
+    offset = int(header.get('header offset', 0))
+
+    data_path = find_envi_data_file(header_path)
+    if mmap:
+        raw = np.memmap(data_path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    else:
+        raw = np.fromfile(data_path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+    return raw.transpose(transpose), envi_metadata(header)
@@ -0,0 +1,301 @@
+import atexit
+import functools
+import json
+import math
+import multiprocessing
+import os
+import threading
+import time
+
+# Environment variable that turns profiling on: "1" to collect timings,
+# or a path ending in .json to also write the session profile there on exit
+PROFILE_ENV = "SPECTRAVIS_PROFILE"
+
+# Profile file format version
+PROFILE_VERSION = 1
+
+
+class Histogram:
+    """
+    Running summary of a series of values (durations, sizes, ...).
+
+    Values are counted in power-of-two buckets, so the memory used does not
+    grow with the number of values and percentiles are estimated to within
+    a factor of two without keeping the samples.
+
+    Attributes:
+    count (int): Number of values
+    total (float): Sum of the values
+    minimum (float): Smallest value
+    maximum (float): Largest value
+    last (float): Most recent value
+    buckets (dict): Exponent e -> number of values in (2^(e-1), 2^e];
+        zero and negative values are counted under None
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.last = None
+        self.buckets = {}
+
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        self.last = value
+        exponent = math.frexp(value)[1] if value > 0 else None
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+    def percentile(self, q):
+        """
+        Estimate a percentile as the upper edge of the bucket it falls in.
+
+        Parameters:
+        q (float): Percentile, 0 to 100
+
+        Returns:
+        float: Estimated value (None if there are no values)
+        """
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = self.buckets.get(None, 0)
+        if seen and seen >= rank:
+            return min(0.0, self.maximum)
+        for exponent in sorted(e for e in self.buckets if e is not None):
+            seen += self.buckets[exponent]
+            if seen >= rank:
+                return min(math.ldexp(1.0, exponent), self.maximum)
+        return self.maximum
+
+    def bucket_counts(self):
+        """
+        Non-empty buckets, smallest first.
+
+        Returns:
+        list: [upper edge, count] pairs; zero and negative values have edge 0
+        """
+        exponents = sorted(self.buckets, key=lambda e: -math.inf if e is None else e)
+        return [[0.0 if e is None else math.ldexp(1.0, e), self.buckets[e]] for e in exponents]
+
+    def summary(self):
+        """
+        Summary statistics of the values.
+
+        Returns:
+        dict: count, total, mean, min, max, last, p50 and p95
+        """
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count,
+            'min': self.minimum,
+            'max': self.maximum,
+            'last': self.last,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+        }
+
+
+class _Span:
+    """Times one pass through a named stage."""
+
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record_span(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    """Span handed out while profiling is off; does nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    """
+    Collects named spans (timed stages), counters and histograms.
+
+    While disabled every call returns after checking one attribute, so the
+    instrumentation can stay in hot paths. Updates are thread-safe, so
+    background tasks report into the same profile as the GUI thread.
+
+    Attributes:
+    enabled (bool): Whether anything is recorded
+    started (float): time.time() when the profile was started or last reset
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+
+    def reset(self):
+        """Drop everything recorded so far."""
+        with self._lock:
+            self.started = time.time()
+            self._spans = {}
+            self._counters = {}
+            self._histograms = {}
+
+    def span(self, name):
+        """
+        Context manager timing a stage.
+
+        Parameters:
+        name (str): Dotted stage name, e.g. 'library.read'
+
+        Returns:
+        object: Context manager (a no-op while disabled)
+        """
+        return _Span(self, name) if self.enabled else _NULL_SPAN
+
+    def record_span(self, name, seconds):
+        """Add one timed pass through a stage."""
+        with self._lock:
+            histogram = self._spans.get(name)
+            if histogram is None:
+                histogram = self._spans[name] = Histogram()
+            histogram.add(seconds)
+
+    def count(self, name, n=1):
+        """Increase a counter."""
+        if self.enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        """Add a value to a histogram."""
+        if self.enabled:
+            with self._lock:
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = Histogram()
+                histogram.add(value)
+
+    def snapshot(self):
+        """
+        Current state of the profile.
+
+        Returns:
+        dict: 'version', 'started', 'elapsed' (seconds), 'spans' (name ->
+            summary of the durations in seconds), 'counters' (name -> value)
+            and 'histograms' (name -> summary with its 'buckets')
+        """
+        with self._lock:
+            return {
+                'version': PROFILE_VERSION,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'elapsed': time.time() - self.started,
+                'spans': {name: h.summary() for name, h in sorted(self._spans.items())},
+                'counters': dict(sorted(self._counters.items())),
+                'histograms': {name: dict(h.summary(), buckets=h.bucket_counts())
+                               for name, h in sorted(self._histograms.items())},
+            }
+
+    def dump(self, path):
+        """
+        Write the profile to a JSON file.
+
+        Parameters:
+        path (str): Output path
+        """
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=4)
+
+
+def profiling_requested():
+    """
+    Whether the environment asks for profiling.
+
+    Returns:
+    bool: True if SPECTRAVIS_PROFILE is set to anything but '', '0' or 'false'
+    """
+    return os.environ.get(PROFILE_ENV, '').strip().lower() not in ('', '0', 'false', 'no')
+
+
+# Profile shared by the whole application
+profiler = Profiler(enabled=profiling_requested())
+
+
+def span(name):
+    """Time a stage of the shared profile, see Profiler.span."""
+    return profiler.span(name)
+
+
+def count(name, n=1):
+    """Increase a counter of the shared profile."""
+    profiler.count(name, n)
+
+
+def observe(name, value):
+    """Add a value to a histogram of the shared profile."""
+    profiler.observe(name, value)
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as a span of the shared profile.
+
+    Parameters:
+    name (str): Span name
+
+    Returns:
+    callable: Decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with _Span(profiler, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def dump_profile(path):
+    """
+    Write the shared profile to a JSON file.
+
+    Parameters:
+    path (str): Output path
+    """
+    profiler.dump(path)
+
+
+def _dump_on_exit():
+    path = os.environ.get(PROFILE_ENV, '')
+    # Worker processes inherit the variable but must not overwrite the profile
+    if profiler.enabled and path.lower().endswith('.json') and multiprocessing.parent_process() is None:
+        profiler.dump(path)
+
+atexit.register(_dump_on_exit)
@@ -0,0 +1,292 @@
+import json
+import os
+import numpy as np
+from utils.cubeIO import load_envi
+from utils.spectralLib import make_library_entry
+from utils.instrumentation import timed
+
+# Label of the unlabelled background in ground-truth maps (e.g. Salinas, Indian Pines)
+DEFAULT_IGNORE_LABELS = (0,)
+
+# Upper bound on the number of cube values reduced per block of rows
+MAX_BLOCK_ELEMENTS = 2 ** 22
+
+
+def _block_class_statistics(pixels, labels):
+    """
+    Per-class statistics of one block of labelled pixels.
+
+    Pixels are sorted by label once, after which every class is a contiguous
+    segment and all sums are segment reductions (np.add.reduceat) over the
+    whole block; there is no loop over pixels or classes. The sorted block
+    is laid out band-major so every reduction runs over contiguous values.
+
+    Parameters:
+    pixels (ndarray): (n, bands) spectra
+    labels (ndarray): (n,) class label of every spectrum
+
+    Returns:
+    tuple: (classes, pixel counts, and (classes, bands) per-band counts,
+        means, sums of squared deviations, minima and maxima)
+    """
+    # Small non-negative labels sort with a radix sort
+    sort_keys = labels
+    if len(labels) and labels.min() >= 0 and labels.max() < 2 ** 16:
+        sort_keys = labels.astype(np.uint16)
+    order = np.argsort(sort_keys, kind='stable')
+    labels = labels[order]
+    starts = np.flatnonzero(np.concatenate(([True], labels[1:] != labels[:-1])))
+    sizes = np.diff(np.append(starts, len(labels)))
+    values = np.ascontiguousarray(pixels[order].T, dtype=np.float64)
+
+    # Missing values (NaN) only count against their own band
+    valid = ~np.isnan(values) if pixels.dtype.kind == 'f' else None
+    if valid is not None and not valid.all():
+        counts = np.add.reduceat(valid, starts, axis=1).T.astype(np.float64)
+        low = np.minimum.reduceat(np.where(valid, values, np.inf), starts, axis=1).T
+        high = np.maximum.reduceat(np.where(valid, values, -np.inf), starts, axis=1).T
+        values[~valid] = 0.0
+    else:
+        counts = np.broadcast_to(sizes[:, np.newaxis].astype(np.float64), (len(starts), len(values)))
+        low = np.minimum.reduceat(values, starts, axis=1).T
+        high = np.maximum.reduceat(values, starts, axis=1).T
+
+    # Within a block the squared deviations follow from the sums of squares;
+    # blocks are merged with the pairwise update, which keeps this accurate
+    sums = np.add.reduceat(values, starts, axis=1).T
+    squares = np.add.reduceat(np.square(values, out=values), starts, axis=1).T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(counts > 0, sums / counts, 0.0)
+    m2 = np.maximum(squares - sums * mean, 0.0)
+    return labels[starts], sizes, counts, mean, m2, low, high
+
+
+@timed('library.class_statistics')
+def class_statistics(image_data, labels, ignore_labels=DEFAULT_IGNORE_LABELS, max_block_elements=MAX_BLOCK_ELEMENTS,
+                     progress=None):
+    """
+    Per-class mean, variance and sample count spectra of a labelled cube.
+
+    The cube is read once, a block of rows at a time. Every block is reduced
+    per class with segment reductions and merged into the running totals
+    with the pairwise mean/variance update, so memory use is bounded by the
+    block size and a memory-mapped cube is never loaded as a whole.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    labels (ndarray): (rows, cols) integer class map aligned to the cube
+    ignore_labels (tuple): Labels that are not classes (background)
+    max_block_elements (int): Cube values reduced per block
+    progress (callable): Called as progress(rows_done, rows) after every block
+
+    Returns:
+    dict: 'classes' (sorted class labels), 'pixel_count' per class, and
+        (classes, bands) arrays 'count' (valid values per band), 'mean',
+        'variance' (the covariance diagonal), 'min' and 'max'
+    """
+    rows, cols, bands = image_data.shape
+    if labels.shape[:2] != (rows, cols):
+        raise ValueError(f"Label raster of shape {labels.shape} does not match the cube ({rows}, {cols})")
+    if labels.dtype.kind not in 'iub':
+        if not np.array_equal(labels, np.round(labels)):
+            raise ValueError("Label raster must contain integer class labels")
+    ignore = np.asarray(ignore_labels, dtype=np.int64)
+    block_rows = max(1, max_block_elements // max(1, cols * bands))
+
+    slots = {}
+    pixel_count = np.zeros(0, dtype=np.int64)
+    count = np.zeros((0, bands))
+    mean = np.zeros((0, bands))
+    m2 = np.zeros((0, bands))
+    low = np.zeros((0, bands))
+    high = np.zeros((0, bands))
+
+    for start in range(0, rows, block_rows):
+        stop = min(start + block_rows, rows)
+        block_labels = np.asarray(labels[start:stop]).reshape(-1).astype(np.int64)
+        keep = ~np.isin(block_labels, ignore)
+        if keep.any():
+            pixels = np.asarray(image_data[start:stop]).reshape(-1, bands)[keep]
+            classes, sizes, n_b, mean_b, m2_b, low_b, high_b = _block_class_statistics(pixels, block_labels[keep])
+
+            # Classes seen for the first time start from empty totals
+            new = [int(c) for c in classes if int(c) not in slots]
+            if new:
+                for c in new:
+                    slots[c] = len(slots)
+                grow = len(new)
+                pixel_count = np.concatenate((pixel_count, np.zeros(grow, dtype=np.int64)))
+                count = np.concatenate((count, np.zeros((grow, bands))))
+                mean = np.concatenate((mean, np.zeros((grow, bands))))
+                m2 = np.concatenate((m2, np.zeros((grow, bands))))
+                low = np.concatenate((low, np.full((grow, bands), np.inf)))
+                high = np.concatenate((high, np.full((grow, bands), -np.inf)))
+
+            index = np.array([slots[int(c)] for c in classes], dtype=np.intp)
+            n_a = count[index]
+            total = n_a + n_b
+            delta = mean_b - mean[index]
+            fraction = np.divide(n_b, total, out=np.zeros_like(total), where=total > 0)
+            mean[index] += delta * fraction
+            m2[index] += m2_b + np.square(delta) * n_a * fraction
+            count[index] = total
+            pixel_count[index] += sizes
+            low[index] = np.minimum(low[index], low_b)
+            high[index] = np.maximum(high[index], high_b)
+
+        if progress is not None:
+            progress(stop, rows)
+
+    order = sorted(slots, key=lambda c: c)
+    index = np.array([slots[c] for c in order], dtype=np.intp)
+    empty = count[index] == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = np.where(empty, np.nan, m2[index] / count[index])
+    return {
+        'classes': np.array(order, dtype=np.int64),
+        'pixel_count': pixel_count[index],
+        'count': count[index].astype(np.int64),
+        'mean': np.where(empty, np.nan, mean[index]),
+        'variance': variance,
+        'min': np.where(empty, np.nan, low[index]),
+        'max': np.where(empty, np.nan, high[index]),
+    }
+
+
+def load_label_raster(path):
+    """
+    Open a ground-truth class map stored as a .npy file or as a one-band
+    ENVI image (pass the .hdr file), memory-mapped read-only.
+
+    Parameters:
+    path (str): Path to the label raster
+
+    Returns:
+    ndarray: (rows, cols) class labels
+    """
+    if path.lower().endswith('.hdr'):
+        labels = load_envi(path)[0]
+    else:
+        labels = np.load(path, mmap_mode='r')
+    if labels.ndim == 3 and labels.shape[2] == 1:
+        labels = labels[:, :, 0]
+    if labels.ndim != 2:
+        raise ValueError(f"Expected a (rows, cols) label raster, got shape {labels.shape}")
+    return labels
+
+
+def load_class_names(path):
+    """
+    Read class names for a label raster.
+
+    Parameters:
+    path (str): JSON file with an object mapping class label to name
+        ({"1": "Brocoli_green_weeds_1", ...}), a list of names indexed by
+        label, or the .labels.json written next to a classification
+
+    Returns:
+    dict: Class label (int) -> name
+    """
+    with open(path, 'r') as f:
+        names = json.load(f)
+    if isinstance(names, dict) and isinstance(names.get('labels'), list):
+        names = names['labels']
+    if isinstance(names, list):
+        return {i: str(name) for i, name in enumerate(names)}
+    return {int(label): str(name) for label, name in names.items()}
+
+
+def class_names_path(labels_path):
+    """
+    Class names file stored next to a label raster as <raster>.labels.json.
+
+    Parameters:
+    labels_path (str): Path to the label raster
+
+    Returns:
+    str: Path of the names file, or None if there is none
+    """
+    path = os.path.splitext(labels_path)[0] + '.labels.json'
+    return path if os.path.exists(path) else None
+
+
+def find_class_names(labels_path):
+    """
+    Class names stored next to a label raster as <raster>.labels.json.
+
+    Parameters:
+    labels_path (str): Path to the label raster
+
+    Returns:
+    dict: Class label (int) -> name, or None if there is no names file
+    """
+    path = class_names_path(labels_path)
+    return load_class_names(path) if path is not None else None
+
+
+def default_ignore_labels(names_path):
+    """
+    Background labels of a label raster, given its class names file.
+
+    A classification's .labels.json numbers the classes from 0 and marks
+    unclassified pixels with its 'unclassified' value, so that value is the
+    background; for other rasters it is DEFAULT_IGNORE_LABELS.
+
+    Parameters:
+    names_path (str): Class names file (None if there is none)
+
+    Returns:
+    tuple: Labels that are not classes
+    """
+    if names_path is None:
+        return DEFAULT_IGNORE_LABELS
+    with open(names_path, 'r') as f:
+        names = json.load(f)
+    if isinstance(names, dict) and isinstance(names.get('labels'), list) and 'unclassified' in names:
+        return (int(names['unclassified']),)
+    return DEFAULT_IGNORE_LABELS
+
+
+def build_class_library(image_data, labels, wavelengths, class_names=None, ignore_labels=DEFAULT_IGNORE_LABELS,
+                        min_count=1, progress=None):
+    """
+    Build a spectral library with one entry per class of a ground-truth map.
+
+    Every entry holds the class mean spectrum, with the per-band standard
+    deviation (square root of the covariance diagonal), minimum and maximum
+    as statistics, like a saved region of interest. The class label and
+    pixel count are stored with the entry.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    labels (ndarray): (rows, cols) integer class map aligned to the cube
+    wavelengths (list): Wavelength of each cube band
+    class_names (dict): Class label -> entry label; 'Class <label>' if missing
+    ignore_labels (tuple): Labels that are not classes (background)
+    min_count (int): Classes with fewer pixels are left out
+    progress (callable): Called as progress(rows_done, rows) after every block
+
+    Returns:
+    dict: Library in the JSON schema, label -> entry, in class order
+    """
+    stats = class_statistics(image_data, labels, ignore_labels, progress=progress)
+    wavelengths = list(wavelengths)[:image_data.shape[2]]
+    class_names = class_names or {}
+
+    library = {}
+    for i, value in enumerate(stats['classes']):
+        pixel_count = int(stats['pixel_count'][i])
+        if pixel_count < min_count:
+            continue
+        label = class_names.get(int(value), f"Class {value}")
+        statistics = {
+            'std': np.sqrt(stats['variance'][i]),
+            'min': stats['min'][i],
+            'max': stats['max'][i],
+        }
+        # Per-band counts only differ from the pixel count where values are missing
+        if (stats['count'][i] != pixel_count).any():
+            statistics['count'] = stats['count'][i]
+        library[label] = make_library_entry(label, wavelengths, stats['mean'][i], statistics,
+                                            class_value=int(value), pixel_count=pixel_count)
+    return library
@@ -0,0 +1,238 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+import numpy as np
+from utils.similarityMetrics import lowest_scores
+from utils.instrumentation import observe, timed
+
+# The index of a library is saved next to it under this suffix
+INDEX_SUFFIX = '.sidx.npz'
+
+# Number of principal directions kept for the pruning bound
+DEFAULT_INDEX_COMPONENTS = 16
+
+# Entries scored exactly in the first step of a search; each further step
+# scores four times as many
+SEARCH_CHUNK = 256
+
+# Slack added to the bound so float32 rounding can never prune a true match
+_BOUND_SLACK = 1e-5
+
+
+def library_fingerprint(compiled_library, n_components=DEFAULT_INDEX_COMPONENTS):
+    """
+    Hash of the compiled library matrix, identifying the index built from it.
+
+    Parameters:
+    compiled_library (CompiledLibrary): Library compiled for a cube
+    n_components (int): Number of index components
+
+    Returns:
+    str: Hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(compiled_library.matrix).tobytes())
+    digest.update(np.asarray(compiled_library.band_indices, dtype=np.int64).tobytes())
+    digest.update(str(n_components).encode())
+    return digest.hexdigest()
+
+
+class SpectralAngleIndex:
+    """
+    Exact top-k spectral angle search over a compiled library, pruned with
+    an uncentered PCA of the library.
+
+    Every unit-norm library row m is split into its projection p onto the
+    leading principal directions and a residual of norm r. For a unit query
+    x (projection q, residual norm s) the Cauchy-Schwarz inequality gives
+    x . m <= p . q + r * s, a cheap upper bound on the cosine. Entries are
+    scored exactly in order of decreasing bound until the k-th best exact
+    cosine beats every remaining bound, so the result is
+    the same as an exhaustive search while most entries are only touched
+    through their few projected coordinates.
+
+    Attributes:
+    basis (ndarray): (bands, components) principal directions
+    projections (ndarray): (entries, components) projected library rows
+    residuals (ndarray): (entries,) norms of the parts outside the basis
+    fingerprint (str): library_fingerprint of the indexed library
+    last_scored (int): Number of entries scored exactly by the last search
+    """
+
+    def __init__(self, compiled_library, basis, projections, residuals, fingerprint):
+        self.compiled_library = compiled_library
+        self.basis = basis
+        self.projections = projections
+        self.residuals = residuals
+        self.fingerprint = fingerprint
+        self.last_scored = 0
+
+    @classmethod
+    @timed('sam.index_build')
+    def build(cls, compiled_library, n_components=DEFAULT_INDEX_COMPONENTS):
+        """
+        Build the index of a compiled library.
+
+        Parameters:
+        compiled_library (CompiledLibrary): Library compiled for a cube
+        n_components (int): Number of principal directions to keep
+
+        Returns:
+        SpectralAngleIndex: The index
+        """
+        matrix = np.nan_to_num(compiled_library.matrix.astype(np.float64))
+        n_components = max(1, min(n_components, matrix.shape[1]))
+
+        # Eigenvectors of the (bands, bands) scatter matrix are the right
+        # singular vectors of the library, without a decomposition of the whole matrix
+        _, vectors = np.linalg.eigh(matrix.T @ matrix)
+        basis = vectors[:, ::-1][:, :n_components]
+
+        projections = matrix @ basis
+        squared_norms = np.square(matrix).sum(axis=1)
+        residuals = np.sqrt(np.maximum(squared_norms - np.square(projections).sum(axis=1), 0.0))
+
+        return cls(compiled_library, basis.astype(np.float32), projections.astype(np.float32),
+                   residuals.astype(np.float32), library_fingerprint(compiled_library, n_components))
+
+    def save(self, index_path):
+        """
+        Write the index to an .npz file, replacing it atomically.
+
+        Parameters:
+        index_path (str): Output path
+        """
+        # A unique temp file, since cancelled searches may still be saving the same index
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(index_path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, basis=self.basis, projections=self.projections,
+                         residuals=self.residuals, fingerprint=np.array(self.fingerprint))
+            os.replace(temp_path, index_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, index_path, compiled_library):
+        """
+        Read a saved index if it was built from this compiled library.
+
+        Parameters:
+        index_path (str): Path written by save()
+        compiled_library (CompiledLibrary): Library the index must belong to
+
+        Returns:
+        SpectralAngleIndex: The index, or None if missing, unreadable or out of date
+        """
+        try:
+            with np.load(index_path) as data:
+                basis = data['basis']
+                fingerprint = str(data['fingerprint'])
+                if fingerprint != library_fingerprint(compiled_library, basis.shape[1]):
+                    return None
+                return cls(compiled_library, basis, data['projections'], data['residuals'], fingerprint)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            # A truncated or corrupt file is rebuilt like an outdated one
+            return None
+
+    @timed('sam.index_search')
+    def search(self, spectrum, k=10):
+        """
+        Find the k library entries with the smallest spectral angle.
+
+        Parameters:
+        spectrum (ndarray): Spectrum with one value per cube band
+        k (int): Number of matches
+
+        Returns:
+        tuple: (indices, angles) of the k best entries, smallest angle first;
+            angles are exact
+        """
+        library = self.compiled_library
+        n_entries = len(library)
+        k = max(0, min(int(k), n_entries))
+        if k == 0:
+            return np.array([], dtype=np.intp), np.array([], dtype=np.float32)
+
+        values = np.asarray(spectrum, dtype=np.float32)[library.band_indices]
+        norm = float(np.linalg.norm(values))
+        if not library.uniform_bands or norm == 0 or not np.isfinite(norm):
+            # Per-entry band masks give every entry its own pixel norm, so
+            # the bound does not apply; score everything instead
+            self.last_scored = n_entries
+            return lowest_scores(library.score_spectrum(spectrum), k)
+
+        query = values / norm
+        query_projection = query @ self.basis
+        query_residual = np.sqrt(max(0.0, 1.0 - float(query_projection @ query_projection)))
+        bounds = self.projections @ query_projection + self.residuals * query_residual + _BOUND_SLACK
+
+        # Score the entries with the highest bounds, widening the set until
+        # the k-th exact cosine beats the best bound left outside it
+        size = max(SEARCH_CHUNK, 4 * k)
+        while True:
+            if size >= n_entries:
+                candidates = np.arange(n_entries)
+                cosines = library.matrix @ query
+            else:
+                partition = np.argpartition(-bounds, size)
+                candidates = partition[:size]
+                cosines = library.matrix[candidates] @ query
+            keep = np.argpartition(-cosines, k - 1)[:k]
+            if size >= n_entries or cosines[keep].min() >= bounds[partition[size]]:
+                break
+            # Past half the library a full pass is cheaper than partitioning
+            size = size * 4 if size * 8 < n_entries else n_entries
+        best_indices = candidates[keep]
+        self.last_scored = len(candidates)
+        observe('sam.index_scored', self.last_scored)
+
+        # Score the winners from the raw pixel as score_spectrum does; the
+        # normalized query loses precision for angles near zero
+        with np.errstate(divide='ignore', invalid='ignore'):
+            best_cosines = (library.matrix[best_indices] @ values) / np.float32(norm)
+        angles = np.arccos(np.clip(best_cosines, -1.0, 1.0))
+        ranking = np.argsort(angles, kind='stable')
+        return best_indices[ranking], angles[ranking]
+
+
+_index_cache = {}
+
+def get_library_index(compiled_library, library_path=None, n_components=DEFAULT_INDEX_COMPONENTS):
+    """
+    Return the search index of a compiled library, building it at most once.
+
+    With a library path the index is also kept on disk next to the library
+    (<library>.sidx.npz) and reused across sessions as long as the compiled
+    library is unchanged.
+
+    Parameters:
+    compiled_library (CompiledLibrary): Library compiled for a cube
+    library_path (str): Library file the compiled library came from
+    n_components (int): Number of principal directions to keep
+
+    Returns:
+    SpectralAngleIndex: Index of the library
+    """
+    cached = _index_cache.get(id(compiled_library))
+    if cached is not None and cached.compiled_library is compiled_library:
+        return cached
+
+    index = None
+    index_path = library_path + INDEX_SUFFIX if library_path else None
+    if index_path is not None:
+        index = SpectralAngleIndex.load(index_path, compiled_library)
+    if index is None:
+        index = SpectralAngleIndex.build(compiled_library, n_components)
+        if index_path is not None:
+            try:
+                index.save(index_path)
+            except OSError:
+                # A read-only library location only costs the rebuild next session
+                pass
+
+    _index_cache.clear()
+    _index_cache[id(compiled_library)] = index
+    return index
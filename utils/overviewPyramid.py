@@ -0,0 +1,283 @@
+import numpy as np
+from utils.FCC import (DEFAULT_PERCENTILES, FCCStretch, compute_stretch, default_rgb_bands,
+                       get_rgb_image, read_fcc_bands, render_cache, update_range)
+from utils.spectralMetadata import as_metadata
+from utils.pcaTransform import get_component_cube
+from utils.instrumentation import timed
+
+# Scenes with more pixels than this are displayed through an overview pyramid
+PYRAMID_MIN_PIXELS = 4_000_000
+
+# The coarsest level is at most this many pixels along its longer side
+OVERVIEW_SIZE = 1024
+
+# Upper bound on the number of float32 values read per block while building
+MAX_BLOCK_ELEMENTS = 2 ** 24
+
+# Stretch used for on-screen FCCs; clipping 2-98% keeps hot pixels from
+# washing out the scene
+DEFAULT_DISPLAY_STRETCH = 'percentile'
+
+# What an on-screen FCC shows: three cube bands, or the three leading PCA
+# or MNF components (see utils.pcaTransform)
+COMPOSITES = ('bands', 'pca', 'mnf')
+
+
+class OverviewPyramid:
+    """
+    Downsampled FCC levels of a cube, built in one streaming pass.
+
+    Level k (k >= 1) holds the mean of every 2^k x 2^k block of the three
+    FCC bands. Level 0 is the cube itself: full-resolution tiles are read
+    on demand for the visible window only. Values are kept unstretched;
+    normalize() maps them to [0, 1] with the same stretch create_rgb_image
+    would use, computed from full-resolution values.
+
+    Attributes:
+    shape (tuple): (rows, cols) of the full-resolution scene
+    bands (tuple): Zero-based (red, green, blue) band indices
+    levels (list): levels[k - 1] is the (rows / 2^k, cols / 2^k, 3) level k
+    stretch (FCCStretch): Stretch applied by normalize()
+    """
+
+    @timed('fcc.pyramid')
+    def __init__(self, image_data, bands, n_levels=None, block_rows=None,
+                 stretch='global', percentiles=DEFAULT_PERCENTILES):
+        self.image_data = image_data
+        self.bands = tuple(bands)
+        rows, cols = image_data.shape[:2]
+        self.shape = (rows, cols)
+
+        if n_levels is None:
+            n_levels = 0
+            while max(rows, cols) >> n_levels > OVERVIEW_SIZE:
+                n_levels += 1
+        # Every level needs at least one pixel
+        n_levels = max(0, min(n_levels, int(np.log2(max(1, min(rows, cols))))))
+
+        self.levels = [np.empty((rows >> k, cols >> k, 3), dtype=np.float32)
+                       for k in range(1, n_levels + 1)]
+        lower = np.full(3, np.inf, dtype=np.float32)
+        upper = np.full(3, -np.inf, dtype=np.float32)
+
+        # Blocks are a multiple of the coarsest cell so cells never straddle blocks
+        cell = 1 << n_levels
+        if block_rows is None:
+            block_rows = MAX_BLOCK_ELEMENTS // max(1, cols * 3)
+        block_rows = max(cell, block_rows // cell * cell)
+
+        for start in range(0, rows, block_rows):
+            stop = min(start + block_rows, rows)
+            block = self.read_tile(start, stop, 0, cols)
+            update_range(block.reshape(-1, 3), lower, upper)
+
+            for k, level in enumerate(self.levels, start=1):
+                # Halve the previous level of this block
+                block = block[:block.shape[0] // 2 * 2, :block.shape[1] // 2 * 2]
+                h, w = block.shape[0] // 2, block.shape[1] // 2
+                block = block.reshape(h, 2, w, 2, 3).mean(axis=(1, 3), dtype=np.float32)
+                level[start >> k:(start >> k) + h] = block
+
+        # Min/max stretches come for free from the pass above
+        if stretch == 'global':
+            self.stretch = FCCStretch(stretch, np.full(3, lower.min()), np.full(3, upper.max()))
+        elif stretch == 'minmax':
+            self.stretch = FCCStretch(stretch, lower, upper)
+        else:
+            self.stretch = compute_stretch(image_data, self.bands, stretch, percentiles)
+
+    @property
+    def n_levels(self):
+        return len(self.levels)
+
+    def read_tile(self, row_start, row_stop, col_start, col_stop):
+        """
+        Read the three FCC bands of a full-resolution window from the cube.
+
+        Returns:
+        ndarray: (rows, cols, 3) float32 unstretched values
+        """
+        return read_fcc_bands(self.image_data, self.bands, row_start, row_stop, col_start, col_stop)
+
+    def normalize(self, values):
+        """
+        Stretch unstretched values to [0, 1] for display.
+
+        Parameters:
+        values (ndarray): Values from a level or a full-resolution tile
+
+        Returns:
+        ndarray: Displayable float32 RGB values
+        """
+        return self.stretch.apply(values)
+
+    def level_for_scale(self, scene_pixels_per_screen_pixel):
+        """
+        Pick the coarsest level that still has at least one pixel per screen pixel.
+
+        Parameters:
+        scene_pixels_per_screen_pixel (float): Zoom, in full-resolution pixels per screen pixel
+
+        Returns:
+        int: Level index (0 = full resolution)
+        """
+        if scene_pixels_per_screen_pixel <= 1:
+            return 0
+        return int(min(self.n_levels, np.floor(np.log2(scene_pixels_per_screen_pixel))))
+
+    def get_view(self, level, row_start, row_stop, col_start, col_stop):
+        """
+        Displayable RGB for a full-resolution window at the given level.
+
+        Parameters:
+        level (int): Pyramid level (0 reads from the cube)
+        row_start, row_stop, col_start, col_stop (int): Window in full-resolution pixels
+
+        Returns:
+        tuple: (rgb, extent) where extent is the imshow extent of rgb in
+            full-resolution pixel coordinates
+        """
+        if level == 0:
+            rgb = self.read_tile(row_start, row_stop, col_start, col_stop)
+            r0, r1, c0, c1 = row_start, row_stop, col_start, col_stop
+        else:
+            data = self.levels[level - 1]
+            r0, c0 = row_start >> level, col_start >> level
+            r1 = min(data.shape[0], -(-row_stop >> level))
+            c1 = min(data.shape[1], -(-col_stop >> level))
+            rgb = data[r0:r1, c0:c1]
+            r0, r1, c0, c1 = r0 << level, r1 << level, c0 << level, c1 << level
+
+        return self.normalize(rgb), (c0 - 0.5, c1 - 0.5, r1 - 0.5, r0 - 0.5)
+
+
+def get_overview_pyramid(image_data, bands, stretch='global', percentiles=DEFAULT_PERCENTILES):
+    """
+    Return the overview pyramid of a cube from the shared render cache,
+    building it on first use.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    bands (tuple): Zero-based (red, green, blue) band indices
+    stretch (str): One of STRETCH_MODES
+    percentiles (tuple): 'percentile' only - lower and upper percentile
+
+    Returns:
+    OverviewPyramid: Pyramid for the cube and bands
+    """
+    bands = tuple(int(b) for b in bands)
+    percentiles = tuple(float(p) for p in percentiles)
+    return render_cache.get_or_render(
+        image_data, ('pyramid', bands, stretch, percentiles),
+        lambda: OverviewPyramid(image_data, bands, stretch=stretch, percentiles=percentiles)
+    )
+
+
+class PyramidImageView:
+    """
+    Show an overview pyramid on a matplotlib axis.
+
+    The image artist always covers the visible window in full-resolution
+    pixel coordinates, so clicks map to cube pixels as with a plain imshow.
+    Whenever the view limits change (zoom/pan through the navigation
+    toolbar), the level matching the zoom is selected and only the visible
+    part of it is pushed to the canvas.
+    """
+
+    def __init__(self, ax, pyramid):
+        self.ax = ax
+        self.pyramid = pyramid
+        rows, cols = pyramid.shape
+        self._current = None
+
+        level = pyramid.n_levels
+        rgb, extent = pyramid.get_view(level, 0, rows, 0, cols)
+        self.image = ax.imshow(rgb, extent=extent, interpolation='nearest')
+        ax.set_xlim(-0.5, cols - 0.5)
+        ax.set_ylim(rows - 0.5, -0.5)
+        # Swapping the level must not rescale the view
+        ax.set_autoscale_on(False)
+        self._current = (level, 0, rows, 0, cols)
+
+        # Plain functions are held strongly by the registry, keeping the view alive
+        ax.callbacks.connect('xlim_changed', lambda ax: self.update())
+        ax.callbacks.connect('ylim_changed', lambda ax: self.update())
+
+    @timed('fcc.view_update')
+    def update(self):
+        """Re-select the level and window for the current view limits."""
+        rows, cols = self.pyramid.shape
+        x0, x1 = sorted(self.ax.get_xlim())
+        y0, y1 = sorted(self.ax.get_ylim())
+        col_start, col_stop = max(0, int(np.floor(x0 + 0.5))), min(cols, int(np.ceil(x1 + 0.5)))
+        row_start, row_stop = max(0, int(np.floor(y0 + 0.5))), min(rows, int(np.ceil(y1 + 0.5)))
+        if col_stop <= col_start or row_stop <= row_start:
+            return
+
+        bbox = self.ax.get_window_extent()
+        scale = max((x1 - x0) / max(bbox.width, 1), (y1 - y0) / max(bbox.height, 1))
+        level = self.pyramid.level_for_scale(scale)
+
+        view = (level, row_start, row_stop, col_start, col_stop)
+        if view == self._current:
+            return
+        self._current = view
+
+        rgb, extent = self.pyramid.get_view(*view)
+        self.image.set_data(rgb)
+        self.image.set_extent(extent)
+
+
+class FCCDisplay:
+    """
+    FCC of a cube that draws itself on an axis.
+
+    Scenes up to PYRAMID_MIN_PIXELS show the cached full-resolution RGB
+    image; larger scenes are shown through an overview pyramid so only the
+    visible window is ever rendered at full resolution.
+
+    PCA and MNF composites show the three leading components, projected
+    lazily from the cube with its cached transform.
+
+    Attributes:
+    stretch (str): Stretch mode of the composite
+    composite (str): One of COMPOSITES
+    rgb_image (ndarray): Full-resolution RGB image (None for pyramid display)
+    pyramid (OverviewPyramid): Pyramid (None for small scenes)
+    shape (tuple): (rows, cols) of the scene
+    """
+
+    def __init__(self, image_data, metadata=None, bands=None, stretch=DEFAULT_DISPLAY_STRETCH,
+                 max_full_pixels=PYRAMID_MIN_PIXELS, composite='bands'):
+        if composite not in COMPOSITES:
+            raise ValueError(f"Unknown composite: {composite}")
+        if composite != 'bands':
+            band_mask = as_metadata(metadata).band_mask if metadata is not None else None
+            image_data = get_component_cube(image_data, composite, 3, band_mask)
+            bands = (0, 1, 2)
+        elif bands is None:
+            bands = default_rgb_bands(image_data, metadata)
+        self.shape = image_data.shape[:2]
+        self.stretch = stretch
+        self.composite = composite
+        self.rgb_image = None
+        self.pyramid = None
+
+        if self.shape[0] * self.shape[1] <= max_full_pixels:
+            self.rgb_image = get_rgb_image(image_data, bands=bands, stretch=stretch)
+        else:
+            self.pyramid = get_overview_pyramid(image_data, bands, stretch=stretch)
+
+    def show(self, ax):
+        """
+        Draw the FCC on an axis (after ax.clear(), call again).
+
+        Parameters:
+        ax (Axes): Axis to draw on
+
+        Returns:
+        AxesImage: The image artist
+        """
+        if self.pyramid is None:
+            return ax.imshow(self.rgb_image)
+        return PyramidImageView(ax, self.pyramid).image
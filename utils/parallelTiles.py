@@ -0,0 +1,291 @@
+import os
+import mmap
+import atexit
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+# Environment variable overriding the default number of worker processes
+WORKERS_ENV = "SPECTRAVIS_WORKERS"
+
+# BLAS/OpenMP thread pools are pinned to one thread in workers so that
+# N processes do not oversubscribe the cores
+_BLAS_THREAD_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def default_workers():
+    """
+    Number of worker processes used when none is given explicitly.
+
+    Returns:
+    int: Value of SPECTRAVIS_WORKERS if set, otherwise the CPU count
+    """
+    value = os.environ.get(WORKERS_ENV)
+    if value:
+        return max(1, int(value))
+    return os.cpu_count() or 1
+
+
+def tile_ranges(n_rows, tile_rows):
+    """
+    Split the row axis into consecutive (start, stop) tiles.
+
+    Parameters:
+    n_rows (int): Number of cube rows
+    tile_rows (int): Rows per tile
+
+    Returns:
+    list: (start, stop) tuples covering every row
+    """
+    tile_rows = max(1, int(tile_rows))
+    return [(start, min(start + tile_rows, n_rows)) for start in range(0, n_rows, tile_rows)]
+
+
+def _memmap_handle(image_data):
+    """
+    Describe a memory-mapped array (or any view of one) by file position and
+    strides so another process can map the same bytes without a copy.
+    Returns None if the array is not backed by a file mapping.
+    """
+    if not isinstance(image_data, np.memmap) or image_data.filename is None:
+        return None
+    if any(stride < 0 for stride in image_data.strides):
+        return None
+
+    # Follow the views back to the memmap that owns the file mapping; its
+    # first element sits at its offset in the file
+    root = image_data
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if not isinstance(root, np.memmap) or not isinstance(root.base, mmap.mmap):
+        return None
+
+    if image_data.mode in ('r+', 'w+'):
+        image_data.flush()
+
+    data_address = image_data.__array_interface__['data'][0]
+    root_address = root.__array_interface__['data'][0]
+
+    return {
+        'kind': 'memmap',
+        'filename': image_data.filename,
+        'offset': root.offset + data_address - root_address,
+        'shape': image_data.shape,
+        'strides': image_data.strides,
+        'dtype': image_data.dtype.str,
+    }
+
+
+class SharedCube:
+    """
+    Hand a hyperspectral cube to worker processes without pickling it.
+
+    Memory-mapped cubes are shared through their backing file; in-memory
+    cubes are copied once into a shared memory block that workers attach to.
+    Use as a context manager so the shared block is released afterwards.
+    """
+
+    def __init__(self, image_data):
+        self.image_data = image_data
+        self._shm = None
+        self.handle = _memmap_handle(image_data)
+
+        if self.handle is None:
+            array = np.ascontiguousarray(image_data)
+            self._shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=self._shm.buf)[...] = array
+            self.handle = {
+                'kind': 'shm',
+                'name': self._shm.name,
+                'shape': array.shape,
+                'dtype': array.dtype.str,
+            }
+
+    @property
+    def shape(self):
+        return self.image_data.shape
+
+    def close(self):
+        """Release the shared memory block, if one was created."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Per-process attachment cache: (handle key, backing object, array)
+_attached = None
+
+
+def _handle_key(handle):
+    return tuple(sorted((k, v) for k, v in handle.items()))
+
+
+def attach_cube(handle):
+    """
+    Attach to a cube shared by SharedCube from inside a worker process.
+
+    Parameters:
+    handle (dict): SharedCube.handle of the parent process
+
+    Returns:
+    ndarray: Read-only view of the shared cube
+    """
+    global _attached
+    key = _handle_key(handle)
+    if _attached is not None and _attached[0] == key:
+        return _attached[2]
+
+    if _attached is not None and isinstance(_attached[1], shared_memory.SharedMemory):
+        _attached[1].close()
+
+    dtype = np.dtype(handle['dtype'])
+    if handle['kind'] == 'memmap':
+        backing = np.memmap(handle['filename'], dtype=np.uint8, mode='r')
+        array = np.ndarray(handle['shape'], dtype=dtype, buffer=backing,
+                           offset=handle['offset'], strides=handle['strides'])
+    else:
+        backing = shared_memory.SharedMemory(name=handle['name'])
+        array = np.ndarray(handle['shape'], dtype=dtype, buffer=backing.buf)
+        array.flags.writeable = False
+
+    _attached = (key, backing, array)
+    return array
+
+
+def _run_tile(handle, func, start, stop, args, transform=None):
+    tile = attach_cube(handle)[start:stop]
+    if transform is not None:
+        tile = transform[0](tile, *transform[1])
+    return func(tile, *args)
+
+
+@contextlib.contextmanager
+def _single_threaded_blas():
+    """Spawned workers inherit the environment present while they start."""
+    saved = {name: os.environ.get(name) for name in _BLAS_THREAD_VARS}
+    for name in _BLAS_THREAD_VARS:
+        os.environ.setdefault(name, "1")
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+_pool = None
+_pool_workers = 0
+
+
+def get_pool(n_workers):
+    """
+    Return the shared process pool, (re)creating it for the worker count.
+
+    Workers are started with the 'spawn' method, which is safe to use from
+    the Qt GUI thread.
+
+    Parameters:
+    n_workers (int): Number of worker processes
+
+    Returns:
+    ProcessPoolExecutor: Process pool with n_workers workers
+    """
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != n_workers:
+        shutdown_pool()
+        _pool = ProcessPoolExecutor(max_workers=n_workers,
+                                    mp_context=multiprocessing.get_context('spawn'))
+        _pool_workers = n_workers
+    return _pool
+
+
+def shutdown_pool():
+    """Stop the shared process pool, if it is running."""
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+        _pool_workers = 0
+
+atexit.register(shutdown_pool)
+
+
+def iter_tiled(func, image_data, args=(), n_workers=None, tile_rows=None):
+    """
+    Apply a function to row tiles of a cube, in parallel across processes.
+
+    func is called as func(tile, *args) with tile = image_data[start:stop]
+    and must be a module-level function so it can be sent to the workers.
+    With one worker the tiles are processed in the calling process.
+
+    Lazily computed cubes (e.g. ContinuumRemovedCube) are sliced like any
+    cube in the calling process; for workers they provide tile_source(),
+    which returns the cube to share and an optional (function, args)
+    transform the workers apply to every tile before func.
+
+    Parameters:
+    func (callable): Function applied to each tile
+    image_data (ndarray or SharedCube): Hyperspectral image data cube (rows, cols, bands)
+    args (tuple): Extra arguments passed to func after the tile
+    n_workers (int): Number of worker processes; default_workers() if None
+    tile_rows (int): Rows per tile; split evenly over the workers if None
+
+    Yields:
+    tuple: ((start, stop), result) for each tile, in row order
+    """
+    if n_workers is None:
+        n_workers = default_workers()
+    n_workers = max(1, int(n_workers))
+
+    n_rows = image_data.shape[0]
+    if tile_rows is None:
+        # A few tiles per worker keeps the pool busy when tiles finish unevenly
+        tile_rows = -(-n_rows // (n_workers * 4))
+    tiles = tile_ranges(n_rows, tile_rows)
+
+    if n_workers == 1 or len(tiles) == 1:
+        cube = image_data.image_data if isinstance(image_data, SharedCube) else image_data
+        for start, stop in tiles:
+            yield (start, stop), func(cube[start:stop], *args)
+        return
+
+    transform = None
+    if hasattr(image_data, 'tile_source'):
+        image_data, transform = image_data.tile_source(n_workers)
+
+    if isinstance(image_data, SharedCube):
+        shared, owned = image_data, False
+    else:
+        shared, owned = SharedCube(image_data), True
+
+    futures = []
+    try:
+        with _single_threaded_blas():
+            pool = get_pool(n_workers)
+            futures = [pool.submit(_run_tile, shared.handle, func, start, stop, args, transform)
+                       for start, stop in tiles]
+        for i, tile in enumerate(tiles):
+            result = futures[i].result()
+            futures[i] = None
+            yield tile, result
+    finally:
+        for future in futures:
+            if future is not None:
+                future.cancel()
+        if owned:
+            # Wait for tiles still running before releasing their shared memory
+            for future in futures:
+                if future is not None and not future.cancelled():
+                    future.exception()
+            shared.close()
@@ -0,0 +1,512 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+import numpy as np
+from utils.FCC import DEFAULT_PERCENTILES, FCCRenderCache, get_rgb_image
+from utils.parallelTiles import iter_tiled
+from utils.instrumentation import timed
+
+# Principal components of the data (PCA), or of the data after whitening
+# its noise so components are ordered by signal-to-noise ratio (MNF)
+TRANSFORM_METHODS = ('pca', 'mnf')
+
+# A transform fitted to a memory-mapped cube is saved next to its file as
+# <cube file>.<method>.npz
+TRANSFORM_SUFFIX = '.{method}.npz'
+
+# Upper bound on the number of cube values reduced per tile while fitting
+FIT_TILE_ELEMENTS = 2 ** 22
+
+# Upper bound on the number of cube values projected at once
+PROJECTION_TILE_ELEMENTS = 2 ** 22
+
+# The cube fingerprint hashes the spectra of about this many pixels
+FINGERPRINT_PIXELS = 4096
+
+# Fitted transforms and component cubes kept at once
+TRANSFORM_CACHE_ENTRIES = 8
+
+# Noise eigenvalues are floored at this fraction of the largest one, so
+# noise-free bands (e.g. constant bad bands) do not blow up the whitening
+_NOISE_FLOOR = 1e-10
+
+
+def cube_fingerprint(image_data, band_indices=None):
+    """
+    Hash identifying a cube, computed from its shape, type and the spectra
+    of a regular grid of pixels, so it costs a few thousand pixel reads.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    band_indices (ndarray): Bands a transform uses (all if None)
+
+    Returns:
+    str: Hex digest
+    """
+    rows, cols = image_data.shape[:2]
+    side = int(np.sqrt(FINGERPRINT_PIXELS))
+    sample = np.ascontiguousarray(image_data[::-(-rows // side), ::-(-cols // side)])
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((tuple(image_data.shape), np.dtype(image_data.dtype).str)).encode())
+    digest.update(sample.tobytes())
+    if band_indices is not None:
+        digest.update(np.asarray(band_indices, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def _tile_moments(tile, band_indices, noise):
+    """
+    Pixel count, mean and scatter matrix (sum of outer products of the
+    centered spectra) of one tile, and for MNF the count and scatter of the
+    differences between horizontally adjacent pixels.
+    """
+    values = tile if band_indices is None else tile[..., band_indices]
+    has_nan = values.dtype.kind == 'f'
+    values = values.astype(np.float64)
+    pixels = values.reshape(-1, values.shape[2])
+    if has_nan and not np.isfinite(pixels).all():
+        pixels = pixels[np.isfinite(pixels).all(axis=1)]
+
+    n = len(pixels)
+    mean = pixels.mean(axis=0) if n else np.zeros(pixels.shape[1])
+    pixels = pixels - mean
+    scatter = pixels.T @ pixels
+
+    if not noise:
+        return n, mean, scatter, 0, None
+    # Neighbouring pixels share their signal, so their difference is
+    # (twice the variance of) the noise
+    differences = (values[:, 1:] - values[:, :-1]).reshape(-1, values.shape[2])
+    if has_nan:
+        differences = differences[np.isfinite(differences).all(axis=1)]
+    return n, mean, scatter, len(differences), differences.T @ differences
+
+
+def _project(pixels, band_indices, mean, components):
+    """Component scores of (..., bands) cube spectra as float32."""
+    if band_indices is not None:
+        pixels = np.asarray(pixels)[..., band_indices]
+    centered = np.subtract(pixels, mean, dtype=np.float32)
+    return centered @ components
+
+
+class SpectralTransform:
+    """
+    PCA or MNF rotation of the spectra of a cube.
+
+    Attributes:
+    method (str): One of TRANSFORM_METHODS
+    band_indices (ndarray): Cube bands the transform uses (all if None)
+    mean (ndarray): (bands,) mean spectrum over those bands
+    components (ndarray): (bands, n) loadings, one column per component,
+        strongest first
+    eigenvalues (ndarray): (n,) variance of each PCA component, or for MNF
+        its variance relative to the noise (signal-to-noise ratio + 1)
+    n_pixels (int): Number of pixels the transform was fitted on
+    fingerprint (str): cube_fingerprint of the fitted cube
+    """
+
+    def __init__(self, method, band_indices, mean, components, eigenvalues, n_pixels, fingerprint):
+        self.method = method
+        self.band_indices = band_indices
+        self.mean = mean
+        self.components = components
+        self.eigenvalues = eigenvalues
+        self.n_pixels = n_pixels
+        self.fingerprint = fingerprint
+        self._mean32 = mean.astype(np.float32)
+        self._components32 = components.astype(np.float32)
+
+    @property
+    def n_components(self):
+        return self.components.shape[1]
+
+    @property
+    def explained_variance_ratio(self):
+        """Fraction of the total variance (PCA) or SNR (MNF) in each component."""
+        total = self.eigenvalues.sum()
+        return self.eigenvalues / total if total > 0 else np.zeros_like(self.eigenvalues)
+
+    def projection(self, n_components=None):
+        """
+        What _project needs to compute the first n component scores.
+
+        Returns:
+        tuple: (band_indices, float32 mean, float32 (bands, n) components)
+        """
+        components = self._components32
+        if n_components is not None:
+            components = np.ascontiguousarray(components[:, :n_components])
+        return self.band_indices, self._mean32, components
+
+    def project(self, pixels, n_components=None):
+        """
+        Component scores of cube spectra.
+
+        Parameters:
+        pixels (ndarray): (..., bands) spectra with all cube bands
+        n_components (int): Number of leading components (all if None)
+
+        Returns:
+        ndarray: (..., n_components) float32 scores
+        """
+        return _project(pixels, *self.projection(n_components))
+
+    def save(self, transform_path):
+        """
+        Write the transform to an .npz file, replacing it atomically.
+
+        Parameters:
+        transform_path (str): Output path
+        """
+        band_indices = np.array([], dtype=np.intp) if self.band_indices is None else self.band_indices
+        # A unique temp file, since a cancelled fit may still be saving the same transform
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(transform_path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, method=np.array(self.method), band_indices=band_indices,
+                         all_bands=np.array(self.band_indices is None), mean=self.mean,
+                         components=self.components, eigenvalues=self.eigenvalues,
+                         n_pixels=np.array(self.n_pixels), fingerprint=np.array(self.fingerprint))
+            os.replace(temp_path, transform_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, transform_path):
+        """
+        Read a transform written by save().
+
+        Parameters:
+        transform_path (str): Path of the .npz file
+
+        Returns:
+        SpectralTransform: The transform, or None if it cannot be read
+        """
+        try:
+            with np.load(transform_path) as data:
+                band_indices = None if bool(data['all_bands']) else data['band_indices']
+                return cls(str(data['method']), band_indices, data['mean'], data['components'],
+                           data['eigenvalues'], int(data['n_pixels']), str(data['fingerprint']))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            # A truncated or corrupt file is refitted like an outdated one
+            return None
+
+
+def _select_bands(image_data, band_mask):
+    """Indices of the usable bands, or None if every band is used."""
+    if band_mask is None:
+        return None
+    band_mask = np.asarray(band_mask, dtype=bool)[:image_data.shape[2]]
+    if band_mask.all():
+        return None
+    return np.flatnonzero(band_mask)
+
+
+@timed('transform.fit')
+def fit_transform(image_data, method='pca', band_mask=None, n_workers=1, tile_rows=None, progress=None):
+    """
+    Fit a PCA or MNF transform to a cube in a single pass.
+
+    Tiles of rows are reduced to their mean and scatter matrix (and, for
+    MNF, the scatter of neighbouring pixel differences as the noise
+    estimate), in parallel when n_workers > 1, and merged with the pairwise
+    update, so a memory-mapped cube is read once and never held whole. The
+    eigendecomposition is done once on the merged covariance.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    method (str): One of TRANSFORM_METHODS
+    band_mask (ndarray): True for bands to use (e.g. SpectralMetadata.band_mask)
+    n_workers (int): Number of worker processes
+    tile_rows (int): Rows per tile; bounded by FIT_TILE_ELEMENTS if None
+    progress (callable): Called as progress(rows_done, rows) after every tile
+
+    Returns:
+    SpectralTransform: The fitted transform
+    """
+    if method not in TRANSFORM_METHODS:
+        raise ValueError(f"Unknown transform: {method}")
+    rows, cols, _ = image_data.shape
+    band_indices = _select_bands(image_data, band_mask)
+    bands = image_data.shape[2] if band_indices is None else len(band_indices)
+    if tile_rows is None:
+        tile_rows = max(1, FIT_TILE_ELEMENTS // max(1, cols * image_data.shape[2]))
+    noise = method == 'mnf'
+
+    count = 0
+    mean = np.zeros(bands)
+    scatter = np.zeros((bands, bands))
+    noise_count = 0
+    noise_scatter = np.zeros((bands, bands))
+
+    for (_, stop), (n, tile_mean, tile_scatter, tile_noise_count, tile_noise_scatter) in iter_tiled(
+            _tile_moments, image_data, args=(band_indices, noise), n_workers=n_workers, tile_rows=tile_rows):
+        if n:
+            total = count + n
+            delta = tile_mean - mean
+            mean = mean + delta * (n / total)
+            scatter += tile_scatter + np.outer(delta, delta) * (count * n / total)
+            count = total
+        if noise:
+            noise_count += tile_noise_count
+            noise_scatter += tile_noise_scatter
+        if progress is not None:
+            progress(stop, rows)
+
+    if count < 2:
+        raise ValueError("Not enough valid pixels to fit a transform")
+    covariance = scatter / (count - 1)
+
+    if noise:
+        if noise_count == 0:
+            raise ValueError("MNF needs at least two columns of valid pixels to estimate the noise")
+        noise_values, noise_vectors = np.linalg.eigh(noise_scatter / (2 * noise_count))
+        floor = max(noise_values.max(), 0.0) * _NOISE_FLOOR or 1.0
+        # Whiten the noise, then take the principal components of the result
+        whitening = noise_vectors / np.sqrt(np.maximum(noise_values, floor))
+        eigenvalues, vectors = np.linalg.eigh(whitening.T @ covariance @ whitening)
+        components = whitening @ vectors
+    else:
+        eigenvalues, components = np.linalg.eigh(covariance)
+
+    order = np.argsort(eigenvalues)[::-1]
+    eigenvalues, components = eigenvalues[order], components[:, order]
+    # Fix the sign of each component so refits give the same composite
+    largest = np.abs(components).argmax(axis=0)
+    components *= np.where(components[largest, np.arange(bands)] < 0, -1.0, 1.0)
+
+    return SpectralTransform(method, band_indices, mean, components, np.maximum(eigenvalues, 0.0), count,
+                             cube_fingerprint(image_data, band_indices))
+
+
+def transform_path(image_data, method):
+    """
+    Where the transform of a memory-mapped cube is saved.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    method (str): One of TRANSFORM_METHODS
+
+    Returns:
+    str: Path next to the cube file, or None for in-memory cubes
+    """
+    filename = getattr(image_data, 'filename', None)
+    if not isinstance(image_data, np.memmap) or not filename:
+        return None
+    return str(filename) + TRANSFORM_SUFFIX.format(method=method)
+
+
+def load_or_fit_transform(image_data, method='pca', band_mask=None, path=None, n_workers=1, progress=None):
+    """
+    Read the saved transform of a cube, fitting and saving it if it is
+    missing or was fitted to different data.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    method (str): One of TRANSFORM_METHODS
+    band_mask (ndarray): True for bands to use
+    path (str): Transform file; transform_path() if None (no file for
+        in-memory cubes)
+    n_workers (int): Number of worker processes for the fit
+    progress (callable): Called as progress(rows_done, rows) while fitting
+
+    Returns:
+    SpectralTransform: The transform
+    """
+    if path is None:
+        path = transform_path(image_data, method)
+    band_indices = _select_bands(image_data, band_mask)
+
+    if path is not None and os.path.exists(path):
+        transform = SpectralTransform.load(path)
+        if (transform is not None and transform.method == method
+                and transform.fingerprint == cube_fingerprint(image_data, band_indices)):
+            return transform
+
+    transform = fit_transform(image_data, method, band_mask, n_workers=n_workers, progress=progress)
+    if path is not None:
+        try:
+            transform.save(path)
+        except OSError:
+            # A read-only cube location only costs the refit next session
+            pass
+    return transform
+
+
+# Transforms and component cubes shared by every tab. Kept apart from the
+# FCC render cache, so changing a composite's bands or stretch never
+# evicts a fitted transform
+transform_cache = FCCRenderCache(max_entries=TRANSFORM_CACHE_ENTRIES)
+
+
+def get_transform(image_data, method='pca', band_mask=None, n_workers=1, progress=None):
+    """
+    Return the PCA/MNF transform of a cube from the transform cache,
+    loading or fitting it on first use (see load_or_fit_transform).
+
+    Returns:
+    SpectralTransform: The transform
+    """
+    band_indices = _select_bands(image_data, band_mask)
+    key = ('transform', method, None if band_indices is None else tuple(band_indices.tolist()))
+    return transform_cache.get_or_render(
+        image_data, key,
+        lambda: load_or_fit_transform(image_data, method, band_mask, n_workers=n_workers, progress=progress)
+    )
+
+
+class ProjectedCube:
+    """
+    Leading PCA/MNF components of a cube, projected lazily.
+
+    Indexing works like a cube of n_components bands (image_data[row, col],
+    image_data[start:stop, c0:c1], image_data[::step, ::step, band]); only
+    the indexed pixels are read and projected, a bounded tile of rows at a
+    time, so FCC rendering and overview pyramids work on it unchanged.
+    Parallel scene passes (utils.parallelTiles) project the source tiles
+    in the workers through tile_source().
+
+    Attributes:
+    source (ndarray): The original cube
+    transform (SpectralTransform): Transform applied to every pixel
+    shape (tuple): (rows, cols, n_components)
+    dtype (dtype): float32
+    """
+
+    def __init__(self, image_data, transform, n_components=None):
+        self.source = image_data
+        self.transform = transform
+        if n_components is None:
+            n_components = transform.n_components
+        n_components = int(min(n_components, transform.n_components))
+        self.shape = image_data.shape[:2] + (n_components,)
+        self.dtype = np.dtype(np.float32)
+        self._projection = transform.projection(n_components)
+        self.tile_rows = max(1, PROJECTION_TILE_ELEMENTS // max(1, image_data.shape[1] * image_data.shape[2]))
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        spatial, band_key = key[:2], key[2] if len(key) > 2 else slice(None)
+        band_indices, mean, components = self._projection
+        # Only the indexed components are computed
+        components = components[:, band_key]
+
+        rows = spatial[0]
+        if not (isinstance(rows, slice) and (rows.step or 1) > 0):
+            return _project(self.source[spatial], band_indices, mean, components)
+
+        start, stop, step = rows.indices(self.shape[0])
+        selected = range(start, max(start, stop), step)
+        rest = spatial[1:]
+        # Tiles start on a selected row so the step is kept across them
+        tile_rows = -(-self.tile_rows // step) * step
+        tiles = [_project(self.source[(slice(tile_start, min(tile_start + tile_rows, selected.stop), step),) + rest],
+                         band_indices, mean, components)
+                 for tile_start in range(selected.start, selected.stop, tile_rows)]
+        if len(tiles) == 1:
+            return tiles[0]
+        if not tiles:
+            return _project(self.source[spatial], band_indices, mean, components)
+        return np.concatenate(tiles)
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.materialize()
+        return values if dtype is None else values.astype(dtype)
+
+    @timed('transform.project')
+    def materialize(self, path=None, n_workers=1, progress=None):
+        """
+        Project the whole cube.
+
+        Parameters:
+        path (str): .npy file to write the reduced cube to (in memory if None)
+        n_workers (int): Number of worker processes
+        progress (callable): Called as progress(rows_done, rows) after every tile
+
+        Returns:
+        ndarray: (rows, cols, n_components) float32 cube, memory-mapped
+            when written to a file
+        """
+        if path is None:
+            values = np.empty(self.shape, dtype=np.float32)
+        else:
+            values = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=self.shape)
+        for (start, stop), tile in iter_tiled(_project, self.source, args=self._projection,
+                                              n_workers=n_workers, tile_rows=self.tile_rows):
+            values[start:stop] = tile
+            if progress is not None:
+                progress(stop, self.shape[0])
+        if path is not None:
+            values.flush()
+        return values
+
+    def tile_source(self, n_workers):
+        """
+        What parallel tile passes should share with their workers.
+
+        Returns:
+        tuple: (source cube, (function, args) the workers apply to every tile)
+        """
+        return self.source, (_project, self._projection)
+
+
+def get_component_cube(image_data, method='pca', n_components=3, band_mask=None):
+    """
+    Return the lazily projected leading components of a cube from the
+    transform cache, so every FCC of them shares one object.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    method (str): One of TRANSFORM_METHODS
+    n_components (int): Number of leading components
+    band_mask (ndarray): True for bands to use
+
+    Returns:
+    ProjectedCube: The component cube
+    """
+    band_indices = _select_bands(image_data, band_mask)
+    key = ('components', method, int(n_components),
+           None if band_indices is None else tuple(band_indices.tolist()))
+    return transform_cache.get_or_render(
+        image_data, key,
+        lambda: ProjectedCube(image_data, get_transform(image_data, method, band_mask), n_components)
+    )
+
+
+def get_component_image(image_data, method='pca', components=(0, 1, 2), band_mask=None,
+                        stretch='percentile', percentiles=DEFAULT_PERCENTILES):
+    """
+    False colour composite of three PCA/MNF components, from the shared
+    render cache.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    method (str): One of TRANSFORM_METHODS
+    components (tuple): Zero-based (red, green, blue) component indices
+    band_mask (ndarray): True for bands to use
+    stretch (str): One of STRETCH_MODES; component scores have long tails,
+        so a percentile stretch is the default
+    percentiles (tuple): 'percentile' only - lower and upper percentile
+
+    Returns:
+    ndarray: Read-only RGB image
+    """
+    components = tuple(int(c) for c in components)
+    component_cube = get_component_cube(image_data, method, max(components) + 1, band_mask)
+    return get_rgb_image(component_cube, bands=components, stretch=stretch, percentiles=percentiles)
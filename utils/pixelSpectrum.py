@@ -1,3 +1,22 @@
+from utils.spectralMetadata import SpectralMetadata
+
+
+def get_wavelengths(metadata, spectral_dimension):
+    """
+    Look up the wavelength of every band in the cube from the metadata.
+
+    Parameters:
+    metadata (SpectralMetadata or dict): Metadata containing wavelength information
+    spectral_dimension (int): Number of bands in the cube
+
+    Returns:
+    ndarray or list: Wavelength (nm) of each band, in band order. Parsed
+        metadata returns its cached array without walking the JSON table.
+    """
+    if isinstance(metadata, SpectralMetadata):
+        return metadata.wavelengths[:spectral_dimension]
+    return [metadata["band_to_wavelength"][str(band)][1] for band in range(1, spectral_dimension+1)]
+
 
 def get_pixel_spectrum(image_data, metadata, pixel_no):
     spectral_dimension = image_data.shape[2]
@@ -6,5 +25,5 @@ def get_pixel_spectrum(image_data, metadata, pixel_no):
         f"Pixel spectral data does not match the spectral dimension: "
         f"expected {spectral_dimension}, got {len(pixel_data)}"
     )
-    wavelengths = [metadata["band_to_wavelength"][str(band)][1] for band in range(1, spectral_dimension+1)]
+    wavelengths = get_wavelengths(metadata, spectral_dimension)
     return wavelengths, pixel_data
@@ -0,0 +1,228 @@
+import itertools
+import threading
+import traceback
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+from utils.instrumentation import count, span
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task once it has been cancelled."""
+
+
+class TaskSignals(QObject):
+    """
+    Signals a task emits from its worker thread. They are delivered to the
+    TaskRunner in the GUI thread through queued connections.
+    """
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+    cancelled = pyqtSignal(int)
+    progress = pyqtSignal(int, int, int)
+
+
+class TaskContext:
+    """
+    Handle a running task uses to report progress and notice cancellation.
+
+    Long computations should call progress() (or check()) regularly; both
+    raise TaskCancelled once the task has been cancelled or superseded, so
+    the worker thread is freed as soon as possible.
+    """
+
+    def __init__(self, task_id, signals):
+        self.task_id = task_id
+        self._signals = signals
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        """Raise TaskCancelled if the task has been cancelled."""
+        if self._cancelled.is_set():
+            raise TaskCancelled()
+
+    def progress(self, done, total):
+        """
+        Report progress and stop if the task has been cancelled.
+
+        Parameters:
+        done (int): Units of work completed
+        total (int): Total units of work
+        """
+        self.check()
+        self._signals.progress.emit(self.task_id, int(done), int(total))
+
+
+class Task(QRunnable):
+    """
+    Run func(context, *args, **kwargs) on a thread pool thread, timed as
+    the span 'task.<name>'.
+    """
+
+    def __init__(self, context, signals, func, args, kwargs, name='task'):
+        super().__init__()
+        # The runner owns the task until its signals have been handled
+        self.setAutoDelete(False)
+        self.name = name
+        self.context = context
+        self.signals = signals
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        task_id = self.context.task_id
+        try:
+            self.context.check()
+            with span(f"task.{self.name}"):
+                result = self.func(self.context, *self.args, **self.kwargs)
+            self.context.check()
+        except TaskCancelled:
+            count('task.cancelled')
+            self.signals.cancelled.emit(task_id)
+        except Exception as e:
+            traceback.print_exc()
+            count('task.failed')
+            self.signals.failed.emit(task_id, str(e))
+        else:
+            self.signals.finished.emit(task_id, result)
+
+
+class TaskRunner(QObject):
+    """
+    Runs long computations off the GUI thread.
+
+    Tasks are submitted under a name; submitting a new task with the same
+    name cancels the older one, and results of superseded tasks are never
+    delivered, so only the latest click is ever plotted. Result and error
+    callbacks run in the GUI thread.
+
+    Signals:
+    message (str): Status text for a status bar ("" when idle)
+    progress (int, int): (done, total) of the latest task; (0, 0) while
+        the amount of work is unknown, (-1, -1) when nothing is running
+    """
+    message = pyqtSignal(str)
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, pool=None, parent=None):
+        super().__init__(parent)
+        self.pool = pool if pool is not None else QThreadPool.globalInstance()
+        self._ids = itertools.count(1)
+        self._tasks = {}   # task id -> (name, context, task, callbacks, description)
+        self._latest = {}  # name -> task id of the newest task
+
+    def submit(self, name, func, *args, on_result=None, on_error=None, description=None, **kwargs):
+        """
+        Start func(context, *args, **kwargs) on the thread pool.
+
+        Parameters:
+        name (str): Task slot; a running task with the same name is cancelled
+        func (callable): Computation; receives a TaskContext first
+        on_result (callable): Called with the return value in the GUI thread
+        on_error (callable): Called with the error message in the GUI thread
+        description (str): Status bar text while the task runs
+
+        Returns:
+        int: Task id
+        """
+        self.cancel(name)
+
+        task_id = next(self._ids)
+        signals = TaskSignals()
+        signals.finished.connect(self._on_finished)
+        signals.failed.connect(self._on_failed)
+        signals.cancelled.connect(self._on_cancelled)
+        signals.progress.connect(self._on_progress)
+
+        context = TaskContext(task_id, signals)
+        task = Task(context, signals, func, args, kwargs, name)
+        description = description or name
+        self._tasks[task_id] = (name, context, task, (on_result, on_error), description)
+        self._latest[name] = task_id
+
+        self.message.emit(f"{description}...")
+        self.progress.emit(0, 0)
+        self.pool.start(task)
+        return task_id
+
+    def cancel(self, name=None):
+        """
+        Cancel the task running under name, or every task if name is None.
+        """
+        names = list(self._latest) if name is None else [name]
+        for task_name in names:
+            task_id = self._latest.pop(task_name, None)
+            if task_id in self._tasks:
+                self._tasks[task_id][1].cancel()
+        self._update_status()
+
+    def is_running(self, name):
+        return name in self._latest
+
+    def wait(self, msecs=-1):
+        """Block until every started task has returned."""
+        return self.pool.waitForDone(msecs)
+
+    def _finish(self, task_id):
+        """Forget a task; returns its callbacks if it was the latest of its name."""
+        entry = self._tasks.pop(task_id, None)
+        if entry is None:
+            return None
+        name, _, _, callbacks, _ = entry
+        if self._latest.get(name) != task_id:
+            return None
+        del self._latest[name]
+        self._update_status()
+        return callbacks
+
+    def _update_status(self):
+        if self._latest:
+            task_id = max(self._latest.values())
+            self.message.emit(f"{self._tasks[task_id][4]}...")
+        else:
+            self.message.emit("")
+            self.progress.emit(-1, -1)
+
+    @pyqtSlot(int, object)
+    def _on_finished(self, task_id, result):
+        callbacks = self._finish(task_id)
+        if callbacks is not None and callbacks[0] is not None:
+            callbacks[0](result)
+
+    @pyqtSlot(int, str)
+    def _on_failed(self, task_id, error):
+        callbacks = self._finish(task_id)
+        if callbacks is not None and callbacks[1] is not None:
+            callbacks[1](error)
+
+    @pyqtSlot(int)
+    def _on_cancelled(self, task_id):
+        self._finish(task_id)
+
+    @pyqtSlot(int, int, int)
+    def _on_progress(self, task_id, done, total):
+        entry = self._tasks.get(task_id)
+        if entry is not None and self._latest.get(entry[0]) == task_id:
+            self.progress.emit(done, total)
+
+
+_task_runner = None
+
+
+def get_task_runner():
+    """
+    Return the task runner shared by every widget in the application.
+
+    Returns:
+    TaskRunner: Shared task runner
+    """
+    global _task_runner
+    if _task_runner is None:
+        _task_runner = TaskRunner()
+    return _task_runner
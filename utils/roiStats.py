@@ -0,0 +1,149 @@
+import numpy as np
+
+# Percentile spectra computed for every region
+DEFAULT_ROI_PERCENTILES = (5.0, 95.0)
+
+# Upper bound on the number of cube values read per block of bounding-box rows
+MAX_BLOCK_ELEMENTS = 2 ** 24
+
+
+def rectangle_mask(corner, opposite_corner, image_shape):
+    """
+    Bounding box and mask of a rectangle of pixels.
+
+    Parameters:
+    corner (tuple): (row, col) of one corner, in pixel coordinates
+    opposite_corner (tuple): (row, col) of the opposite corner
+    image_shape (tuple): (rows, cols) of the image
+
+    Returns:
+    tuple: ((row_start, row_stop, col_start, col_stop), mask) with mask
+        True for every pixel of the clipped rectangle
+    """
+    rows, cols = image_shape[:2]
+    (r0, c0), (r1, c1) = corner, opposite_corner
+    row_start = max(0, int(np.floor(min(r0, r1) + 0.5)))
+    row_stop = min(rows, int(np.floor(max(r0, r1) + 0.5)) + 1)
+    col_start = max(0, int(np.floor(min(c0, c1) + 0.5)))
+    col_stop = min(cols, int(np.floor(max(c0, c1) + 0.5)) + 1)
+    bbox = (row_start, max(row_start, row_stop), col_start, max(col_start, col_stop))
+    return bbox, np.ones((bbox[1] - bbox[0], bbox[3] - bbox[2]), dtype=bool)
+
+
+def polygon_mask(vertices, image_shape):
+    """
+    Bounding box and mask of the pixels whose centres lie inside a polygon
+    (even-odd rule, so lassos that cross themselves work too).
+
+    Rows are filled by scanline: the crossings of every row centre with
+    every edge are computed in one (rows, edges) array, sorted, and the
+    spans between pairs of crossings are filled through a difference array.
+
+    Parameters:
+    vertices (array-like): (n, 2) (row, col) polygon vertices in pixel coordinates
+    image_shape (tuple): (rows, cols) of the image
+
+    Returns:
+    tuple: ((row_start, row_stop, col_start, col_stop), mask) over the
+        clipped bounding box
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    rows, cols = image_shape[:2]
+    row_start = max(0, int(np.ceil(vertices[:, 0].min())))
+    row_stop = min(rows, int(np.floor(vertices[:, 0].max())) + 1)
+    col_start = max(0, int(np.ceil(vertices[:, 1].min())))
+    col_stop = min(cols, int(np.floor(vertices[:, 1].max())) + 1)
+    row_stop, col_stop = max(row_start, row_stop), max(col_start, col_stop)
+    bbox = (row_start, row_stop, col_start, col_stop)
+    height, width = row_stop - row_start, col_stop - col_start
+    if len(vertices) < 3 or height == 0 or width == 0:
+        return bbox, np.zeros((height, width), dtype=bool)
+
+    y0, x0 = vertices[:, 0], vertices[:, 1]
+    y1, x1 = np.roll(y0, -1), np.roll(x0, -1)
+    centres = np.arange(row_start, row_stop, dtype=np.float64)[:, np.newaxis]
+
+    # Half-open test so a vertex on a row centre is counted once
+    crosses = (y0 <= centres) != (y1 <= centres)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = x0 + (centres - y0) * (x1 - x0) / (y1 - y0)
+    x = np.sort(np.where(crosses, x, np.inf), axis=1)
+
+    # Pairs of crossings bound the inside spans; columns are pixel centres
+    stops = np.floor(x[:, 1::2] - col_start) + 1
+    starts = np.ceil(x[:, 0::2] - col_start)[:, :stops.shape[1]]
+    valid = np.isfinite(stops) & (stops > starts)
+    starts = np.clip(starts, 0, width).astype(np.intp)
+    stops = np.clip(stops, 0, width).astype(np.intp)
+
+    span_rows = np.broadcast_to(np.arange(height)[:, np.newaxis], valid.shape)[valid]
+    edges = np.zeros((height, width + 1), dtype=np.int32)
+    np.add.at(edges, (span_rows, starts[valid]), 1)
+    np.add.at(edges, (span_rows, stops[valid]), -1)
+    return bbox, np.cumsum(edges[:, :width], axis=1) > 0
+
+
+def read_region_pixels(image_data, bbox, mask=None, max_block_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Read the spectra of the pixels in a region.
+
+    Only the rows and columns of the bounding box are read, a block of
+    rows at a time, so a small region of a memory-mapped cube touches
+    only the pages it covers.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    bbox (tuple): (row_start, row_stop, col_start, col_stop)
+    mask (ndarray): Pixels of the box that belong to the region (all if None)
+    max_block_elements (int): Cube values read per block
+
+    Returns:
+    ndarray: (pixels, bands) spectra in row-major order
+    """
+    row_start, row_stop, col_start, col_stop = bbox
+    bands = image_data.shape[2]
+    block_rows = max(1, max_block_elements // max(1, (col_stop - col_start) * bands))
+
+    blocks = []
+    for start in range(row_start, row_stop, block_rows):
+        stop = min(start + block_rows, row_stop)
+        block = np.asarray(image_data[start:stop, col_start:col_stop, :])
+        if mask is not None:
+            block = block[mask[start - row_start:stop - row_start]]
+        blocks.append(block.reshape(-1, bands))
+    if not blocks:
+        return np.empty((0, bands), dtype=image_data.dtype)
+    return np.concatenate(blocks)
+
+
+def region_statistics(image_data, bbox, mask=None, percentiles=DEFAULT_ROI_PERCENTILES):
+    """
+    Per-band statistics of the pixels in a region, as vectorized reductions
+    over the region's spectra.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    bbox (tuple): (row_start, row_stop, col_start, col_stop)
+    mask (ndarray): Pixels of the box that belong to the region (all if None)
+    percentiles (tuple): Percentile spectra to compute
+
+    Returns:
+    dict: 'count' (pixels in the region) and (bands,) arrays 'mean', 'std',
+        'min', 'max' and 'p<percentile>' (e.g. 'p5', 'p95')
+    """
+    pixels = read_region_pixels(image_data, bbox, mask)
+    if len(pixels) == 0:
+        raise ValueError("The selected region contains no pixels")
+
+    values = pixels.astype(np.float64)
+    stats = {
+        'count': len(values),
+        'mean': values.mean(axis=0),
+        'std': values.std(axis=0),
+        'min': values.min(axis=0),
+        'max': values.max(axis=0),
+    }
+    if percentiles:
+        for p, spectrum in zip(percentiles, np.percentile(values, percentiles, axis=0)):
+            stats[f"p{p:g}"] = spectrum
+    return stats
@@ -0,0 +1,211 @@
+import numpy as np
+
+# Floor applied to values before taking logarithms in SID; spectra are
+# treated as probability distributions, which need positive values
+SID_EPSILON = 1e-12
+
+
+class SimilarityMetric:
+    """
+    A spectral similarity measure, scored in batches.
+
+    Every metric is a distance: 0 for identical spectra, lower is more
+    similar. prepare() derives whatever the metric needs from a compiled
+    library once; score() then compares a whole block of pixels against
+    every entry with a few matrix products. Entries are only compared on
+    the bands they cover.
+
+    Attributes:
+    name (str): Registry key
+    label (str): Display name
+    units (str): Units of the score, for axis labels
+    thresholds (tuple): Default (high confidence, low confidence) upper limits
+    """
+
+    def __init__(self, name, label, score, prepare=None, thresholds=(0.03, 0.1), units=''):
+        self.name = name
+        self.label = label
+        self.units = units
+        self.thresholds = thresholds
+        self._score = score
+        self._prepare = prepare
+
+    def prepare(self, library):
+        """
+        Precompute the library side of the metric.
+
+        Parameters:
+        library (CompiledLibrary): Library compiled for a cube
+
+        Returns:
+        object: Terms passed to score()
+        """
+        return library if self._prepare is None else self._prepare(library)
+
+    def score(self, values, terms):
+        """
+        Score pixels against every library entry.
+
+        Parameters:
+        values (ndarray): (pixels, library bands) float32 pixel values
+        terms (object): Result of prepare()
+
+        Returns:
+        ndarray: (pixels, entries) float32 scores
+        """
+        return self._score(values, terms).astype(np.float32, copy=False)
+
+
+METRICS = {}
+
+def register_metric(metric):
+    """
+    Add a metric to the registry, making it available by name to the
+    comparison widget, scene classification and the command line.
+
+    Parameters:
+    metric (SimilarityMetric): Metric to register
+
+    Returns:
+    SimilarityMetric: The metric
+    """
+    METRICS[metric.name] = metric
+    return metric
+
+
+def get_metric(name):
+    """
+    Look up a registered metric.
+
+    Parameters:
+    name (str): Registry key, e.g. 'sam'
+
+    Returns:
+    SimilarityMetric: The metric
+    """
+    try:
+        return METRICS[name]
+    except KeyError:
+        raise ValueError(f"Unknown similarity metric '{name}' (expected one of {', '.join(METRICS)})")
+
+
+def lowest_scores(scores, k):
+    """
+    Indices and values of the k lowest scores, lowest first (NaN last).
+
+    Parameters:
+    scores (ndarray): Score per entry
+    k (int): Number of entries to keep
+
+    Returns:
+    tuple: (indices, scores)
+    """
+    keys = np.where(np.isnan(scores), np.inf, scores)
+    k = min(k, len(keys))
+    candidates = np.argpartition(keys, k - 1)[:k] if 0 < k < len(keys) else np.arange(k)
+    ranking = candidates[np.argsort(keys[candidates], kind='stable')]
+    return ranking, scores[ranking]
+
+
+class _MaskedTerms:
+    """
+    Library spectra with the per-entry sums every masked metric needs.
+
+    Sums over "the bands an entry covers" become matrix products with the
+    (entries, bands) mask, so they stay batched for libraries whose entries
+    cover different bands. Computed in float64: distances between near
+    identical spectra are small differences of large sums.
+    """
+
+    def __init__(self, library):
+        self.mask = library.band_mask.astype(np.float64)
+        self.spectra = np.where(library.band_mask, library.spectra, 0.0).astype(np.float64)
+        self.counts = self.mask.sum(axis=1)
+        self.sums = self.spectra.sum(axis=1)
+        self.squares = np.square(self.spectra).sum(axis=1)
+
+    def pixel_sums(self, values):
+        """Sum of each pixel over each entry's bands: (pixels, entries)."""
+        return values @ self.mask.T
+
+
+def _score_sam(values, library):
+    dots = values @ library.matrix.T
+
+    if library.uniform_bands:
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+    else:
+        norms = np.sqrt(np.square(values) @ library.band_mask.T.astype(np.float32))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cosines = dots / norms
+    return np.arccos(np.clip(cosines, -1.0, 1.0))
+
+
+def _score_euclidean(values, terms):
+    values = values.astype(np.float64)
+    pixel_squares = np.square(values) @ terms.mask.T
+    distances = pixel_squares - 2 * (values @ terms.spectra.T) + terms.squares
+    # Relative to the pixel so one threshold fits any radiometric scale
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(np.maximum(distances, 0.0) / pixel_squares)
+
+
+def _score_scm(values, terms):
+    values = values.astype(np.float64)
+    sx = terms.pixel_sums(values)
+    sxx = np.square(values) @ terms.mask.T
+    sxy = values @ terms.spectra.T
+
+    covariance = sxy - sx * terms.sums / terms.counts
+    pixel_variance = sxx - np.square(sx) / terms.counts
+    entry_variance = terms.squares - np.square(terms.sums) / terms.counts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = covariance / np.sqrt(pixel_variance * entry_variance)
+    # Pearson correlation as an angle, comparable to SAM but blind to offsets
+    return np.arccos(np.clip(correlation, -1.0, 1.0))
+
+
+def _prepare_sid(library):
+    terms = _MaskedTerms(library)
+    spectra = np.maximum(terms.spectra, SID_EPSILON) * terms.mask
+    # Each entry as a distribution over its own bands
+    terms.distributions = spectra / spectra.sum(axis=1, keepdims=True)
+    terms.log_distributions = np.log(np.maximum(terms.distributions, SID_EPSILON)) * terms.mask
+    terms.entropies = (terms.distributions * terms.log_distributions).sum(axis=1)
+    return terms
+
+
+def _score_sid(values, terms):
+    values = np.maximum(values.astype(np.float64), SID_EPSILON)
+    log_values = np.log(values)
+    sx = terms.pixel_sums(values)
+    log_sx = np.log(sx)
+
+    # With p = x / sx over an entry's bands and q the entry distribution,
+    # SID = sum(p log p) + sum(q log q) - sum(p log q) - sum(q log p)
+    p_log_p = ((values * log_values) @ terms.mask.T) / sx - log_sx
+    p_log_q = (values @ terms.log_distributions.T) / sx
+    q_log_p = log_values @ terms.distributions.T - log_sx
+    return np.maximum(p_log_p + terms.entropies - p_log_q - q_log_p, 0.0)
+
+
+def _prepare_sid_sam(library):
+    return library, _prepare_sid(library)
+
+
+def _score_sid_sam(values, terms):
+    library, sid_terms = terms
+    return _score_sid(values, sid_terms) * np.tan(_score_sam(values, library))
+
+
+register_metric(SimilarityMetric(
+    'sam', "Spectral Angle (SAM)", _score_sam, thresholds=(0.03, 0.1), units="radians"))
+register_metric(SimilarityMetric(
+    'sid', "Spectral Information Divergence (SID)", _score_sid, _prepare_sid, thresholds=(0.002, 0.02)))
+register_metric(SimilarityMetric(
+    'scm', "Spectral Correlation (SCM)", _score_scm, _MaskedTerms, thresholds=(0.05, 0.15), units="radians"))
+register_metric(SimilarityMetric(
+    'euclidean', "Relative Euclidean Distance", _score_euclidean, _MaskedTerms, thresholds=(0.03, 0.1)))
+register_metric(SimilarityMetric(
+    'sid_sam', "SID x tan(SAM)", _score_sid_sam, _prepare_sid_sam, thresholds=(6e-5, 2e-3)))
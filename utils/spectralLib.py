@@ -1,60 +1,640 @@
 import json
 import os
+import threading
+import warnings
 import numpy as np
+from utils.instrumentation import timed
 
 
-def load_library(library_path):
+# Binary library layout:
+#   magic (8 bytes) | header length (uint64 LE) | JSON header |
+#   wavelengths (float64, n_bands) | spectra (n_entries, n_bands)
+# Both arrays start on a 64-byte boundary so the file can be memory-mapped.
+BINARY_LIBRARY_MAGIC = b'SVLIB\x00\x01\x00'
+BINARY_LIBRARY_EXTENSION = '.slib'
+_ALIGNMENT = 64
+
+
+class LibraryTable:
     """
-    Load existing spectral library from the given path or create a new one.
-    
+    Columnar view of a spectral library.
+
+    Attributes:
+    wavelengths (ndarray): Shared wavelength vector (n_bands,) in nm
+    spectra (ndarray): (n_entries, n_bands) float matrix, NaN where an entry
+        has no value for a wavelength
+    labels (list): Library key of each entry
+    entries (list): Per-entry metadata (every entry field except 'spectrum')
+    integer_values (bool): True if all spectrum values were integers
+    """
+
+    def __init__(self, wavelengths, spectra, labels, entries, integer_values=True):
+        self.wavelengths = wavelengths
+        self.spectra = spectra
+        self.labels = labels
+        self.entries = entries
+        self.integer_values = integer_values
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def _wavelength_key(wavelength):
+    """JSON spectrum key for a wavelength (integers are written without a fraction)."""
+    return str(int(wavelength)) if float(wavelength).is_integer() else repr(float(wavelength))
+
+
+def library_table_from_dict(library):
+    """
+    Convert a library in the JSON schema into a LibraryTable.
+
+    Parameters:
+    library (dict): Spectral library as loaded from JSON
+
+    Returns:
+    LibraryTable: Columnar library over the union of all entry wavelengths
+    """
+    spectra_dicts = [{float(k): v for k, v in entry['spectrum'].items()}
+                     for entry in library.values()]
+    wavelengths = np.array(sorted(set().union(*spectra_dicts)), dtype=np.float64)
+    column = {w: i for i, w in enumerate(wavelengths)}
+
+    values = [v for spectrum in spectra_dicts for v in spectrum.values()]
+    integer_values = all(isinstance(v, int) for v in values)
+
+    # float32 unless that would lose precision (e.g. float-valued spectra)
+    dtype = np.float32
+    if values and not np.array_equal(np.array(values, dtype=np.float32), np.array(values, dtype=np.float64)):
+        dtype = np.float64
+
+    spectra = np.full((len(library), len(wavelengths)), np.nan, dtype=dtype)
+    for i, spectrum in enumerate(spectra_dicts):
+        spectra[i, [column[w] for w in spectrum]] = list(spectrum.values())
+
+    entries = [{k: v for k, v in entry.items() if k != 'spectrum'} for entry in library.values()]
+    return LibraryTable(wavelengths, spectra, list(library.keys()), entries, integer_values)
+
+
+def library_table_to_dict(table):
+    """
+    Convert a LibraryTable back into the JSON library schema.
+
+    Parameters:
+    table (LibraryTable): Columnar library
+
+    Returns:
+    dict: Spectral library in the JSON schema
+    """
+    keys = [_wavelength_key(w) for w in table.wavelengths]
+    cast = int if table.integer_values else float
+
+    library = {}
+    for label, info, row in zip(table.labels, table.entries, np.asarray(table.spectra)):
+        valid = np.flatnonzero(~np.isnan(row))
+        entry = dict(info)
+        entry['spectrum'] = {keys[i]: cast(row[i]) for i in valid}
+        library[label] = entry
+    return library
+
+
+def is_binary_library(library_path):
+    """
+    Check whether a file is a binary spectral library.
+
+    Parameters:
+    library_path (str): Path to the spectral library
+
+    Returns:
+    bool: True if the file starts with the binary library magic bytes
+    """
+    if not os.path.exists(library_path):
+        return library_path.lower().endswith(BINARY_LIBRARY_EXTENSION)
+    with open(library_path, 'rb') as f:
+        return f.read(len(BINARY_LIBRARY_MAGIC)) == BINARY_LIBRARY_MAGIC
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def write_binary_library(library_path, table):
+    """
+    Write a LibraryTable in the binary library format.
+
+    Parameters:
+    library_path (str): Output path (conventionally *.slib)
+    table (LibraryTable): Library to write
+    """
+    spectra = np.ascontiguousarray(table.spectra)
+    dtype = np.dtype(spectra.dtype).newbyteorder('<')
+    header = {
+        'version': 1,
+        'n_entries': len(table),
+        'n_bands': len(table.wavelengths),
+        'dtype': dtype.str,
+        'integer_values': bool(table.integer_values),
+        'labels': list(table.labels),
+        'entries': list(table.entries),
+    }
+
+    # Offsets depend on the header length, which depends on the offsets
+    prefix = len(BINARY_LIBRARY_MAGIC) + 8
+    header['wavelengths_offset'] = header['data_offset'] = 0
+    while True:
+        header_bytes = json.dumps(header).encode('utf-8')
+        wavelengths_offset = _align(prefix + len(header_bytes))
+        data_offset = _align(wavelengths_offset + 8 * len(table.wavelengths))
+        if (header['wavelengths_offset'], header['data_offset']) == (wavelengths_offset, data_offset):
+            break
+        header['wavelengths_offset'], header['data_offset'] = wavelengths_offset, data_offset
+
+    with open(library_path, 'wb') as f:
+        f.write(BINARY_LIBRARY_MAGIC)
+        f.write(np.uint64(len(header_bytes)).astype('<u8').tobytes())
+        f.write(header_bytes)
+        f.write(b'\0' * (wavelengths_offset - f.tell()))
+        f.write(np.asarray(table.wavelengths, dtype='<f8').tobytes())
+        f.write(b'\0' * (data_offset - f.tell()))
+        f.write(spectra.astype(dtype, copy=False).tobytes())
+
+
+def read_binary_library(library_path, mmap=True):
+    """
+    Read a binary spectral library.
+
     Parameters:
-    library_path (str): Path to the spectral library JSON file
-    
+    library_path (str): Path to the binary library
+    mmap (bool): Memory-map the spectra matrix instead of reading it
+
     Returns:
-    dict: Loaded spectral library
+    LibraryTable: Library with a (possibly memory-mapped) spectra matrix
     """
+    with open(library_path, 'rb') as f:
+        if f.read(len(BINARY_LIBRARY_MAGIC)) != BINARY_LIBRARY_MAGIC:
+            raise ValueError(f"{library_path} is not a binary spectral library")
+        header_length = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(header_length).decode('utf-8'))
+
+    n_entries, n_bands = header['n_entries'], header['n_bands']
+    wavelengths = np.fromfile(library_path, dtype='<f8', count=n_bands,
+                              offset=header['wavelengths_offset'])
+    if mmap and n_entries and n_bands:
+        spectra = np.memmap(library_path, dtype=header['dtype'], mode='r',
+                            offset=header['data_offset'], shape=(n_entries, n_bands))
+    else:
+        spectra = np.fromfile(library_path, dtype=header['dtype'], count=n_entries * n_bands,
+                              offset=header['data_offset']).reshape(n_entries, n_bands)
+
+    return LibraryTable(wavelengths, spectra, header['labels'], header['entries'],
+                        header['integer_values'])
+
+
+def _read_base_table(library_path, mmap=True):
+    """Read the compacted library file, without the journal."""
+    if is_binary_library(library_path):
+        if os.path.exists(library_path):
+            return read_binary_library(library_path, mmap)
+        return library_table_from_dict({})
+    return library_table_from_dict(_load_base_library(library_path))
+
+
+def _load_base_library(library_path):
+    """Load the compacted library file as a dict, without the journal."""
     if os.path.exists(library_path):
+        if is_binary_library(library_path):
+            return library_table_to_dict(read_binary_library(library_path))
         with open(library_path, 'r') as f:
             return json.load(f)
     return {}
 
 
-def save_entry_to_library(library_path, label, wavelengths, pixel_data):
+def _write_base(library_path, library):
     """
-    Save a pixel spectrum entry to the spectral library.
+    Atomically replace the compacted library file: the new content is
+    written and synced to a temporary file that is then renamed over it.
+    """
+    binary = is_binary_library(library_path)
+    temp_path = library_path + '.tmp'
+    if binary:
+        if isinstance(library, dict):
+            library = library_table_from_dict(library)
+        write_binary_library(temp_path, library)
+    else:
+        if isinstance(library, LibraryTable):
+            library = library_table_to_dict(library)
+        with open(temp_path, 'w') as f:
+            json.dump(library, f, indent=4)
+
+    with open(temp_path, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(temp_path, library_path)
+
+
+# Append-only journal of changes made since the last compaction, stored
+# next to the library as one JSON record per line:
+#   {"op": "put", "label": ..., "entry": {...}} or {"op": "delete", "label": ...}
+JOURNAL_SUFFIX = '.journal'
+
+# Journal size that triggers a background compaction
+COMPACT_JOURNAL_BYTES = 1 << 20
+
+_locks = {}
+_locks_guard = threading.Lock()
+_compacting = set()
+
+
+def journal_path(library_path):
+    """Path of the append-only journal that belongs to a library."""
+    return library_path + JOURNAL_SUFFIX
+
+
+def _file_identity(path):
+    """(device, inode, size, mtime_ns) of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _library_lock(library_path):
+    key = os.path.abspath(library_path)
+    with _locks_guard:
+        return _locks.setdefault(key, threading.RLock())
+
+
+def _read_journal(library_path, end=None):
+    """
+    Read journal records, up to byte offset end. A torn last line left by an
+    interrupted write is ignored.
+    """
+    try:
+        with open(journal_path(library_path), 'rb') as f:
+            data = f.read() if end is None else f.read(end)
+    except FileNotFoundError:
+        return []
+
+    records = []
+    for line in data.splitlines():
+        try:
+            records.append(json.loads(line.decode('utf-8')))
+        except ValueError:
+            continue
+    return records
+
+
+def _replay(records):
+    """Reduce journal records to label -> entry (None = deleted), in order."""
+    changes = {}
+    for record in records:
+        changes[record['label']] = record['entry'] if record['op'] == 'put' else None
+    return changes
+
+
+def _apply_changes_to_dict(library, changes):
+    for label, entry in changes.items():
+        if entry is None:
+            library.pop(label, None)
+        else:
+            library[label] = entry
+    return library
+
+
+def _apply_changes_to_table(table, changes):
+    """
+    Apply journal changes to a LibraryTable with the same ordering as a dict
+    update: replaced entries keep their row, new entries are appended.
+    """
+    if not changes:
+        return table
+
+    updates = library_table_from_dict({label: entry for label, entry in changes.items()
+                                       if entry is not None})
+    update_row = {label: i for i, label in enumerate(updates.labels)}
+    base_labels = set(table.labels)
+
+    # (source table, row) for every row of the merged table
+    rows = []
+    for i, label in enumerate(table.labels):
+        if label not in changes:
+            rows.append((table, i, label))
+        elif changes[label] is not None:
+            rows.append((updates, update_row[label], label))
+    rows.extend((updates, update_row[label], label) for label in updates.labels
+                if label not in base_labels)
+
+    wavelengths = np.union1d(table.wavelengths, updates.wavelengths)
+    dtype = np.result_type(np.asarray(table.spectra).dtype, updates.spectra.dtype)
+    spectra = np.full((len(rows), len(wavelengths)), np.nan, dtype=dtype)
+    for source in (table, updates):
+        positions = [i for i, (src, _, _) in enumerate(rows) if src is source]
+        if positions and len(source.wavelengths):
+            columns = np.searchsorted(wavelengths, source.wavelengths)
+            source_rows = [rows[i][1] for i in positions]
+            spectra[np.ix_(positions, columns)] = np.asarray(source.spectra)[source_rows]
+
+    return LibraryTable(
+        wavelengths,
+        spectra,
+        [label for _, _, label in rows],
+        [src.entries[i] for src, i, _ in rows],
+        table.integer_values and updates.integer_values
+    )
+
+
+@timed('library.journal_append')
+def _append_journal(library_path, record):
+    """Durably append one record to the journal and compact it if it grew large."""
+    line = (json.dumps(record) + '\n').encode('utf-8')
+    with _library_lock(library_path):
+        with open(journal_path(library_path), 'ab+') as f:
+            # Start on a fresh line if an earlier write was cut short
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    line = b'\n' + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+
+    if size >= COMPACT_JOURNAL_BYTES:
+        compact_library_in_background(library_path)
+
+
+@timed('library.compact')
+def compact_library(library_path):
+    """
+    Fold the journal into the library file.
+
+    The merged library is written to a temporary file and atomically renamed
+    over the old one; the journal is then cut down to the records appended
+    while compaction was running. A crash at any point leaves a library and
+    journal that still replay to the same content. If the library was
+    rewritten while the merge ran (e.g. by write_library), the merge is
+    stale and the compaction is skipped.
+
+    Parameters:
+    library_path (str): Path to the spectral library
+
+    Returns:
+    bool: True if the journal was folded into the library
+    """
+    lock = _library_lock(library_path)
+    path = journal_path(library_path)
+    with lock:
+        if not os.path.exists(path):
+            return False
+        end = os.path.getsize(path)
+        identities = (_file_identity(library_path), _file_identity(path))
+
+    # Merge outside the lock so saves are not blocked meanwhile
+    changes = _replay(_read_journal(library_path, end))
+    if is_binary_library(library_path):
+        merged = _apply_changes_to_table(_read_base_table(library_path, mmap=False), changes)
+    else:
+        merged = _apply_changes_to_dict(_load_base_library(library_path), changes)
+
+    with lock:
+        # Appends keep the journal's identity; anything else replaced the
+        # library or the journal under the merge
+        journal = _file_identity(path)
+        if (_file_identity(library_path) != identities[0] or journal is None
+                or journal[:2] != identities[1][:2] or journal[2] < end):
+            return False
+
+        _write_base(library_path, merged)
+
+        with open(path, 'rb') as f:
+            f.seek(end)
+            tail = f.read()
+        if tail:
+            temp_path = path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        else:
+            os.remove(path)
+    return True
+
+
+def compact_library_in_background(library_path):
+    """
+    Start compact_library on a daemon thread unless one is already running
+    for this library. A failed compaction is reported as a RuntimeWarning.
+
+    Parameters:
+    library_path (str): Path to the spectral library
+
+    Returns:
+    threading.Thread: The compaction thread, or None if one was running
+    """
+    key = os.path.abspath(library_path)
+    with _locks_guard:
+        if key in _compacting:
+            return None
+        _compacting.add(key)
+
+    def run():
+        try:
+            compact_library(library_path)
+        except Exception as e:
+            # The journal is left in place, so nothing is lost; the next
+            # save past the threshold tries again
+            warnings.warn(f"Library compaction failed: {e}", RuntimeWarning)
+        finally:
+            with _locks_guard:
+                _compacting.discard(key)
+
+    thread = threading.Thread(target=run, name="library-compaction", daemon=True)
+    thread.start()
+    return thread
+
+
+def library_signature(library_path):
+    """
+    Cheap fingerprint of a library and its journal, which changes whenever
+    an entry is saved, deleted or compacted.
+
+    Parameters:
+    library_path (str): Path to the spectral library
+
+    Returns:
+    tuple: (mtime_ns, size) of the library file and of its journal
+    """
+    signature = []
+    for path in (library_path, journal_path(library_path)):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+@timed('library.read')
+def read_library_table(library_path, mmap=True):
+    """
+    Load a spectral library of either format as a LibraryTable, merged with
+    any journaled changes.
+
+    Parameters:
+    library_path (str): Path to a JSON or binary spectral library
+    mmap (bool): Memory-map the spectra of binary libraries
+
+    Returns:
+    LibraryTable: Loaded library (empty if the file does not exist)
+    """
+    with _library_lock(library_path):
+        table = _read_base_table(library_path, mmap)
+        records = _read_journal(library_path)
+    return _apply_changes_to_table(table, _replay(records))
+
+
+@timed('library.write')
+def write_library(library_path, library):
+    """
+    Write a whole library, in the format given by the path, replacing the
+    file atomically and discarding any journal.
+
+    Parameters:
+    library_path (str): Output path (*.slib for binary, otherwise JSON)
+    library (dict or LibraryTable): Library to write
+    """
+    with _library_lock(library_path):
+        _write_base(library_path, library)
+        if os.path.exists(journal_path(library_path)):
+            os.remove(journal_path(library_path))
+
+
+def convert_library(source_path, destination_path):
+    """
+    Convert a spectral library between the JSON and binary formats.
+
+    The conversion is lossless: labels, every entry field and all spectrum
+    values are preserved.
+
+    Parameters:
+    source_path (str): Existing JSON or binary library
+    destination_path (str): Output path (*.slib for binary, otherwise JSON)
+    """
+    write_library(destination_path, read_library_table(source_path, mmap=False))
+
+
+@timed('library.load')
+def load_library(library_path):
+    """
+    Load existing spectral library from the given path or create a new one.
+
+    Parameters:
+    library_path (str): Path to the spectral library (JSON or binary)
+
+    Returns:
+    dict: Loaded spectral library, including journaled changes
+    """
+    with _library_lock(library_path):
+        library = _load_base_library(library_path)
+        records = _read_journal(library_path)
+    return _apply_changes_to_dict(library, _replay(records))
+
+
+def _spectrum_dict(wavelengths, values):
+    """Spectrum in the JSON schema; integral values (pixel DNs) stay integers."""
+    return {
+        str(int(w)): int(v) if float(v).is_integer() else float(v)
+        for w, v in zip(wavelengths, values)
+    }
+
+
+def make_library_entry(label, wavelengths, pixel_data, statistics=None, **fields):
+    """
+    Build a library entry in the JSON schema from a pixel spectrum.
 
     Parameters:
-    library_path (str): Path to the spectral library JSON file
     label (str): Label for the library entry
     wavelengths (list): List of wavelengths
-    pixel_data (list): Corresponding radiance data
+    pixel_data (list): Corresponding radiance data (e.g. a region mean)
+    statistics (dict): Optional name -> per-band spectrum (e.g. 'std', 'p95'),
+        stored under the entry's 'statistics'
+    **fields: Further entry fields, e.g. pixel_count
+
+    Returns:
+    dict: Library entry
     """
-    # Load existing library
-    library = load_library(library_path)
-    
-    # Create library entry
     entry = {
         "label": label,
-        "spectrum": dict(zip([int(w) for w in wavelengths], [int(p) for p in pixel_data]))
+        "spectrum": _spectrum_dict(wavelengths, pixel_data)
     }
-    
-    # Add to library
-    library[label] = entry
-    
-    # Save updated library
-    with open(library_path, 'w') as f:
-        json.dump(library, f, indent=4)
+    if statistics:
+        entry["statistics"] = {name: _spectrum_dict(wavelengths, values)
+                               for name, values in statistics.items()}
+    entry.update(fields)
+    return entry
+
+
+def save_entry_to_library(library_path, label, wavelengths, pixel_data, statistics=None, **fields):
+    """
+    Save a pixel spectrum entry to the spectral library.
+
+    The entry is appended to the library's journal, so saving costs the
+    same regardless of library size; the journal is folded into the
+    library file by a background compaction once it grows large.
+
+    Parameters:
+    library_path (str): Path to the spectral library (JSON or binary)
+    label (str): Label for the library entry
+    wavelengths (list): List of wavelengths
+    pixel_data (list): Corresponding radiance data
+    statistics (dict): Optional per-band statistics (see make_library_entry)
+    **fields: Further entry fields, e.g. pixel_count
+    """
+    # Create library entry
+    entry = make_library_entry(label, wavelengths, pixel_data, statistics, **fields)
+
+    _append_journal(library_path, {"op": "put", "label": label, "entry": entry})
 
     print(f"Saved entry: {label}")
 
 
+def save_entries_to_library(library_path, entries):
+    """
+    Add many entries to the spectral library at once.
+
+    The library and its journal are merged with the new entries and
+    written back as a whole, replacing entries with the same label.
+
+    Parameters:
+    library_path (str): Path to the spectral library (JSON or binary)
+    entries (dict): Label -> library entry (see make_library_entry)
+    """
+    with _library_lock(library_path):
+        library = load_library(library_path)
+        library.update(entries)
+        write_library(library_path, library)
+
+    print(f"Saved {len(entries)} entries")
+
+
+def delete_entry_from_library(library_path, label):
+    """
+    Delete an entry from the spectral library.
+
+    Parameters:
+    library_path (str): Path to the spectral library (JSON or binary)
+    label (str): Label of the entry to delete
+    """
+    _append_journal(library_path, {"op": "delete", "label": label})
+
+
 def view_library(library_path):
     """
     Load and return the spectral library for visualization.
-    
+
     Parameters:
-    library_path (str): Path to the spectral library JSON file
-    
+    library_path (str): Path to the spectral library (JSON or binary)
+
     Returns:
     dict: Spectral library data
     """
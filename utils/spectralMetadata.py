@@ -0,0 +1,129 @@
+import numpy as np
+
+# Wavelengths (nm) of the default FCC red, green and blue bands; on the
+# Salinas sensor these are bands 33, 16 and 7
+DEFAULT_RGB_WAVELENGTHS = (685.0, 522.5, 437.0)
+
+
+class SpectralMetadata:
+    """
+    Parsed and validated cube metadata.
+
+    Built once from the metadata JSON and shared by every extraction,
+    plotting and FCC call. Item access (metadata["band_to_wavelength"])
+    still reads the original dict, so code written against the raw
+    metadata keeps working.
+
+    Attributes:
+    raw (dict): Metadata as loaded from JSON
+    wavelengths (ndarray): Wavelength (nm) of each band, in band order
+    band_mask (ndarray): True for usable bands, False for listed bad bands
+    """
+
+    def __init__(self, metadata):
+        if "band_to_wavelength" not in metadata:
+            raise ValueError("Metadata has no 'band_to_wavelength' table")
+        table = metadata["band_to_wavelength"]
+
+        n_bands = len(table)
+        missing = [band for band in range(1, n_bands + 1) if str(band) not in table]
+        if missing:
+            raise ValueError(f"Metadata is missing bands {missing[:5]} of 1..{n_bands}")
+
+        self.raw = metadata
+        self.wavelengths = np.array([float(table[str(band)][1]) for band in range(1, n_bands + 1)])
+        if not np.all(np.isfinite(self.wavelengths)):
+            raise ValueError("Metadata wavelengths must be finite numbers")
+
+        self.band_mask = np.ones(n_bands, dtype=bool)
+        bad_bands = np.asarray(metadata.get("bad_bands", []), dtype=np.intp)
+        if bad_bands.size and (bad_bands.min() < 1 or bad_bands.max() > n_bands):
+            raise ValueError(f"Bad band numbers must lie in 1..{n_bands}")
+        self.band_mask[bad_bands - 1] = False
+
+        # Sorted view for nearest-band lookups
+        self._order = np.argsort(self.wavelengths, kind='stable')
+        self._sorted = self.wavelengths[self._order]
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+    def __contains__(self, key):
+        return key in self.raw
+
+    def get(self, key, default=None):
+        return self.raw.get(key, default)
+
+    @property
+    def n_bands(self):
+        return len(self.wavelengths)
+
+    def check_cube(self, image_data):
+        """
+        Make sure the metadata describes every band of the cube.
+
+        Parameters:
+        image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+        """
+        if image_data.shape[2] > self.n_bands:
+            raise ValueError(
+                f"Metadata describes {self.n_bands} bands but the cube has {image_data.shape[2]}"
+            )
+
+    def nearest_band(self, wavelength, valid_only=True, n_bands=None):
+        """
+        Find the band closest to a wavelength by binary search.
+
+        Parameters:
+        wavelength (float): Wavelength in nm
+        valid_only (bool): Skip bands flagged as bad
+        n_bands (int): Only search the first n_bands bands, e.g. the bands
+            of a cube that holds a leading subset of the metadata's bands
+
+        Returns:
+        int: Zero-based band index
+        """
+        order, sorted_wavelengths = self._order, self._sorted
+        keep = None
+        if valid_only and not self.band_mask.all():
+            keep = self.band_mask[order]
+        if n_bands is not None and n_bands < self.n_bands:
+            in_cube = order < n_bands
+            keep = in_cube if keep is None else keep & in_cube
+        if keep is not None:
+            order, sorted_wavelengths = order[keep], sorted_wavelengths[keep]
+        if len(order) == 0:
+            raise ValueError("No valid bands in metadata")
+
+        i = int(np.searchsorted(sorted_wavelengths, wavelength))
+        candidates = [j for j in (i - 1, i) if 0 <= j < len(order)]
+        best = min(candidates, key=lambda j: abs(sorted_wavelengths[j] - wavelength))
+        return int(order[best])
+
+    def rgb_bands(self, wavelengths=DEFAULT_RGB_WAVELENGTHS, n_bands=None):
+        """
+        Pick the red, green and blue bands for an FCC by wavelength.
+
+        Parameters:
+        wavelengths (tuple): Target (red, green, blue) wavelengths in nm
+        n_bands (int): Number of bands in the cube (all metadata bands if None)
+
+        Returns:
+        tuple: Zero-based (red, green, blue) band indices
+        """
+        return tuple(self.nearest_band(w, n_bands=n_bands) for w in wavelengths)
+
+
+def as_metadata(metadata):
+    """
+    Return metadata as a SpectralMetadata, parsing it only if needed.
+
+    Parameters:
+    metadata (dict or SpectralMetadata): Raw or parsed metadata
+
+    Returns:
+    SpectralMetadata: Parsed metadata
+    """
+    if isinstance(metadata, SpectralMetadata):
+        return metadata
+    return SpectralMetadata(metadata)
@@ -0,0 +1,102 @@
+import numpy as np
+
+
+class SpectrumSelection:
+    """
+    Growable buffer of selected pixels and their spectra.
+
+    Spectra live in one preallocated (capacity, bands) array that doubles
+    when full, so adding a pixel is a row copy and plotting a selection of
+    any size reads a single contiguous block.
+
+    Attributes:
+    n_bands (int): Number of bands per spectrum
+    """
+
+    def __init__(self, n_bands, capacity=64, dtype=np.float32):
+        self.n_bands = n_bands
+        self._pixels = np.empty((capacity, 2), dtype=np.intp)
+        self._spectra = np.empty((capacity, n_bands), dtype=dtype)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def pixels(self):
+        """(n, 2) view of the selected (row, col) coordinates."""
+        return self._pixels[:self._count]
+
+    @property
+    def spectra(self):
+        """(n, bands) view of the selected spectra."""
+        return self._spectra[:self._count]
+
+    def _reserve(self, count):
+        if count <= len(self._spectra):
+            return
+        capacity = max(count, 2 * len(self._spectra))
+        pixels = np.empty((capacity, 2), dtype=self._pixels.dtype)
+        spectra = np.empty((capacity, self.n_bands), dtype=self._spectra.dtype)
+        pixels[:self._count] = self.pixels
+        spectra[:self._count] = self.spectra
+        self._pixels, self._spectra = pixels, spectra
+
+    def extend(self, pixels, spectra):
+        """
+        Append several pixels and their spectra.
+
+        Parameters:
+        pixels (array-like): (n, 2) (row, col) coordinates
+        spectra (array-like): (n, bands) spectra
+        """
+        pixels = np.asarray(pixels, dtype=np.intp).reshape(-1, 2)
+        self._reserve(self._count + len(pixels))
+        stop = self._count + len(pixels)
+        self._pixels[self._count:stop] = pixels
+        self._spectra[self._count:stop] = spectra
+        self._count = stop
+
+    def append(self, pixel, spectrum):
+        self.extend([pixel], [spectrum])
+
+    def pop(self):
+        """Drop the most recently added pixel."""
+        if self._count:
+            self._count -= 1
+
+    def clear(self):
+        self._count = 0
+
+
+def read_pixel_spectra(image_data, pixels):
+    """
+    Read the spectra of many pixels with one fancy-indexed read.
+
+    Parameters:
+    image_data (ndarray): Hyperspectral image data cube (rows, cols, bands)
+    pixels (array-like): (n, 2) (row, col) coordinates
+
+    Returns:
+    ndarray: (n, bands) spectra
+    """
+    pixels = np.asarray(pixels, dtype=np.intp).reshape(-1, 2)
+    return image_data[pixels[:, 0], pixels[:, 1], :]
+
+
+def transect_pixels(start, end):
+    """
+    Pixels on the straight line between two pixels, both ends included.
+
+    Parameters:
+    start (tuple): (row, col) of the first pixel
+    end (tuple): (row, col) of the last pixel
+
+    Returns:
+    ndarray: (n, 2) (row, col) coordinates, one per step along the longer axis
+    """
+    (r0, c0), (r1, c1) = start, end
+    n = max(abs(r1 - r0), abs(c1 - c0)) + 1
+    rows = np.rint(np.linspace(r0, r1, n)).astype(np.intp)
+    cols = np.rint(np.linspace(c0, c1, n)).astype(np.intp)
+    return np.stack((rows, cols), axis=1)